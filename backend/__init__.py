@@ -1,17 +1,60 @@
 from .asset import Asset
-from .correlation import validate_correlation_matrix, sample_mixture_of_normals, sample_correlated_assets
-from .risk import portfolio_returns, calculate_cvar, calculate_sharpe, calculate_var
-from .optimisation import optimize_portfolio_grid, optimize_portfolio_continuous
+from .ppf import QuantileTable
+from .correlation import (
+    AssetUniverse,
+    FactorCorrelation,
+    validate_correlation_matrix,
+    sample_mixture_of_normals,
+    sample_correlated_assets,
+    sample_tail_weighted,
+)
+from .risk import (
+    portfolio_returns,
+    portfolio_moments,
+    calculate_cvar,
+    calculate_sharpe,
+    calculate_var,
+    tail_risk,
+    replicate_estimates,
+)
+from .scenarios import (
+    ScenarioCache,
+    ScenarioStore,
+    SCENARIO_CACHE,
+    generate_scenarios,
+    get_scenarios,
+    sample_replicates,
+)
+from .optimisation import optimize_portfolio_grid, optimize_frontier_grid, optimize_portfolio_continuous
+from .crossval import cross_validate, cross_validate_grid
+from .results import GridResults
 
 __all__ = [
     'Asset',
+    'QuantileTable',
+    'FactorCorrelation',
+    'AssetUniverse',
     'validate_correlation_matrix',
     'sample_mixture_of_normals',
     'sample_correlated_assets',
+    'sample_tail_weighted',
     'portfolio_returns',
+    'portfolio_moments',
     'calculate_cvar',
     'calculate_var',
     'calculate_sharpe',
+    'tail_risk',
+    'replicate_estimates',
+    'ScenarioCache',
+    'ScenarioStore',
+    'SCENARIO_CACHE',
+    'generate_scenarios',
+    'get_scenarios',
+    'sample_replicates',
     'optimize_portfolio_grid',
+    'optimize_frontier_grid',
     'optimize_portfolio_continuous',
+    'cross_validate',
+    'cross_validate_grid',
+    'GridResults',
 ]
\ No newline at end of file
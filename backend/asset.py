@@ -1,5 +1,6 @@
 import numpy as np
 from .correlation import sample_mixture_of_normals
+from .ppf import QuantileTable
 
 
 class Asset:
@@ -22,14 +23,27 @@ class Asset:
         if not np.isclose(self.weights.sum(), 1.0):
             raise ValueError(f"Weights must sum to 1, got {self.weights.sum()}")
 
-    def sample(self, n_samples):
-        """Generate return samples for this asset."""
-        return sample_mixture_of_normals(self.weights, self.means, self.stds, n_samples)
+        self._quantile_tables = {}
+
+    def sample(self, n_samples, rng=None):
+        """Generate return samples for this asset, from rng if given (a np.random.Generator)."""
+        return sample_mixture_of_normals(self.weights, self.means, self.stds, n_samples, rng=rng)
+
+    def quantile_table(self, tol=1e-6):
+        """Interpolated inverse CDF, built on first use and cached per tolerance."""
+        if tol not in self._quantile_tables:
+            self._quantile_tables[tol] = QuantileTable(self.weights, self.means, self.stds, tol=tol)
+        return self._quantile_tables[tol]
 
     def expected_return(self):
         """Analytical expected return."""
         return np.sum(self.weights * self.means)
 
+    def volatility(self):
+        """Analytical standard deviation."""
+        second_moment = np.sum(self.weights * (self.stds**2 + self.means**2))
+        return np.sqrt(second_moment - self.expected_return()**2)
+
     def __repr__(self):
         return f"Asset({self.name}, E[r]={self.expected_return():.2%})"
 
@@ -1,16 +1,136 @@
+import warnings
+
 import numpy as np
 from scipy import stats
-from scipy.optimize import brentq
-from tqdm import tqdm
+from scipy.stats import qmc
+
+from .metrics import count, timed
+from .ppf import mixture_cdf, mixture_ppf_vectorized
+
+
+# Scenario precisions: float32 halves the memory and bandwidth of scenario
+# matrices (see evaluation.evaluate_portfolios for the error bounds)
+SCENARIO_DTYPES = ('float64', 'float32')
+
+
+def scenario_dtype(dtype):
+    """Name of a scenario precision, checked against SCENARIO_DTYPES."""
+    name = np.dtype(dtype).name
+    if name not in SCENARIO_DTYPES:
+        raise ValueError(f"Unknown scenario dtype: {dtype}")
+    return name
+
+
+class FactorCorrelation:
+    """
+    Correlation matrix with a factor structure, C = B B^T + diag(d).
+
+    Each asset's latent normal is Z_i = B_i . F + sqrt(d_i) e_i, with k
+    common factors F and an independent term e_i, so validating and
+    sampling cost O(n k) per scenario instead of the O(n^2) of a dense
+    Cholesky factor. It can be passed wherever a correlation matrix is
+    accepted.
+    """
+
+    def __init__(self, loadings, idiosyncratic=None):
+        """
+        Args:
+            loadings: factor loadings B, of shape (n_assets, n_factors)
+            idiosyncratic: variances d of the assets' independent terms
+                (default: 1 - |B_i|^2, which gives a unit diagonal)
+        """
+        self.loadings = np.array(loadings, dtype=float)
+        if self.loadings.ndim != 2:
+            raise ValueError("Factor loadings must be a 2D (assets x factors) array")
+        if idiosyncratic is None:
+            idiosyncratic = 1 - np.sum(self.loadings ** 2, axis=1)
+        self.idiosyncratic = np.array(idiosyncratic, dtype=float)
+        self._validation = None
+        self._idiosyncratic_std = None
+
+    @property
+    def n_assets(self):
+        return self.loadings.shape[0]
+
+    @property
+    def n_factors(self):
+        return self.loadings.shape[1]
+
+    def validate(self):
+        """
+        Check that the factors describe a correlation matrix (cached).
+
+        Returns:
+            (is_valid, message)
+        """
+        if self._validation is None:
+            self._validation = self._check()
+        return self._validation
+
+    def _check(self):
+        if self.idiosyncratic.shape != (self.n_assets,):
+            return False, "Need one idiosyncratic variance per asset"
+        if not (np.all(np.isfinite(self.loadings)) and np.all(np.isfinite(self.idiosyncratic))):
+            return False, "Factor loadings and idiosyncratic variances must be finite"
+        if np.any(self.idiosyncratic < -1e-10):
+            asset = int(np.argmin(self.idiosyncratic))
+            return False, f"Factor loadings of asset {asset} explain more than all of its variance"
+        # Diagonal of B B^T + diag(d); the matrix is PSD by construction
+        if not np.allclose(np.sum(self.loadings ** 2, axis=1) + self.idiosyncratic, 1.0):
+            return False, "Diagonal elements must be 1"
+        return True, "Valid factor correlation model"
+
+    def to_dense(self):
+        """The full correlation matrix, of shape (n_assets, n_assets)."""
+        return self.loadings @ self.loadings.T + np.diag(self.idiosyncratic)
+
+    # Copula factor interface (see AssetUniverse.factor): latent draws u are the
+    # factors followed by the independent terms
+
+    @property
+    def n_latent(self):
+        return self.n_factors + self.n_assets
+
+    def _std(self):
+        if self._idiosyncratic_std is None:
+            self._idiosyncratic_std = np.sqrt(np.clip(self.idiosyncratic, 0, None))
+        return self._idiosyncratic_std
+
+    def correlate(self, u):
+        """Correlated normals Z from latent draws u of shape (n_samples, n_latent)."""
+        k = self.n_factors
+        return u[:, :k] @ self.loadings.T + u[:, k:] * self._std()
+
+    def latent_direction(self, v):
+        """A^T v for the latent-to-correlated map Z = A u."""
+        return np.concatenate([self.loadings.T @ v, self._std() * v])
+
+
+class _CholeskyFactor:
+    """Copula factor of a dense correlation matrix, Z = L u."""
+
+    def __init__(self, L):
+        self.L = L
+        self.n_latent = L.shape[1]
+
+    def correlate(self, u):
+        return u @ self.L.T
+
+    def latent_direction(self, v):
+        return self.L.T @ v
 
 
 def validate_correlation_matrix(corr_matrix):
     """
     Check if a correlation matrix is valid (positive semi-definite).
 
+    Accepts a dense matrix or a FactorCorrelation.
+
     Returns:
         (is_valid, message)
     """
+    if isinstance(corr_matrix, FactorCorrelation):
+        return corr_matrix.validate()
     corr = np.array(corr_matrix)
 
     # Check square
@@ -37,7 +157,7 @@ def validate_correlation_matrix(corr_matrix):
     return True, "Valid correlation matrix"
 
 
-def sample_mixture_of_normals(weights, means, stds, n_samples):
+def sample_mixture_of_normals(weights, means, stds, n_samples, rng=None):
     """
     Sample from a mixture of normal distributions.
 
@@ -46,6 +166,8 @@ def sample_mixture_of_normals(weights, means, stds, n_samples):
         means: array of component means
         stds: array of component standard deviations
         n_samples: number of samples to draw
+        rng: np.random.Generator to draw from (default: the global
+            np.random state)
 
     Returns:
         array of samples
@@ -53,71 +175,271 @@ def sample_mixture_of_normals(weights, means, stds, n_samples):
     weights = np.array(weights)
     means = np.array(means)
     stds = np.array(stds)
+    rng = np.random if rng is None else rng
 
     # Choose which component each sample comes from
-    components = np.random.choice(len(weights), size=n_samples, p=weights)
+    components = rng.choice(len(weights), size=n_samples, p=weights)
 
     # Sample from the chosen component
-    samples = np.random.normal(means[components], stds[components])
+    samples = rng.normal(means[components], stds[components])
 
     return samples
 
 
-def mixture_cdf(x, weights, means, stds):
-    """CDF of a mixture of normals."""
-    cdf = 0.0
-    for w, mu, sigma in zip(weights, means, stds):
-        cdf += w * stats.norm.cdf(x, mu, sigma)
-    return cdf
+def standard_normals(n_samples, n_dims, sampler='random', rng=None):
+    """
+    Independent standard normal draws, pseudo-random or quasi-random.
 
+    With sampler='sobol', the points are a scrambled Sobol sequence mapped
+    through the normal inverse CDF: randomized quasi-Monte Carlo, which
+    covers the space far more evenly than pseudo-random points, so
+    estimates converge faster in n_samples. Sample sizes that are powers of
+    two keep the sequence balanced.
 
-def mixture_ppf_vectorized(q_array, weights, means, stds, desc=None):
-    """Vectorized inverse CDF for an array of quantiles."""
+    Args:
+        n_samples: number of draws
+        n_dims: dimension of each draw
+        sampler: 'random' or 'sobol'
+        rng: np.random.Generator for the draws or the scrambling (default:
+            the global np.random state)
 
-    overall_mean = np.sum(weights * means)
-    overall_std = np.sqrt(np.sum(weights * (stds**2 + means**2)) - overall_mean**2)
-    low = overall_mean - 10 * overall_std
-    high = overall_mean + 10 * overall_std
+    Returns:
+        array of shape (n_samples, n_dims)
+    """
+    if sampler == 'random':
+        rng = np.random if rng is None else rng
+        return rng.standard_normal((n_samples, n_dims))
+    if sampler != 'sobol':
+        raise ValueError(f"Unknown sampler: {sampler}")
 
-    results = np.zeros_like(q_array)
-    for i, q in tqdm(enumerate(q_array), total=len(q_array), desc=desc, leave=False):
-        # Handle edge cases
-        q = np.clip(q, 1e-10, 1 - 1e-10)
-        def objective(x):
-            return mixture_cdf(x, weights, means, stds) - q
-        results[i] = brentq(objective, low, high)
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(2**31))
+    sobol = qmc.Sobol(d=n_dims, scramble=True, seed=rng)
+    with warnings.catch_warnings():
+        # Sobol warns when n_samples is not a power of two
+        warnings.simplefilter('ignore', UserWarning)
+        uniforms = sobol.random(n_samples)
+    # Scrambled points are never exactly 0, but guard the inverse CDF anyway
+    return stats.norm.ppf(np.clip(uniforms, 1e-16, 1 - 1e-16))
 
-    return results
 
+class AssetUniverse:
+    """
+    Assets and their copula correlation, prepared once for repeated sampling.
 
-def sample_correlated_assets(assets, corr_matrix, n_samples):
+    Holds every asset's mixture parameters in padded (n_assets,
+    max_components) arrays (padding has zero weight), their moments, the
+    validated correlation and, on first use, its factor and the assets'
+    quantile tables. It can be passed as the assets of any sampler,
+    scenario function or optimizer, with corr_matrix left as None, so a
+    problem is converted, validated and factorized once however many
+    times it is sampled.
+    """
+
+    def __init__(self, assets, corr_matrix):
+        """
+        Args:
+            assets: list of Asset objects
+            corr_matrix: correlation matrix, dense or a FactorCorrelation
+        """
+        self.assets = list(assets)
+        if isinstance(corr_matrix, FactorCorrelation):
+            self.corr_matrix = corr_matrix
+        else:
+            self.corr_matrix = np.array(corr_matrix, dtype=float)
+        with timed('validation'):
+            self.is_valid, self.validation_message = validate_correlation_matrix(self.corr_matrix)
+
+        n_components = max(len(asset.weights) for asset in self.assets)
+        shape = (len(self.assets), n_components)
+        self.weights = np.zeros(shape)
+        self.means = np.zeros(shape)
+        self.stds = np.ones(shape)
+        for i, asset in enumerate(self.assets):
+            k = len(asset.weights)
+            self.weights[i, :k] = asset.weights
+            self.means[i, :k] = asset.means
+            self.stds[i, :k] = asset.stds
+
+        self.expected_returns = np.sum(self.weights * self.means, axis=1)
+        second_moments = np.sum(self.weights * (self.stds**2 + self.means**2), axis=1)
+        self.volatilities = np.sqrt(second_moments - self.expected_returns**2)
+
+        self._factor = None
+        self._tables = {}
+
+    def __len__(self):
+        return len(self.assets)
+
+    def __iter__(self):
+        return iter(self.assets)
+
+    def __getitem__(self, index):
+        return self.assets[index]
+
+    @property
+    def factor(self):
+        """
+        Copula factor, computed on first use, warning if the matrix is invalid.
+
+        An object with n_latent, correlate(u) and latent_direction(v): a
+        FactorCorrelation is its own factor, a dense matrix gets a Cholesky
+        factor.
+        """
+        if self._factor is None:
+            if not self.is_valid:
+                print(f"WARNING: {self.validation_message}")
+            if isinstance(self.corr_matrix, FactorCorrelation):
+                self._factor = self.corr_matrix
+            else:
+                with timed('cholesky'):
+                    self._factor = _CholeskyFactor(np.linalg.cholesky(self.corr_matrix))
+        return self._factor
+
+    def quantile_tables(self, tol=1e-6):
+        """Every asset's QuantileTable at tolerance tol (built on first use)."""
+        if tol not in self._tables:
+            self._tables[tol] = [asset.quantile_table(tol) for asset in self.assets]
+        return self._tables[tol]
+
+    def returns_from_normals(self, correlated_normals, ppf_method='table', ppf_tol=1e-6,
+                             progress=None, dtype='float64'):
+        """
+        Map each column of correlated standard normals to its asset's distribution.
+
+        Returns are computed in float64 and stored as dtype.
+        """
+        n_samples, n_assets = correlated_normals.shape
+        count('scenarios', n_samples)
+        samples = np.zeros((n_samples, n_assets), dtype=dtype)
+        if ppf_method == 'table':
+            # One np.interp per column is faster than one search of all the
+            # tables stacked end to end
+            for i, table in enumerate(self.quantile_tables(ppf_tol)):
+                samples[:, i] = table.ppf_from_normal(correlated_normals[:, i])
+                if progress is not None:
+                    progress('sampling', (i + 1) / n_assets)
+            return samples
+
+        # Transform to uniform, then solve every column at once with the
+        # padded mixture parameters
+        uniforms = stats.norm.cdf(correlated_normals)
+        samples[:] = mixture_ppf_vectorized(uniforms, self.weights, self.means, self.stds,
+                                            progress=progress)
+        return samples
+
+    def sample(self, n_samples, rng=None, sampler='random', ppf_method='table', ppf_tol=1e-6,
+               progress=None, dtype='float64'):
+        """
+        Correlated return samples of all assets.
+
+        Args:
+            n_samples, rng, sampler, ppf_method, ppf_tol, progress, dtype: as
+                in sample_correlated_assets
+
+        Returns:
+            array of shape (n_samples, n_assets)
+        """
+        if ppf_method not in ('table', 'exact'):
+            raise ValueError(f"Unknown ppf_method: {ppf_method}")
+        dtype = scenario_dtype(dtype)
+
+        # Generate correlated standard normals
+        factor = self.factor
+        uncorrelated_normals = standard_normals(n_samples, factor.n_latent, sampler, rng)
+        correlated_normals = factor.correlate(uncorrelated_normals)
+
+        with timed('ppf'):
+            return self.returns_from_normals(correlated_normals, ppf_method, ppf_tol, progress,
+                                             dtype)
+
+
+def as_universe(assets, corr_matrix):
+    """assets if it already is an AssetUniverse, else a new one of assets and corr_matrix."""
+    if isinstance(assets, AssetUniverse):
+        return assets
+    return AssetUniverse(assets, corr_matrix)
+
+
+def sample_correlated_assets(assets, corr_matrix, n_samples, ppf_method='table', ppf_tol=1e-6,
+                             progress=None, rng=None, sampler='random', dtype='float64'):
     """
     Generate correlated return samples from multiple assets.
+
+    Args:
+        assets: list of Asset objects, or an AssetUniverse
+        corr_matrix: correlation matrix, dense or a FactorCorrelation (None
+            with an AssetUniverse)
+        n_samples: number of scenarios to generate
+        ppf_method: 'table' interpolates each asset's cached QuantileTable;
+            'exact' solves every sample with the batched root-finder
+        ppf_tol: maximum interpolation error of the quantile tables
+        progress: optional callback progress(stage, fraction) reporting the
+            'sampling' stage
+        rng: np.random.Generator to draw from (default: the global
+            np.random state)
+        sampler: 'random' for pseudo-random scenarios, 'sobol' for scrambled
+            Sobol points (see standard_normals)
+        dtype: 'float64' or 'float32' (one of SCENARIO_DTYPES); float32
+            samples are the float64 ones rounded to single precision
+
+    Returns:
+        array of shape (n_samples, n_assets)
     """
-    n_assets = len(assets)
-    corr = np.array(corr_matrix)
+    return as_universe(assets, corr_matrix).sample(n_samples, rng, sampler, ppf_method, ppf_tol,
+                                                   progress, dtype)
+
+
+def sample_tail_weighted(assets, corr_matrix, n_samples, tail_shift=1.5, tail_fraction=0.5,
+                         ppf_method='table', ppf_tol=1e-6, progress=None, rng=None,
+                         sampler='random', dtype='float64'):
+    """
+    Importance-sampled scenarios that oversample the joint lower tail.
+
+    A tail_fraction of the copula's latent normal draws is shifted by
+    tail_shift standard deviations towards the most likely way for the
+    assets to do badly together: the latent lower-tail design point of a
+    portfolio holding each asset in proportion to its volatility, which
+    puts the shift where most of the portfolio risk is. Each scenario
+    carries the likelihood ratio of the original copula to this defensive
+    mixture,
+
+        w = 1 / ((1 - f) + f * exp(s . u - |s|^2 / 2)),
+
+    so weighted statistics (see risk.tail_risk) are unbiased, the weights
+    never exceed 1 / (1 - f), and tail estimates are built from several
+    times more tail scenarios.
+
+    Args:
+        assets, corr_matrix, n_samples, ppf_method, ppf_tol, progress, rng,
+            sampler, dtype: as in sample_correlated_assets
+        tail_shift: length of the latent shift, in standard deviations
+        tail_fraction: fraction f of draws that are shifted, below 1
+
+    Returns:
+        (samples of shape (n_samples, n_assets), float64 likelihood-ratio
+        weights of shape (n_samples,))
+    """
+    if ppf_method not in ('table', 'exact'):
+        raise ValueError(f"Unknown ppf_method: {ppf_method}")
+    dtype = scenario_dtype(dtype)
+    if not 0 <= tail_fraction < 1:
+        raise ValueError(f"tail_fraction must be in [0, 1), got {tail_fraction}")
+
+    universe = as_universe(assets, corr_matrix)
+    factor = universe.factor
+    u = standard_normals(n_samples, factor.n_latent, sampler, rng)
+
+    # Latent Z = A u; the most likely Z with v . Z = t is along C v, i.e.
+    # u along A^T v
+    direction = factor.latent_direction(universe.volatilities)
+    shift = -tail_shift * direction / np.linalg.norm(direction)
+    shifted = (np.random if rng is None else rng).random(n_samples) < tail_fraction
+    u[shifted] += shift
 
-    is_valid, msg = validate_correlation_matrix(corr)
-    if not is_valid:
-        print(f"WARNING: {msg}")
-
-    # Generate correlated standard normals
-    L = np.linalg.cholesky(corr)
-    uncorrelated_normals = np.random.standard_normal((n_samples, n_assets))
-    correlated_normals = uncorrelated_normals @ L.T
-
-    # Transform to uniform
-    uniforms = stats.norm.cdf(correlated_normals)
-
-    # Transform each column to asset's distribution
-    samples = np.zeros((n_samples, n_assets))
-    for i, asset in enumerate(assets):
-        samples[:, i] = mixture_ppf_vectorized(
-            uniforms[:, i],
-            asset.weights,
-            asset.means,
-            asset.stds,
-            desc=f"Sampling {asset.name}"
-        )
-
-    return samples
\ No newline at end of file
+    weights = 1.0 / ((1 - tail_fraction)
+                     + tail_fraction * np.exp(u @ shift - 0.5 * shift @ shift))
+    with timed('ppf'):
+        samples = universe.returns_from_normals(factor.correlate(u), ppf_method, ppf_tol,
+                                                progress, dtype)
+    return samples, weights
@@ -0,0 +1,157 @@
+import json
+
+import numpy as np
+from scipy.optimize import nnls
+
+from .evaluation import DEFAULT_MEMORY_BUDGET, weight_block_size
+from .optimisation import _refinement_levels, count_weight_grid
+
+
+def _stage_features(stage, n_assets, n_samples, n_points=0):
+    """Work terms whose weighted sum predicts the seconds a stage takes."""
+    if stage == 'sampling':
+        # Quantile table per asset, then one interpolation per value
+        return [n_assets, n_samples * n_assets]
+    if stage == 'enumeration':
+        return [n_points * n_assets]
+    if stage == 'evaluation':
+        # Returns matrix product plus the per-portfolio moments and partition
+        return [n_points * n_samples * n_assets, n_points * n_samples]
+    if stage == 'continuous':
+        # SLSQP: iterations grow with the assets, each with a finite
+        # difference gradient over every scenario
+        return [n_samples * n_assets * (n_assets + 1)]
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+STAGES = ('sampling', 'enumeration', 'evaluation', 'continuous')
+
+# Seconds per unit of work, fitted by benchmarks/run_benchmarks.py on a
+# single core
+DEFAULT_COEFFICIENTS = {
+    'sampling': [1.9e-2, 3.8e-7],
+    'enumeration': [2.2e-7],
+    'evaluation': [1.8e-9, 1.1e-8],
+    'continuous': [2.2e-6],
+}
+
+
+class CostModel:
+    """
+    Predicted run time of the optimizer stages, linear in their work terms.
+
+    Used by strategy='auto' to choose between grid search and continuous
+    optimization; refit it from benchmark results with fit.
+    """
+
+    def __init__(self, coefficients=None):
+        self.coefficients = {stage: list(values) for stage, values in
+                             (coefficients or DEFAULT_COEFFICIENTS).items()}
+
+    @classmethod
+    def fit(cls, records):
+        """
+        Least-squares coefficients (non-negative) from benchmark records.
+
+        Args:
+            records: dicts with stage, n_assets, n_samples, n_points and
+                seconds, as written by the benchmark harness. Stages without
+                records keep their default coefficients.
+        """
+        coefficients = dict(DEFAULT_COEFFICIENTS)
+        for stage in STAGES:
+            rows = [r for r in records if r['stage'] == stage]
+            if not rows:
+                continue
+            X = np.array([_stage_features(stage, r['n_assets'], r['n_samples'], r.get('n_points', 0))
+                          for r in rows], dtype=float)
+            y = np.array([r['seconds'] for r in rows])
+            # Relative error matters, not absolute: scale every row by 1 / y
+            scale = 1.0 / np.maximum(y, 1e-6)
+            coefficients[stage] = nnls(X * scale[:, None], y * scale)[0].tolist()
+        return cls(coefficients)
+
+    @classmethod
+    def load(cls, path):
+        """Model from a JSON file holding coefficients, or a benchmark results file."""
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get('cost_model', data))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.coefficients, f, indent=2)
+
+    def predict(self, stage, n_assets, n_samples, n_points=0):
+        """Predicted seconds for one stage."""
+        features = _stage_features(stage, n_assets, n_samples, n_points)
+        return float(np.dot(self.coefficients[stage], features))
+
+    def predict_grid(self, n_assets, step, n_samples, asset_bounds=None, search='exhaustive',
+                     refine_top_k=5, coarse_points=5000):
+        """
+        Predicted seconds of a grid search, sampling included.
+
+        'exhaustive' evaluates every grid point. 'moments' enumerates the
+        grid and ranks it by moment Sharpe ratio (priced as an evaluation
+        against n_assets "scenarios", the size of the covariance), then
+        usually settles within its first two batches of scenario
+        evaluations. 'adaptive' evaluates the coarse grid plus a box of
+        candidates around 2 * refine_top_k points per finer level, as in
+        adaptive_grid_search; enumeration is priced per evaluated point.
+        Both estimates are rough, but of the right order, which is what
+        choosing a strategy needs.
+        """
+        sampling = self.predict('sampling', n_assets, n_samples)
+        n_points = count_weight_grid(n_assets, step, asset_bounds)
+        if search == 'exhaustive':
+            n_evaluated = n_enumerated = n_points
+            ranking = 0.0
+        elif search == 'moments':
+            n_enumerated = n_points
+            n_evaluated = min(n_points, 3 * weight_block_size(n_samples, DEFAULT_MEMORY_BUDGET))
+            ranking = self.predict('evaluation', n_assets, n_assets, n_points)
+        elif search == 'adaptive':
+            levels = _refinement_levels(n_assets, int(round(1 / step)), asset_bounds,
+                                        coarse_points)
+            n_evaluated = count_weight_grid(n_assets, 1 / levels[0], asset_bounds)
+            for coarse, fine in zip(levels, levels[1:]):
+                box = (2 * (fine // coarse) + 1) ** (n_assets - 1)
+                n_evaluated += min(count_weight_grid(n_assets, 1 / fine, asset_bounds),
+                                   2 * refine_top_k * box)
+            n_enumerated = n_evaluated
+            ranking = 0.0
+        else:
+            raise ValueError(f"Unknown search: {search}")
+        return (sampling + ranking
+                + self.predict('enumeration', n_assets, n_samples, n_enumerated)
+                + self.predict('evaluation', n_assets, n_samples, n_evaluated))
+
+    def predict_continuous(self, n_assets, n_samples, n_starts=1):
+        """
+        Predicted seconds of a continuous optimization, sampling included.
+
+        Every start is one more SLSQP solve; with several starts the coarse
+        grid and Dirichlet candidates choosing them are evaluated as well.
+        """
+        seconds = (self.predict('sampling', n_assets, n_samples)
+                   + n_starts * self.predict('continuous', n_assets, n_samples))
+        if n_starts > 1:
+            seconds += self.predict('evaluation', n_assets, n_samples, 2000 + 64 * n_starts)
+        return seconds
+
+    def choose_strategy(self, n_assets, step, n_samples, asset_bounds=None, time_budget=10.0,
+                        search='exhaustive', n_starts=1):
+        """
+        'grid' or 'continuous' for a problem and a time budget in seconds.
+
+        Grid search is preferred, since it finds the best grid point
+        whatever the shape of the problem, as long as it is predicted to
+        finish within the budget or no slower than continuous optimization.
+        search is the grid search that would run and n_starts the number of
+        continuous starts, as priced by predict_grid and predict_continuous.
+        """
+        grid = self.predict_grid(n_assets, step, n_samples, asset_bounds, search)
+        if grid <= time_budget or grid <= self.predict_continuous(n_assets, n_samples, n_starts):
+            return 'grid'
+        return 'continuous'
@@ -0,0 +1,232 @@
+import numpy as np
+
+from .evaluation import DEFAULT_MEMORY_BUDGET, best_feasible_index, weight_block_size
+from .optimisation import weight_grid_array
+from .parallel import map_grid_chunks
+from .scenarios import get_scenarios
+
+
+# Per-fold statistics computed for every portfolio, in output row order
+FOLD_METRICS = ('train_mean', 'train_std', 'train_cvar', 'test_mean', 'test_std', 'test_cvar')
+
+
+def fold_ids(n_samples, n_folds):
+    """
+    Test fold of every scenario: n_folds contiguous blocks of n_samples // n_folds.
+
+    Scenarios left over at the end belong to no test fold (-1), so they are
+    always part of the training set.
+    """
+    fold_size = n_samples // n_folds
+    ids = np.full(n_samples, -1)
+    ids[:fold_size * n_folds] = np.arange(fold_size * n_folds) // fold_size
+    return ids
+
+
+def _masked_tail_means(values, members, k, ret, columns):
+    """
+    Mean of the k smallest returns belonging to a subset, per portfolio.
+
+    Args:
+        values: (B, c) sorted candidate returns, the c smallest of each row
+        members: (B, c) mask of candidates that belong to the subset
+        k: tail size
+        ret: (B, n) full returns, for rows whose candidates run out
+        columns: mask of the subset's scenarios, used for those rows
+    """
+    if k == 0:
+        return np.full(len(values), np.nan)
+    rank = np.cumsum(members, axis=1)
+    total = np.where(members & (rank <= k), values, 0.0).sum(axis=1)
+    cvar = total / k
+
+    # The candidates hold fewer than k of the subset's returns only when
+    # the subset dominates the lower tail; select those rows directly
+    for row in np.flatnonzero(rank[:, -1] < k):
+        cvar[row] = np.partition(ret[row, columns], k - 1)[:k].mean()
+    return cvar
+
+
+def _fold_statistics(samples, weights, n_folds, cvar_alpha, memory_budget):
+    """
+    Train and test mean, std and CVaR of every portfolio for every fold.
+
+    Returns for a block of portfolios are computed once. Means and standard
+    deviations come from per-fold sums, with the training statistics as
+    whole-sample sums minus the fold. For the tails, the smallest returns of
+    each portfolio are selected and sorted once; each fold's train and test
+    tails are then the first k members of that candidate list, masked by
+    fold membership.
+
+    Returns:
+        (columns of shape (len(FOLD_METRICS) * n_folds, n_portfolios), None),
+        rows ordered metric-major as in FOLD_METRICS
+    """
+    n_samples = samples.shape[0]
+    n_portfolios = len(weights)
+    ids = fold_ids(n_samples, n_folds)
+    fold_size = n_samples // n_folds
+    n_train = n_samples - fold_size
+    k_test = int(fold_size * cvar_alpha)
+    k_train = int(n_train * cvar_alpha)
+
+    # Every train tail is among the k_train + fold_size smallest returns; in
+    # practice about twice the overall tail is plenty, with a fallback
+    # in _masked_tail_means for the rest
+    n_candidates = min(n_samples, 2 * int(n_samples * cvar_alpha) + 64)
+
+    out = np.empty((len(FOLD_METRICS), n_folds, n_portfolios))
+    block = weight_block_size(n_samples, memory_budget)
+    for start in range(0, n_portfolios, block):
+        stop = min(start + block, n_portfolios)
+        # Single-precision product for float32 scenarios, float64 statistics
+        ret = (weights[start:stop].astype(samples.dtype, copy=False) @ samples.T).astype(
+            float, copy=False)
+
+        # Shift by the full-sample mean before squaring to avoid cancellation
+        mean = ret.mean(axis=1)
+        dev = ret - mean[:, None]
+        total_dev = dev.sum(axis=1)
+        total_sq = np.einsum('ij,ij->i', dev, dev)
+
+        if n_candidates < n_samples:
+            idx = np.argpartition(ret, n_candidates - 1, axis=1)[:, :n_candidates]
+        else:
+            idx = np.broadcast_to(np.arange(n_samples), ret.shape)
+        values = np.take_along_axis(ret, idx, axis=1)
+        order = np.argsort(values, axis=1)
+        values = np.take_along_axis(values, order, axis=1)
+        candidate_folds = ids[np.take_along_axis(idx, order, axis=1)]
+
+        for fold in range(n_folds):
+            test_slice = slice(fold * fold_size, (fold + 1) * fold_size)
+            test_dev = dev[:, test_slice].sum(axis=1)
+            test_sq = np.einsum('ij,ij->i', dev[:, test_slice], dev[:, test_slice])
+
+            test_shift = test_dev / fold_size
+            train_shift = (total_dev - test_dev) / n_train
+            out[3, fold, start:stop] = mean + test_shift
+            out[4, fold, start:stop] = np.sqrt(np.maximum(test_sq / fold_size - test_shift**2, 0))
+            out[0, fold, start:stop] = mean + train_shift
+            out[1, fold, start:stop] = np.sqrt(
+                np.maximum((total_sq - test_sq) / n_train - train_shift**2, 0))
+
+            in_test = candidate_folds == fold
+            test_columns = ids == fold
+            out[5, fold, start:stop] = _masked_tail_means(values, in_test, k_test, ret, test_columns)
+            out[2, fold, start:stop] = _masked_tail_means(values, ~in_test, k_train, ret,
+                                                          ~test_columns)
+
+    return out.reshape(len(FOLD_METRICS) * n_folds, n_portfolios), None
+
+
+def cross_validate_grid(samples, weight_grid, n_folds=5, cvar_limit=-0.20, cvar_alpha=0.05,
+                        memory_budget=DEFAULT_MEMORY_BUDGET, n_workers=1, progress=None):
+    """
+    K-fold cross-validation of grid-search portfolio selection.
+
+    For each fold, the best feasible grid point is chosen on the training
+    scenarios (highest Sharpe with CVaR >= cvar_limit) and scored on the
+    held-out fold. All folds come from a single evaluation of the grid.
+
+    Args:
+        samples: 2D array of shape (n_samples, n_assets)
+        weight_grid: 2D array of shape (n_portfolios, n_assets)
+        n_folds: number of contiguous test folds
+        cvar_limit: minimum training CVaR of a selectable portfolio
+        cvar_alpha: CVaR tail probability
+        memory_budget: approximate bytes of scratch space per block
+        n_workers: number of processes evaluating the grid; None uses every
+            core
+        progress: optional callback progress(stage, fraction), reporting
+            the 'evaluation' stage
+
+    Returns:
+        dict with per-fold results and in-sample vs out-of-sample summary
+    """
+    weight_grid = np.asarray(weight_grid, dtype=float)
+    n_portfolios = len(weight_grid)
+    args = (n_folds, cvar_alpha, memory_budget)
+    if n_workers == 1:
+        columns, _ = _fold_statistics(samples, weight_grid, *args)
+        if progress is not None:
+            progress('evaluation', 1.0)
+    else:
+        columns, _ = map_grid_chunks(_fold_statistics, samples, weight_grid,
+                                     len(FOLD_METRICS) * n_folds,
+                                     weight_block_size(samples.shape[0], memory_budget),
+                                     args, n_workers, progress)
+    stats = dict(zip(FOLD_METRICS, columns.reshape(len(FOLD_METRICS), n_folds, n_portfolios)))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        train_sharpe = stats['train_mean'] / stats['train_std']
+        test_sharpe = stats['test_mean'] / stats['test_std']
+
+    results = []
+    for fold in range(n_folds):
+        best = best_feasible_index({'cvar': stats['train_cvar'][fold], 'sharpe': train_sharpe[fold]},
+                                   cvar_limit)
+        if best is None:
+            continue
+        results.append({
+            'fold': fold,
+            'weights': weight_grid[best].copy(),
+            'train_sharpe': train_sharpe[fold, best],
+            'test_sharpe': test_sharpe[fold, best],
+            'train_cvar': stats['train_cvar'][fold, best],
+            'test_cvar': stats['test_cvar'][fold, best],
+        })
+
+    train_sharpes = [r['train_sharpe'] for r in results]
+    test_sharpes = [r['test_sharpe'] for r in results]
+    return {
+        'fold_results': results,
+        'mean_train_sharpe': np.mean(train_sharpes) if results else np.nan,
+        'mean_test_sharpe': np.mean(test_sharpes) if results else np.nan,
+        'sharpe_degradation': np.mean(train_sharpes) - np.mean(test_sharpes) if results else np.nan,
+        'weight_stability': (np.std([r['weights'] for r in results], axis=0) if results
+                             else np.full(weight_grid.shape[1], np.nan)),
+        'n_portfolios': n_portfolios,
+    }
+
+
+def cross_validate(assets, corr_matrix, n_samples=10000, n_folds=5, cvar_limit=-0.20,
+                   cvar_alpha=0.05, step=0.10, asset_bounds=None,
+                   memory_budget=DEFAULT_MEMORY_BUDGET, seed=None, use_cache=True, store=None,
+                   n_workers=1, progress=None, sampler='random', dtype='float64'):
+    """
+    Detect overfitting of grid search via cross-validation.
+
+    Splits the scenarios into folds, optimizes on each training set and
+    evaluates on the held-out test set; see cross_validate_grid.
+
+    Args:
+        assets: list of Asset objects, or an AssetUniverse
+        corr_matrix: correlation matrix (None with an AssetUniverse)
+        n_samples: number of scenarios to generate
+        n_folds: number of folds
+        cvar_limit: maximum allowed CVaR
+        cvar_alpha: CVaR confidence level
+        step: grid step size for weights
+        asset_bounds: list of (min, max) tuples for each asset's weight bounds
+        memory_budget: approximate bytes of scratch space per block
+        seed: random seed for the scenarios; seeded scenarios are shared
+            with the optimizers through the scenario cache
+        use_cache: set to False to bypass the scenario cache
+        store: optional ScenarioStore, as in optimize_portfolio_grid
+        n_workers: number of processes evaluating the grid (and threads
+            sampling seeded scenarios)
+        progress: optional callback progress(stage, fraction), reporting
+            the 'sampling' and 'evaluation' stages
+        sampler: 'random' or 'sobol', as in optimize_portfolio_grid
+        dtype: 'float64' or 'float32' scenarios, as in optimize_portfolio_grid
+
+    Returns:
+        dict with in-sample and out-of-sample performance
+    """
+    samples = get_scenarios(assets, corr_matrix, n_samples, seed=seed, use_cache=use_cache,
+                            store=store, n_workers=n_workers, progress=progress, sampler=sampler,
+                            dtype=dtype)
+    weight_grid = weight_grid_array(len(assets), step, asset_bounds)
+    return cross_validate_grid(samples, weight_grid, n_folds, cvar_limit, cvar_alpha,
+                               memory_budget, n_workers, progress)
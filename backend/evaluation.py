@@ -0,0 +1,315 @@
+import numpy as np
+
+from .risk import chunked_portfolio_stats, portfolio_moments, scenario_moments, tail_risk
+
+
+# Default cap on the scratch memory used per block of portfolio returns.
+# Blocks that stay cache resident beat one huge matrix product.
+DEFAULT_MEMORY_BUDGET = 8 * 2**20
+
+
+def weight_block_size(n_samples, memory_budget=DEFAULT_MEMORY_BUDGET, itemsize=8):
+    """
+    Number of weight vectors to evaluate together within a memory budget.
+
+    Each block holds a (block, n_samples) matrix of portfolio returns plus a
+    partitioned copy of it for the tail statistics.
+    """
+    return max(1, int(memory_budget // (2 * n_samples * itemsize)))
+
+
+def _tail_size(n_samples, cvar_alpha):
+    """Smallest returns retained per portfolio when streaming (an upper bound)."""
+    return min(n_samples, int(n_samples * np.max(cvar_alpha)) + 2)
+
+
+def streaming_product_size(n_samples, cvar_alpha=0.05, memory_budget=DEFAULT_MEMORY_BUDGET,
+                           chunk_rows=65536):
+    """
+    Portfolios per matrix product when streaming memory-mapped scenarios.
+
+    Each product holds one chunk of returns per portfolio, merged with the
+    retained tail before it is partitioned.
+    """
+    return weight_block_size(min(n_samples, chunk_rows) + _tail_size(n_samples, cvar_alpha),
+                             memory_budget)
+
+
+def evaluation_block_size(samples, cvar_alpha=0.05, memory_budget=DEFAULT_MEMORY_BUDGET,
+                          chunk_rows=65536, weighted=False):
+    """
+    Number of portfolios evaluate_portfolios puts in one block.
+
+    Blocks always start at multiples of this size, so any split of the
+    portfolios on block boundaries reproduces the same arithmetic.
+    Weighted scenarios need room for the sort order and cumulative sums.
+    """
+    n_samples = samples.shape[0]
+    if weighted:
+        return weight_block_size(3 * n_samples, memory_budget)
+    if isinstance(samples, np.memmap):
+        # Every block makes one pass over the file, so the block is as large
+        # as the per-portfolio accumulators allow: the retained tail plus the
+        # moment sums. The returns of each chunk are computed in sub-blocks
+        # (see streaming_product_size).
+        return max(1, int(memory_budget // (8 * (_tail_size(n_samples, cvar_alpha) + 3))))
+    # Returns are computed in the precision of the scenarios
+    return weight_block_size(n_samples, memory_budget, samples.dtype.itemsize)
+
+
+def best_feasible_index(metrics, cvar_limit):
+    """
+    Index of the highest-Sharpe portfolio with CVaR >= cvar_limit, or None.
+
+    Ties go to the lowest index; portfolios with an undefined Sharpe ratio
+    are never chosen.
+    """
+    candidates = np.where((metrics['cvar'] >= cvar_limit) & (metrics['sharpe'] > -np.inf),
+                          metrics['sharpe'], -np.inf)
+    if not np.any(candidates > -np.inf):
+        return None
+    return int(np.argmax(candidates))
+
+
+def frontier_indices(metrics, cvar_limits, objective='sharpe'):
+    """
+    best_feasible_index for many CVaR limits at once.
+
+    Portfolios are sorted by CVaR, least negative first, so the feasible
+    set of every limit is a prefix of that order. A running minimum of
+    objective ranks along it gives the best portfolio of every prefix, and
+    each limit is then a single binary search.
+
+    Args:
+        metrics: dict with 'cvar' and objective arrays of length n_portfolios
+        cvar_limits: array of CVaR limits
+        objective: metric to maximize, 'sharpe' or 'mean'
+
+    Returns:
+        int array shaped like cvar_limits: the index best_feasible_index
+        would return for each limit, or -1 where nothing is feasible
+    """
+    score = np.asarray(metrics[objective])
+    cvar = np.asarray(metrics['cvar'])
+    cvar_limits = np.asarray(cvar_limits, dtype=float)
+    n_portfolios = len(score)
+
+    # Rank 0 is the highest score, ties going to the lowest index;
+    # portfolios that can never be chosen get rank n_portfolios
+    valid = score > -np.inf
+    by_score = np.lexsort((np.arange(n_portfolios), -np.where(valid, score, -np.inf)))
+    rank = np.empty(n_portfolios, dtype=np.int64)
+    rank[by_score] = np.arange(n_portfolios)
+    rank[~valid] = n_portfolios
+
+    # NaN CVaRs sort last and are never inside a feasible prefix
+    order = np.argsort(-cvar, kind='stable')
+    best_rank = np.minimum.accumulate(rank[order]) if n_portfolios else rank
+    n_feasible = np.asarray(np.searchsorted(-cvar[order], -cvar_limits, side='right'))
+    n_feasible[np.isnan(cvar_limits)] = 0
+
+    indices = np.full(cvar_limits.shape, -1, dtype=np.int64)
+    has_any = n_feasible > 0
+    ranks = best_rank[n_feasible[has_any] - 1]
+    indices[has_any] = np.where(ranks < n_portfolios, by_score[np.minimum(ranks, n_portfolios - 1)], -1)
+    return indices
+
+
+def evaluate_portfolios(samples, weights_matrix, cvar_alpha=0.05,
+                        memory_budget=DEFAULT_MEMORY_BUDGET, progress=None, chunk_rows=65536,
+                        scenario_weights=None):
+    """
+    Evaluate many portfolios against the same scenarios.
+
+    Portfolio returns are computed as block matrix products
+    weights_block @ samples.T, one row per portfolio so that the mean, std
+    and tail partition all run over contiguous memory. Memory-mapped
+    scenarios are streamed in row chunks instead of being loaded whole;
+    each block of portfolios then makes one pass over the file. Those
+    blocks are sized by what each portfolio keeps between chunks, its
+    int(n_samples * alpha) smallest returns, so a pass serves about
+    memory_budget / (8 * n_samples * alpha) portfolios.
+
+    With float32 scenarios, the products and the partition run in single
+    precision (half the memory traffic, and twice the portfolios per
+    block), while means, variances and tail means are accumulated in
+    float64, so errors do not grow with n_samples. With u = 2**-24 and
+    R = max |return| of any asset, each portfolio return is off by at most
+    (n_assets + 1) u R from the float64 result on the unrounded samples;
+    mean, VaR and CVaR inherit that absolute bound, the standard deviation
+    twice it, and the Sharpe ratio is off by about (n_assets + 1) u R
+    (1 + |sharpe|) / std. For 10 assets with returns below 1 that is below
+    1e-6, so float32 picks a different optimum only among grid points
+    whose Sharpe ratios tie to about that precision.
+
+    Args:
+        samples: 2D array of shape (n_samples, n_assets)
+        weights_matrix: 2D array of shape (n_portfolios, n_assets)
+        cvar_alpha: CVaR tail probability, or a sequence of them
+        memory_budget: approximate bytes of scratch space per block; for
+            memory-mapped scenarios, of the retained tails (plus as much
+            scratch again for the products)
+        progress: optional callback progress(stage, fraction), called with
+            the 'evaluation' stage after every block
+        chunk_rows: scenario rows per chunk for memory-mapped scenarios
+        scenario_weights: optional weight per scenario (e.g. importance
+            sampling likelihood ratios) for all statistics; see tail_risk.
+            Not supported for memory-mapped scenarios.
+
+    Returns:
+        dict of arrays of length n_portfolios: mean, std, var, cvar, sharpe
+        (VaR and CVaR at cvar_alpha; with several alphas, var and cvar
+        have shape (n_alphas, n_portfolios))
+    """
+    weights_matrix = np.asarray(weights_matrix, dtype=float)
+    n_portfolios = weights_matrix.shape[0]
+    streaming = isinstance(samples, np.memmap)
+    if streaming and scenario_weights is not None:
+        raise ValueError("Scenario weights are not supported for memory-mapped scenarios")
+
+    mean = np.empty(n_portfolios)
+    std = np.empty(n_portfolios)
+    var = np.empty(np.shape(cvar_alpha) + (n_portfolios,))
+    cvar = np.empty(np.shape(cvar_alpha) + (n_portfolios,))
+
+    block = evaluation_block_size(samples, cvar_alpha, memory_budget, chunk_rows,
+                                  scenario_weights is not None)
+    if streaming:
+        product_size = streaming_product_size(samples.shape[0], cvar_alpha, memory_budget,
+                                              chunk_rows)
+    for start in range(0, n_portfolios, block):
+        stop = min(start + block, n_portfolios)
+        if streaming:
+            stats = chunked_portfolio_stats(weights_matrix[start:stop], samples, cvar_alpha,
+                                            chunk_rows, product_size)
+            mean[start:stop] = stats['mean']
+            std[start:stop] = stats['std']
+            var[..., start:stop] = stats['var']
+            cvar[..., start:stop] = stats['cvar']
+        else:
+            port_ret = weights_matrix[start:stop].astype(samples.dtype, copy=False) @ samples.T
+            mean[start:stop], std[start:stop] = portfolio_moments(port_ret, axis=1,
+                                                                  scenario_weights=scenario_weights)
+            var[..., start:stop], cvar[..., start:stop] = tail_risk(
+                port_ret, cvar_alpha, axis=1, scenario_weights=scenario_weights)
+
+        if progress is not None:
+            progress('evaluation', stop / n_portfolios)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = mean / std
+
+    return {
+        'mean': mean,
+        'std': std,
+        'var': var,
+        'cvar': cvar,
+        'sharpe': sharpe,
+    }
+
+
+def moment_sharpe(weights_matrix, mean, cov, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Sharpe ratios of many portfolios from the asset mean vector and covariance.
+
+    Mean and variance are exact functions of the scenario moments, so this
+    costs O(n_assets^2) per portfolio instead of a pass over the scenarios.
+    """
+    weights_matrix = np.asarray(weights_matrix, dtype=float)
+    sharpe = np.empty(len(weights_matrix))
+    block = max(1, int(memory_budget // (8 * weights_matrix.shape[1])))
+    for start in range(0, len(weights_matrix), block):
+        w = weights_matrix[start:start + block]
+        variance = np.einsum('ij,ij->i', w @ cov, w)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe[start:start + block] = (w @ mean) / np.sqrt(np.maximum(variance, 0.0))
+    return sharpe
+
+
+def lazy_best_feasible(samples, weights_matrix, cvar_limit, cvar_alpha=0.05,
+                       memory_budget=DEFAULT_MEMORY_BUDGET, progress=None, rtol=1e-9,
+                       chunk_rows=65536, scenario_weights=None):
+    """
+    best_feasible_index without evaluating CVaR for the whole grid.
+
+    Sharpe ratios for every portfolio come from the scenario moments (see
+    moment_sharpe). Candidates are then evaluated on the scenarios in
+    descending order of that Sharpe ratio, in batches that double in size,
+    until one meets the CVaR limit. When the limit is loose that is
+    typically the first batch; when it is tight the batches grow until
+    the rest of the grid is evaluated in one go.
+
+    Moment and scenario Sharpe ratios agree to rounding error, so after
+    the first feasible candidate, evaluation continues down to rtol below
+    its Sharpe ratio (widened for float32 scenarios to cover their
+    rounding; see evaluate_portfolios). The pick is then made with
+    best_feasible_index on the exact metrics, giving the same portfolio as
+    an exhaustive search.
+
+    Args:
+        samples: 2D array of shape (n_samples, n_assets)
+        weights_matrix: 2D array of shape (n_portfolios, n_assets)
+        cvar_limit: minimum CVaR of a feasible portfolio
+        cvar_alpha: CVaR tail probability
+        memory_budget: approximate bytes of scratch space per block
+        progress: optional callback progress(stage, fraction), called with
+            the 'evaluation' stage after every batch (as a fraction of the
+            whole grid)
+        rtol: relative margin between moment and scenario Sharpe ratios
+        chunk_rows: scenario rows per chunk for memory-mapped scenarios
+        scenario_weights: optional weight per scenario, as in
+            evaluate_portfolios
+
+    Returns:
+        (best, evaluated, metrics): best grid index or None, the indices
+        evaluated on the scenarios (in evaluation order) and their metrics
+        as from evaluate_portfolios
+    """
+    weights_matrix = np.asarray(weights_matrix, dtype=float)
+    n_portfolios = len(weights_matrix)
+    if samples.dtype == np.float32:
+        rtol = max(rtol, 64 * float(np.finfo(np.float32).eps) * (samples.shape[1] + 1))
+    mean, cov = scenario_moments(samples, chunk_rows, scenario_weights)
+    sharpe = moment_sharpe(weights_matrix, mean, cov, memory_budget)
+    order = np.argsort(-sharpe, kind='stable')
+
+    batches = []
+    threshold = None
+    start = 0
+    size = evaluation_block_size(samples, cvar_alpha, memory_budget, chunk_rows,
+                                 scenario_weights is not None)
+    while start < n_portfolios:
+        batch = order[start:start + size]
+        if threshold is not None:
+            batch = batch[sharpe[batch] >= threshold]
+            if len(batch) == 0:
+                break
+        metrics = evaluate_portfolios(samples, weights_matrix[batch], cvar_alpha, memory_budget,
+                                      chunk_rows=chunk_rows, scenario_weights=scenario_weights)
+        batches.append((batch, metrics))
+        start += len(batch)
+        size *= 2
+        if progress is not None:
+            progress('evaluation', start / n_portfolios)
+
+        if threshold is None:
+            local = best_feasible_index(metrics, cvar_limit)
+            if local is not None:
+                best_sharpe = metrics['sharpe'][local]
+                threshold = best_sharpe - rtol * max(1.0, abs(best_sharpe))
+
+    if not batches:
+        metrics = evaluate_portfolios(samples, weights_matrix[:0], cvar_alpha, memory_budget)
+        return None, np.empty(0, dtype=np.int64), metrics
+
+    evaluated = np.concatenate([batch for batch, _ in batches])
+    metrics = {key: np.concatenate([m[key] for _, m in batches], axis=-1) for key in batches[0][1]}
+
+    # Ties go to the lowest grid index, as in an exhaustive search
+    by_index = np.argsort(evaluated, kind='stable')
+    best = best_feasible_index({key: metrics[key][by_index] for key in ('cvar', 'sharpe')}, cvar_limit)
+    if best is not None:
+        best = int(evaluated[by_index[best]])
+    if progress is not None:
+        progress('evaluation', 1.0)
+    return best, evaluated, metrics
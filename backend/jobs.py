@@ -0,0 +1,212 @@
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job has been cancelled."""
+
+
+class _ProgressReporter:
+    """
+    Progress callback handed to a job's function in the worker process.
+
+    Forwards (stage, fraction) events to the parent through a queue, at most
+    once per percent per stage, and raises JobCancelled as soon as the job's
+    cancel flag is set.
+    """
+
+    def __init__(self, job_id, events, cancel_event):
+        self.job_id = job_id
+        self.events = events
+        self.cancel_event = cancel_event
+        self._last = (None, -1.0)
+
+    def __call__(self, stage, fraction):
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.job_id)
+        last_stage, last_fraction = self._last
+        if stage != last_stage or fraction - last_fraction >= 0.01 or fraction >= 1.0:
+            self._last = (stage, fraction)
+            self.events.put((self.job_id, stage, fraction, time.time()))
+
+
+def _run_job(job_id, fn, args, kwargs, events, cancel_event):
+    """Worker entry point: run fn with a progress callback wired to the parent."""
+    progress = _ProgressReporter(job_id, events, cancel_event)
+    progress('started', 0.0)
+    return fn(*args, progress=progress, **kwargs)
+
+
+class JobManager:
+    """
+    Runs long computations in a bounded process pool and tracks their progress.
+
+    Submitted functions must be importable (picklable) and accept a
+    `progress(stage, fraction)` keyword argument. Job records, including
+    results, are kept in memory; the oldest finished jobs are dropped once
+    there are more than max_jobs.
+    """
+
+    def __init__(self, max_workers=2, max_jobs=100):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._manager = None
+        self._events = None
+
+    def _start(self):
+        # Spawned (not forked) workers, since the web server runs threads
+        context = multiprocessing.get_context('spawn')
+        self._manager = context.Manager()
+        self._events = self._manager.Queue()
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        threading.Thread(target=self._drain_events, daemon=True).start()
+
+    def _drain_events(self):
+        while True:
+            try:
+                job_id, stage, fraction, timestamp = self._events.get()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job['state'] not in ('queued', 'running'):
+                    continue
+                job['state'] = 'running'
+                if stage == 'started':
+                    job['started_at'] = timestamp
+                    continue
+                if stage != job['stage']:
+                    job['stage'] = stage
+                    job['stage_starts'][stage] = timestamp
+                job['stage_progress'] = fraction
+
+    def submit(self, fn, *args, stages=(), **kwargs):
+        """
+        Queue fn(*args, progress=..., **kwargs) and return its job id.
+
+        Args:
+            fn: importable function accepting a `progress` keyword argument
+            stages: expected stage names in order, used to turn per-stage
+                fractions into an overall progress fraction
+        """
+        with self._lock:
+            if self._executor is None:
+                self._start()
+
+            job_id = uuid.uuid4().hex
+            cancel_event = self._manager.Event()
+            self._jobs[job_id] = {
+                'id': job_id,
+                'state': 'queued',
+                'stages': list(stages),
+                'stage': None,
+                'stage_progress': 0.0,
+                'stage_starts': {},
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                'cancel_event': cancel_event,
+                'future': None,
+            }
+            self._prune()
+
+        future = self._executor.submit(_run_job, job_id, fn, args, kwargs, self._events, cancel_event)
+        with self._lock:
+            self._jobs[job_id]['future'] = future
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job['finished_at'] = time.time()
+            try:
+                job['result'] = future.result()
+                job['state'] = 'done'
+            except (CancelledError, JobCancelled):
+                job['state'] = 'cancelled'
+            except Exception as e:
+                job['state'] = 'failed'
+                job['error'] = str(e)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job['state'] in ('done', 'failed', 'cancelled')]
+        for job_id in finished[:max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[job_id]
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. Queued jobs never start; running jobs stop at their
+        next progress callback.
+
+        Returns:
+            False if there is no such job
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job['cancel_event'].set()
+            future = job['future']
+        if future is not None and future.cancel():
+            with self._lock:
+                job['state'] = 'cancelled'
+        return True
+
+    def status(self, job_id, include_result=True):
+        """
+        Snapshot of a job as a JSON-serializable dict, or None if unknown.
+
+        Contains state, current stage, overall progress fraction, elapsed
+        seconds per stage and, once done, the result (or error).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+
+            # Each stage lasts until the next one starts (or the job ends)
+            now = job['finished_at'] or time.time()
+            starts = sorted(job['stage_starts'].items(), key=lambda item: item[1])
+            ends = [start for _, start in starts[1:]] + [now]
+            timings = {stage: end - start for (stage, start), end in zip(starts, ends)}
+
+            if job['state'] == 'done':
+                progress = 1.0
+            elif job['stage'] in job['stages']:
+                progress = (job['stages'].index(job['stage']) + job['stage_progress']) / len(job['stages'])
+            else:
+                progress = 0.0
+
+            status = {
+                'id': job_id,
+                'state': job['state'],
+                'stage': job['stage'],
+                'progress': progress,
+                'timings': timings,
+                'queued_seconds': (job['started_at'] or now) - job['submitted_at'],
+            }
+            if job['state'] == 'failed':
+                status['error'] = job['error']
+            if job['state'] == 'done' and include_result:
+                status['result'] = job['result']
+            return status
+
+    def shutdown(self):
+        """Stop the worker pool, cancelling queued jobs."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+            self._executor = None
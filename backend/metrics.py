@@ -0,0 +1,158 @@
+import contextlib
+import contextvars
+import cProfile
+import sys
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class Metrics:
+    """
+    Thread-safe totals of stage timings and event counters.
+
+    Stages may nest (e.g. 'ppf' runs inside 'sampling'); every stage
+    records its own inclusive time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Zero every stage and counter."""
+        with self._lock:
+            self.stage_seconds = defaultdict(float)
+            self.stage_calls = defaultdict(int)
+            self.counters = defaultdict(int)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_calls[stage] += 1
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def snapshot(self):
+        """Stage seconds and calls, and counters, as plain dicts."""
+        with self._lock:
+            return {
+                'stages': {stage: {'seconds': seconds, 'calls': self.stage_calls[stage]}
+                           for stage, seconds in self.stage_seconds.items()},
+                'counters': dict(self.counters),
+            }
+
+
+# Process-wide totals, exported by the /metrics route
+METRICS = Metrics()
+
+# Per-request Metrics that also receive every observation (see collect)
+_collectors = contextvars.ContextVar('metrics_collectors', default=())
+
+
+def _targets():
+    return (METRICS,) + _collectors.get()
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Time the enclosed block as stage, in METRICS and any active collector."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        for metrics in _targets():
+            metrics.observe(stage, seconds)
+
+
+def count(name, value=1):
+    """Add value to a counter, in METRICS and any active collector."""
+    for metrics in _targets():
+        metrics.inc(name, value)
+
+
+@contextlib.contextmanager
+def collect():
+    """
+    Gather the stages and counters of the enclosed block in a fresh Metrics.
+
+    Observations made in other threads are only included when the thread
+    runs in a copy of this context (see contextvars.copy_context), as the
+    scenario sampling threads do.
+    """
+    metrics = Metrics()
+    token = _collectors.set(_collectors.get() + (metrics,))
+    try:
+        yield metrics
+    finally:
+        _collectors.reset(token)
+
+
+def peak_rss_bytes():
+    """Peak resident memory of this process in bytes, or None where unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@contextlib.contextmanager
+def profiled(path):
+    """Run the enclosed block under cProfile and dump the stats to path (pstats format)."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(metrics=METRICS, gauges=None, prefix='optimizer'):
+    """
+    Metrics in the Prometheus text exposition format.
+
+    Args:
+        metrics: Metrics to export
+        gauges: optional {name: value} of extra point-in-time values
+        prefix: prepended to every metric name
+
+    Returns:
+        str
+    """
+    snapshot = metrics.snapshot()
+    lines = [
+        f'# HELP {prefix}_stage_seconds_total Time spent in each stage',
+        f'# TYPE {prefix}_stage_seconds_total counter',
+    ]
+    for stage, values in sorted(snapshot['stages'].items()):
+        lines.append(f'{prefix}_stage_seconds_total{{stage="{_escape(stage)}"}} {values["seconds"]:.9g}')
+    lines += [
+        f'# HELP {prefix}_stage_calls_total Times each stage ran',
+        f'# TYPE {prefix}_stage_calls_total counter',
+    ]
+    for stage, values in sorted(snapshot['stages'].items()):
+        lines.append(f'{prefix}_stage_calls_total{{stage="{_escape(stage)}"}} {values["calls"]}')
+    for name, value in sorted(snapshot['counters'].items()):
+        lines += [f'# TYPE {prefix}_{name}_total counter', f'{prefix}_{name}_total {value}']
+
+    gauges = dict(gauges or {})
+    peak = peak_rss_bytes()
+    if peak is not None:
+        gauges.setdefault('peak_rss_bytes', peak)
+    for name, value in sorted(gauges.items()):
+        lines += [f'# TYPE {prefix}_{name} gauge', f'{prefix}_{name} {value}']
+    return '\n'.join(lines) + '\n'
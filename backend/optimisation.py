@@ -1,9 +1,164 @@
+import threading
+import warnings
+from collections import OrderedDict
+
 import numpy as np
-from tqdm import tqdm
-from itertools import product
 from .asset import Asset
-from .correlation import sample_correlated_assets
-from .risk import portfolio_returns, calculate_cvar, calculate_sharpe
+from .metrics import count, timed
+from .scenarios import get_scenarios, scenario_key
+from .risk import portfolio_returns, calculate_cvar, calculate_sharpe, tail_weights
+from .evaluation import (
+    DEFAULT_MEMORY_BUDGET,
+    best_feasible_index,
+    evaluate_portfolios,
+    frontier_indices,
+    lazy_best_feasible,
+)
+from .parallel import evaluate_portfolios_parallel, map_starts
+from .results import GridResults
+
+
+def _grid_units(n_assets, step, asset_bounds=None):
+    """
+    Express the grid in integer units of 1 / total.
+
+    Returns:
+        (total, lo, hi) where lo and hi are per-asset bounds in units
+    """
+    if not 0 < step <= 1:
+        raise ValueError(f"Step must be in (0, 1], got {step}")
+    total = int(round(1 / step))
+
+    if asset_bounds is None:
+        return total, [0] * n_assets, [total] * n_assets
+
+    lo = [max(0, int(np.ceil(b[0] * total - 1e-9))) for b in asset_bounds]
+    hi = [min(total, int(np.floor(b[1] * total + 1e-9))) for b in asset_bounds]
+    return total, lo, hi
+
+
+def _suffix_counts(total, lo, hi):
+    """
+    counts[j][s] = number of ways assets j..n-1 can sum to s units.
+
+    Plain Python ints, so counts never overflow.
+    """
+    n_assets = len(lo)
+    counts = [None] * (n_assets + 1)
+    counts[n_assets] = [1] + [0] * total
+    for j in range(n_assets - 1, -1, -1):
+        prefix = [0]
+        for c in counts[j + 1]:
+            prefix.append(prefix[-1] + c)
+        counts[j] = [
+            prefix[max(0, s - lo[j] + 1)] - prefix[max(0, s - hi[j])]
+            for s in range(total + 1)
+        ]
+    return counts
+
+
+def count_weight_grid(n_assets, step=0.1, asset_bounds=None):
+    """
+    Exact number of points generate_weight_grid will produce.
+
+    Runs in O(n_assets / step) without enumerating anything.
+    """
+    total, lo, hi = _grid_units(n_assets, step, asset_bounds)
+    return _suffix_counts(total, lo, hi)[0][total]
+
+
+def _compositions(depth, remaining, lo, hi, min_rest, max_rest):
+    """All bounded compositions of `remaining` units over assets depth..n-1."""
+    first = max(lo[depth], remaining - max_rest[depth + 1])
+    last = min(hi[depth], remaining - min_rest[depth + 1])
+    if first > last:
+        return np.empty((0, len(lo) - depth), dtype=np.int64)
+
+    values = np.arange(first, last + 1)
+    if depth == len(lo) - 2:
+        return np.column_stack([values, remaining - values])
+    if depth == len(lo) - 1:
+        return values[:, None]
+
+    blocks = []
+    for v in values:
+        rest = _compositions(depth + 1, remaining - v, lo, hi, min_rest, max_rest)
+        blocks.append(np.column_stack([np.full(len(rest), v), rest]))
+    return np.concatenate(blocks)
+
+
+def _composition_blocks(depth, remaining, lo, hi, min_rest, max_rest, counts, max_rows):
+    """Yield compositions in lexicographic order, in blocks of at most max_rows."""
+    if counts[depth][remaining] <= max_rows:
+        yield _compositions(depth, remaining, lo, hi, min_rest, max_rest)
+        return
+
+    first = max(lo[depth], remaining - max_rest[depth + 1])
+    last = min(hi[depth], remaining - min_rest[depth + 1])
+    for v in range(first, last + 1):
+        for rest in _composition_blocks(depth + 1, remaining - v, lo, hi, min_rest, max_rest,
+                                        counts, max_rows):
+            yield np.column_stack([np.full(len(rest), v), rest])
+
+
+def _iter_unit_chunks(total, lo, hi, chunk_size=65536):
+    """Bounded integer compositions of total, as int arrays of at most chunk_size rows."""
+    n_assets = len(lo)
+    counts = _suffix_counts(total, lo, hi)
+    if counts[0][total] == 0:
+        return
+
+    # Smallest and largest number of units assets j..n-1 can hold
+    min_rest = [sum(lo[j:]) for j in range(n_assets + 1)]
+    max_rest = [sum(hi[j:]) for j in range(n_assets + 1)]
+
+    pending = []
+    n_pending = 0
+    for block in _composition_blocks(0, total, lo, hi, min_rest, max_rest, counts, chunk_size):
+        pending.append(block)
+        n_pending += len(block)
+        while n_pending >= chunk_size:
+            units = np.concatenate(pending)
+            yield units[:chunk_size]
+            pending = [units[chunk_size:]]
+            n_pending -= chunk_size
+
+    if n_pending:
+        yield np.concatenate(pending)
+
+
+def iter_weight_grid_chunks(n_assets, step=0.1, asset_bounds=None, chunk_size=65536):
+    """
+    Enumerate the weight grid as contiguous arrays.
+
+    Only points on the simplex are generated: weights are built directly as
+    integer compositions of round(1 / step) units, and each asset's range is
+    pruned against its bounds and what the remaining assets can still
+    absorb, so nothing is ever filtered out.
+
+    Args:
+        n_assets: number of assets
+        step: grid step size (weights are multiples of 1 / round(1 / step))
+        asset_bounds: list of (min, max) tuples, one per asset
+        chunk_size: maximum number of rows per chunk
+
+    Yields:
+        float arrays of shape (m, n_assets), m <= chunk_size, in
+        lexicographic order
+    """
+    total, lo, hi = _grid_units(n_assets, step, asset_bounds)
+    for units in _iter_unit_chunks(total, lo, hi, chunk_size):
+        yield units / total
+
+
+def weight_grid_array(n_assets, step=0.1, asset_bounds=None):
+    """The whole weight grid as one (n_points, n_assets) array."""
+    grid = np.empty((count_weight_grid(n_assets, step, asset_bounds), n_assets))
+    start = 0
+    for chunk in iter_weight_grid_chunks(n_assets, step, asset_bounds):
+        grid[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    return grid
 
 
 def generate_weight_grid(n_assets, step=0.1, asset_bounds=None):
@@ -18,107 +173,489 @@ def generate_weight_grid(n_assets, step=0.1, asset_bounds=None):
     Yields:
         tuples of weights
     """
-    steps = int(1 / step) + 1
-    values = [i * step for i in range(steps)]
+    for chunk in iter_weight_grid_chunks(n_assets, step, asset_bounds):
+        yield from map(tuple, chunk.tolist())
 
-    for combo in product(values, repeat=n_assets):
-        if abs(sum(combo) - 1.0) < 1e-9:
-            if asset_bounds is None or all(
-                asset_bounds[i][0] <= combo[i] <= asset_bounds[i][1]
-                for i in range(n_assets)
-            ):
-                yield combo
+
+def _refinement_levels(n_assets, total, asset_bounds=None, coarse_points=5000):
+    """
+    Grid resolutions (in units per whole portfolio) from coarse to total.
+
+    Each level divides the next one by its smallest prime factor, so every
+    coarse grid point is also a point of all finer grids. Coarsening stops
+    once the grid has at most coarse_points points, or before a level with
+    no points at all (narrow bounds can fall between coarse grid points).
+    """
+    levels = [total]
+    while count_weight_grid(n_assets, 1 / levels[0], asset_bounds) > coarse_points:
+        factor = next((p for p in range(2, levels[0] + 1) if levels[0] % p == 0), None)
+        if factor is None or factor == levels[0]:
+            break
+        if count_weight_grid(n_assets, 1 / (levels[0] // factor), asset_bounds) == 0:
+            break
+        levels.insert(0, levels[0] // factor)
+    return levels
+
+
+def adaptive_grid_search(samples, n_assets, step, cvar_limit, cvar_alpha=0.05, asset_bounds=None,
+                         memory_budget=DEFAULT_MEMORY_BUDGET, refine_top_k=5, coarse_points=5000,
+                         progress=None, scenario_weights=None):
+    """
+    Coarse-to-fine grid search.
+
+    The grid is first searched at a coarse step (see _refinement_levels).
+    At every finer level only the neighborhoods of promising points of the
+    level before are gridded: a box of one coarse step in every direction
+    around each of the refine_top_k best feasible points, and around the
+    refine_top_k infeasible points closest to the CVaR limit among those
+    with a higher Sharpe ratio than the best feasible one, since a binding
+    optimum lies between the two. Points are never evaluated twice.
+
+    This is a heuristic: a narrow optimum between coarse points that look
+    unpromising can be missed. Scenario weights, if given, weight every
+    statistic as in evaluate_portfolios.
+
+    Returns:
+        (units, metrics, best): evaluated points as integer weights out of
+        round(1 / step), their metrics as from evaluate_portfolios, and the
+        index of the best feasible one (or None)
+    """
+    levels = _refinement_levels(n_assets, int(round(1 / step)), asset_bounds, coarse_points)
+    total = levels[-1]
+
+    seen = set()
+    evaluated = []
+    batches = []
+    centers = None
+    for level, level_total in enumerate(levels):
+        _, lo, hi = _grid_units(n_assets, 1 / level_total, asset_bounds)
+        if centers is None:
+            candidates = list(_iter_unit_chunks(level_total, lo, hi))
+        else:
+            # One step of the previous level, in this level's units
+            radius = level_total // levels[level - 1]
+            scale = total // level_total
+            candidates = []
+            for center in centers // scale:
+                box_lo = [max(l, c - radius) for l, c in zip(lo, center)]
+                box_hi = [min(h, c + radius) for h, c in zip(hi, center)]
+                candidates.extend(_iter_unit_chunks(level_total, box_lo, box_hi))
+
+        # In units of the finest grid, without points seen before
+        new = []
+        if candidates:
+            for row in np.concatenate(candidates) * (total // level_total):
+                key = row.tobytes()
+                if key not in seen:
+                    seen.add(key)
+                    new.append(row)
+        if new:
+            new = np.array(new)
+            evaluated.append(new)
+            batches.append(evaluate_portfolios(samples, new / total, cvar_alpha, memory_budget,
+                                               scenario_weights=scenario_weights))
+        if progress is not None:
+            progress('evaluation', (level + 1) / len(levels))
+
+        if not evaluated:
+            break
+        units = np.concatenate(evaluated)
+        metrics = {key: np.concatenate([m[key] for m in batches]) for key in batches[0]}
+
+        # Promising points to refine around at the next level
+        sharpe = np.where(metrics['sharpe'] > -np.inf, metrics['sharpe'], -np.inf)
+        feasible = metrics['cvar'] >= cvar_limit
+        by_sharpe = np.argsort(-np.where(feasible, sharpe, -np.inf), kind='stable')
+        keep = [i for i in by_sharpe[:refine_top_k] if feasible[i] and sharpe[i] > -np.inf]
+        best_sharpe = sharpe[keep[0]] if keep else -np.inf
+        near = np.flatnonzero(~feasible & (sharpe > best_sharpe) & ~np.isnan(metrics['cvar']))
+        keep.extend(near[np.argsort(cvar_limit - metrics['cvar'][near], kind='stable')[:refine_top_k]])
+        centers = units[keep]
+
+    if not evaluated:
+        return np.empty((0, n_assets), dtype=np.int64), evaluate_portfolios(
+            samples, np.empty((0, n_assets)), cvar_alpha, scenario_weights=scenario_weights), None
+
+    # Ties go to the lowest point in grid (lexicographic) order
+    order = np.lexsort(units.T[::-1])
+    units = units[order]
+    metrics = {key: values[order] for key, values in metrics.items()}
+    return units, metrics, best_feasible_index(metrics, cvar_limit)
 
 
 def optimize_portfolio_grid(assets, corr_matrix, n_samples=10000,
                            cvar_limit=-0.20, cvar_alpha=0.05, step=0.05,
-                           asset_bounds=None):
+                           asset_bounds=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                           seed=None, use_cache=True, store=None, progress=None, n_workers=1,
+                           search='exhaustive', refine_top_k=5, coarse_points=5000, verify=False,
+                           sampler='random', tail_shift=None, dtype='float64'):
     """
     Find optimal portfolio via grid search.
 
     Args:
-        assets: list of Asset objects
-        corr_matrix: correlation matrix
+        assets: list of Asset objects, or an AssetUniverse
+        corr_matrix: correlation matrix (None with an AssetUniverse)
         n_samples: number of scenarios to generate
         cvar_limit: maximum allowed CVaR (e.g., -0.20 = can't lose more than 20% on average in worst 5%)
         cvar_alpha: CVaR confidence level
         step: grid step size for weights
         asset_bounds: list of (min, max) tuples for each asset's weight bounds
+        memory_budget: approximate bytes of scratch space used per block of
+            grid points during evaluation
+        seed: random seed for the scenarios; seeded scenarios are shared
+            through the process-wide scenario cache
+        use_cache: set to False to bypass the scenario cache
+        store: optional ScenarioStore; seeded scenarios are then kept on disk
+            and evaluated memory-mapped in row chunks
+        progress: optional callback progress(stage, fraction), called as the
+            'sampling' and 'evaluation' stages advance. Raising from it
+            aborts the search.
+        n_workers: number of processes evaluating the grid (and threads
+            sampling seeded scenarios); None uses every core. With more than
+            one, the scenarios are shared with the workers through shared
+            memory. Results are identical for any number of workers.
+        search: 'exhaustive' evaluates every grid point on the scenarios;
+            'moments' ranks the grid by Sharpe ratio from the scenario mean
+            and covariance and evaluates CVaR only from the top down until
+            the limit is met (see lazy_best_feasible). Both find the same
+            portfolio. 'adaptive' searches coarse-to-fine, refining only
+            around promising points (see adaptive_grid_search); it is much
+            cheaper for fine steps but not guaranteed to find the grid
+            optimum. Except for 'exhaustive', all_results only holds the
+            evaluated points and n_workers only applies to sampling.
+        refine_top_k: with search='adaptive', number of best feasible and
+            of near-boundary points refined at every level
+        coarse_points: with search='adaptive', maximum size of the initial
+            coarse grid
+        verify: also run the exhaustive search and report in
+            result['verification'] whether it finds the same Sharpe ratio.
+            Only meant for small problems.
+        sampler: 'random' for pseudo-random scenarios or 'sobol' for
+            scrambled Sobol points (randomized quasi-Monte Carlo), which
+            reach the same Sharpe and CVaR accuracy with far fewer
+            scenarios; powers of two for n_samples work best
+        tail_shift: if given, importance-sample the lower tail of the copula
+            with this latent shift (see sample_tail_weighted) and weight
+            every statistic by the likelihood ratios, for lower-variance
+            CVaR estimates from the same number of scenarios. Not supported
+            with a store.
+        dtype: 'float64' or 'float32' scenarios; float32 halves their
+            memory and the bandwidth of evaluating them, with the error
+            bounds given in evaluate_portfolios
 
     Returns:
-        dict with optimal weights, sharpe, cvar, and all results
+        dict with optimal weights, sharpe, cvar, all results (a GridResults
+        of every evaluated point), and the number of grid points evaluated
+        on the scenarios (n_evaluated) next to the size of the full grid
+        (n_exhaustive), the scenarios and their scenario_weights (None
+        without tail_shift)
     """
+    if search not in ('exhaustive', 'moments', 'adaptive'):
+        raise ValueError(f"Unknown search: {search}")
+
     # Generate scenarios once (SAA)
-    samples = sample_correlated_assets(assets, corr_matrix, n_samples)
+    with timed('sampling'):
+        samples = get_scenarios(assets, corr_matrix, n_samples, seed=seed, use_cache=use_cache,
+                                store=store, n_workers=n_workers, progress=progress,
+                                sampler=sampler, tail_shift=tail_shift, dtype=dtype)
+    scenario_weights = None
+    if tail_shift is not None:
+        samples, scenario_weights = samples
 
     n_assets = len(assets)
+    n_exhaustive = count_weight_grid(n_assets, step, asset_bounds)
+
+    # points: the evaluated weights, metrics: theirs, best: a row of points
+    if search == 'adaptive':
+        # Enumerates each refinement level as it goes
+        with timed('evaluation'):
+            units, metrics, best = adaptive_grid_search(samples, n_assets, step, cvar_limit,
+                                                        cvar_alpha, asset_bounds, memory_budget,
+                                                        refine_top_k, coarse_points,
+                                                        progress=progress,
+                                                        scenario_weights=scenario_weights)
+        points = units / int(round(1 / step))
+    else:
+        with timed('enumeration'):
+            weight_grid = weight_grid_array(n_assets, step, asset_bounds)
+        with timed('evaluation'):
+            if search == 'moments':
+                best, evaluated, metrics = lazy_best_feasible(samples, weight_grid, cvar_limit,
+                                                              cvar_alpha, memory_budget,
+                                                              progress=progress,
+                                                              scenario_weights=scenario_weights)
+                points = weight_grid[evaluated]
+                if best is not None:
+                    best = int(np.flatnonzero(evaluated == best)[0])
+            elif n_workers == 1:
+                metrics = evaluate_portfolios(samples, weight_grid, cvar_alpha, memory_budget,
+                                              progress=progress, scenario_weights=scenario_weights)
+                best = best_feasible_index(metrics, cvar_limit)
+                points = weight_grid
+            else:
+                metrics, best = evaluate_portfolios_parallel(samples, weight_grid, cvar_limit,
+                                                             cvar_alpha, memory_budget, n_workers,
+                                                             progress=progress,
+                                                             scenario_weights=scenario_weights)
+                points = weight_grid
+    count('grid_points', len(points))
+    all_results = GridResults.from_metrics(points, metrics, cvar_limit)
+
+    # Best feasible Sharpe; ties go to the first grid point
     best_sharpe = -np.inf
     best_weights = None
     best_cvar = None
-    all_results = []
+    if best is not None:
+        best_sharpe = metrics['sharpe'][best]
+        best_weights = points[best].copy()
+        best_cvar = metrics['cvar'][best]
+
+    result = {
+        'optimal_weights': best_weights,
+        'optimal_sharpe': best_sharpe,
+        'optimal_cvar': best_cvar,
+        'all_results': all_results,
+        'n_evaluated': len(points),
+        'n_exhaustive': n_exhaustive,
+        'scenarios': samples,
+        'scenario_weights': scenario_weights
+    }
 
-    # Pre-compute grid for tqdm total
-    weight_grid = list(generate_weight_grid(n_assets, step, asset_bounds))
+    if verify:
+        exhaustive = evaluate_portfolios(samples, weight_grid_array(n_assets, step, asset_bounds),
+                                         cvar_alpha, memory_budget,
+                                         scenario_weights=scenario_weights)
+        exhaustive_best = best_feasible_index(exhaustive, cvar_limit)
+        result['verification'] = {
+            'optimal_sharpe': -np.inf if exhaustive_best is None else exhaustive['sharpe'][exhaustive_best],
+            'matches': bool((exhaustive_best is None) == (best is None) and (
+                best is None or exhaustive['sharpe'][exhaustive_best] == best_sharpe)),
+        }
+    return result
 
-    for weights in tqdm(weight_grid, desc="Optimizing weights"):
-        weights = np.array(weights)
-        port_ret = portfolio_returns(weights, samples)
 
-        cvar = calculate_cvar(port_ret, cvar_alpha)
-        sharpe = calculate_sharpe(port_ret)
+def optimize_frontier_grid(assets, corr_matrix, cvar_limits=None, cvar_alphas=(0.05,),
+                           n_points=25, objective='sharpe', n_samples=10000, step=0.05,
+                           asset_bounds=None,
+                           memory_budget=DEFAULT_MEMORY_BUDGET, seed=None, use_cache=True,
+                           store=None, progress=None, n_workers=1, sampler='random',
+                           tail_shift=None, dtype='float64'):
+    """
+    Efficient frontier by grid search: the best portfolio for many CVaR limits.
 
-        result = {
-            'weights': weights,
-            'sharpe': sharpe,
-            'cvar': cvar,
-            'mean': port_ret.mean(),
-            'std': port_ret.std(),
-            'feasible': cvar >= cvar_limit
-        }
-        all_results.append(result)
+    The grid is evaluated once, at every alpha, and each limit is then
+    answered by a sorted feasibility sweep (see frontier_indices) instead of
+    a new search. With the default objective, every point is the portfolio
+    optimize_portfolio_grid would return for that limit and alpha on the
+    same scenarios; objective='mean' traces the mean-CVaR frontier instead.
+
+    Args:
+        assets: list of Asset objects, or an AssetUniverse
+        corr_matrix: correlation matrix (None with an AssetUniverse)
+        cvar_limits: CVaR limits to solve for; default n_points limits
+            evenly spaced between the lowest and highest CVaR on the grid,
+            separately for every alpha
+        cvar_alphas: CVaR confidence levels
+        n_points: number of default limits
+        objective: 'sharpe' or 'mean', the metric maximized at every limit
+        n_samples, step, asset_bounds, memory_budget, seed, use_cache,
+            store, progress, n_workers, sampler, tail_shift, dtype: as in
+            optimize_portfolio_grid
+
+    Returns:
+        dict of arrays, indexed [alpha, limit]: cvar_limits, index (grid
+        point, -1 where nothing is feasible), weights (with a trailing
+        asset axis), sharpe, mean, std and cvar (NaN where infeasible),
+        plus cvar_alphas and the number of grid points evaluated
+    """
+    if objective not in ('sharpe', 'mean'):
+        raise ValueError(f"Unknown objective: {objective}")
+    cvar_alphas = np.atleast_1d(np.asarray(cvar_alphas, dtype=float))
+    samples = get_scenarios(assets, corr_matrix, n_samples, seed=seed, use_cache=use_cache,
+                            store=store, n_workers=n_workers, progress=progress, sampler=sampler,
+                            tail_shift=tail_shift, dtype=dtype)
+    scenario_weights = None
+    if tail_shift is not None:
+        samples, scenario_weights = samples
+    weight_grid = weight_grid_array(len(assets), step, asset_bounds)
+
+    if n_workers == 1:
+        metrics = evaluate_portfolios(samples, weight_grid, cvar_alphas, memory_budget,
+                                      progress=progress, scenario_weights=scenario_weights)
+    else:
+        metrics, _ = evaluate_portfolios_parallel(samples, weight_grid, None, cvar_alphas,
+                                                  memory_budget, n_workers, progress=progress,
+                                                  scenario_weights=scenario_weights)
+
+    if cvar_limits is None:
+        limits = np.full((len(cvar_alphas), n_points), np.nan)
+        for i, cvar in enumerate(metrics['cvar']):
+            finite = cvar[np.isfinite(cvar)]
+            if len(finite):
+                limits[i] = np.linspace(finite.min(), finite.max(), n_points)
+    else:
+        limits = np.broadcast_to(np.asarray(cvar_limits, dtype=float),
+                                 (len(cvar_alphas), np.size(cvar_limits))).copy()
 
-        # Check constraint and update best
-        if cvar >= cvar_limit and sharpe > best_sharpe:
-            best_sharpe = sharpe
-            best_weights = weights
-            best_cvar = cvar
+    index = np.stack([
+        frontier_indices({objective: metrics[objective], 'cvar': cvar}, alpha_limits, objective)
+        for cvar, alpha_limits in zip(metrics['cvar'], limits)
+    ])
 
+    # Index -1 (nothing feasible) picks a trailing row of NaN
+    def pick(values):
+        return np.append(values, np.nan)[index]
+
+    padded_cvar = np.hstack([metrics['cvar'], np.full((len(cvar_alphas), 1), np.nan)])
     return {
-        'optimal_weights': best_weights,
-        'optimal_sharpe': best_sharpe,
-        'optimal_cvar': best_cvar,
-        'all_results': all_results,
-        'scenarios': samples
+        'cvar_alphas': cvar_alphas,
+        'cvar_limits': limits,
+        'index': index,
+        'weights': np.vstack([weight_grid, np.full(len(assets), np.nan)])[index],
+        'sharpe': pick(metrics['sharpe']),
+        'mean': pick(metrics['mean']),
+        'std': pick(metrics['std']),
+        'cvar': np.take_along_axis(padded_cvar, index, axis=1),
+        'n_portfolios': len(weight_grid),
     }
 
 
+from scipy.optimize import linprog, minimize
 
-from scipy.optimize import minimize
 
-def optimize_portfolio_continuous(assets, corr_matrix, n_samples=10000,
-                                  cvar_limit=-0.20, cvar_alpha=0.05,
-                                  asset_bounds=None):
+def _solve_cvar_lp(samples, cvar_limit, cvar_alpha, bounds, tol=1e-7, max_iter=500,
+                   scenario_weights=None):
     """
-    Find optimal portfolio via continuous optimization.
+    Maximize mean / MAD subject to a CVaR limit by linear programming.
 
-    Args:
-        assets: list of Asset objects
-        corr_matrix: correlation matrix
-        n_samples: number of scenarios to generate
-        cvar_limit: maximum allowed CVaR
-        cvar_alpha: CVaR confidence level
-        asset_bounds: list of (min, max) tuples for each asset's weight bounds
+    The CVaR limit is the Rockafellar-Uryasev linear constraint with
+    k = int(n_samples * alpha) tail scenarios, so it is exact for the same
+    worst-k average calculate_cvar uses. Mean absolute deviation (MAD)
+    stands in for the standard deviation, which keeps the Sharpe-like ratio
+    linear-fractional; the Charnes-Cooper transform y = tau * w then makes
+    the whole problem linear in (y, tau).
+
+    Written out with one auxiliary variable per scenario, that LP has dense
+    scenario columns which make HiGHS slow at tens of thousands of
+    scenarios. Projecting the auxiliaries out leaves one linear cut per tail
+    subset (for CVaR) or downside subset (for MAD), so the cuts are
+    generated lazily instead: solve a small LP over (y, tau), add the cuts
+    the solution violates, and repeat until none are violated.
+
+    With scenario_weights, the mean, MAD and CVaR are all weighted; tail
+    cuts then use the weighted tail of tail_weights.
+
+    The transform needs a positive optimal mean: when no portfolio in the
+    bounds has one, the LP optimum is y = 0 whether or not the CVaR limit
+    can be met, so no weights are returned and result['positive_mean'] is
+    False. If cuts are still violated after max_iter rounds, the last
+    iterate is returned with result['converged'] False and a
+    RuntimeWarning, since it may break the CVaR limit.
+
+    Returns:
+        (weights or None, linprog result of the final LP)
     """
-    samples = sample_correlated_assets(assets, corr_matrix, n_samples)
-    n_assets = len(assets)
+    n_samples, n_assets = samples.shape
+    if scenario_weights is None:
+        if int(n_samples * cvar_alpha) == 0:
+            raise ValueError("cvar_alpha * n_samples must be at least 1 for the LP formulation")
+        probabilities = np.full(n_samples, 1.0 / n_samples)
+    else:
+        probabilities = np.asarray(scenario_weights, dtype=float) / np.sum(scenario_weights)
+
+    mu = probabilities @ samples
+    centered = samples - mu
+    lo = np.array([b[0] for b in bounds], dtype=float)
+    hi = np.array([b[1] for b in bounds], dtype=float)
+
+    # Variables: [y (n_assets), tau]
+    c = np.concatenate([-mu, [0.0]])
+    A_eq = np.concatenate([np.ones(n_assets), [-1.0]])[None, :]  # sum(y) = tau
+    b_eq = [0.0]
+    eye = np.eye(n_assets)
+    cut_rows = [
+        np.hstack([eye, -hi[:, None]]),   # y <= hi * tau
+        np.hstack([-eye, lo[:, None]]),   # y >= lo * tau
+    ]
+    cut_rhs = [np.zeros(n_assets), np.zeros(n_assets)]
+    # tau is capped only so the first relaxations stay bounded
+    variable_bounds = [(None, None)] * n_assets + [(0, 1e6)]
+
+    for iteration in range(max_iter):
+        result = linprog(c, A_ub=np.vstack(cut_rows), b_ub=np.concatenate(cut_rhs),
+                         A_eq=A_eq, b_eq=b_eq, bounds=variable_bounds, method='highs')
+        result['cut_iterations'] = iteration + 1
+        result['converged'] = False
+        result['positive_mean'] = True
+        if result.status != 0:
+            return None, result
+
+        y, tau = result.x[:n_assets], result.x[n_assets]
+        port_ret = samples @ y
+        deviation = centered @ y
+
+        # MAD(y) = 2 * mean downside deviation <= 1
+        downside = deviation < 0
+        mad = -2.0 * probabilities[downside] @ deviation[downside]
+        violated = False
+        if mad > 1 + tol:
+            cut_rows.append(np.append(-2.0 * probabilities[downside] @ centered[downside], 0.0)[None, :])
+            cut_rhs.append([1.0])
+            violated = True
+
+        # Average loss over the worst alpha of scenarios <= -cvar_limit * tau
+        tail = tail_weights(port_ret, cvar_alpha, scenario_weights)
+        if -(tail @ port_ret) > -cvar_limit * tau + tol * max(tau, 1.0):
+            cut_rows.append(np.append(-(tail @ samples), cvar_limit)[None, :])
+            cut_rhs.append([0.0])
+            violated = True
+
+        if not violated:
+            result['converged'] = True
+            break
 
+    if tau <= 1e-12 or -result.fun <= 0:
+        # The optimum is y = 0, which says nothing about feasibility
+        result['positive_mean'] = False
+        return None, result
+    if not result['converged']:
+        warnings.warn(f"CVaR LP cuts still violated after {max_iter} iterations; "
+                      f"the weights may break the CVaR limit", RuntimeWarning)
+    return y / tau, result
+
+
+# Previous continuous solutions, keyed by scenario_key plus everything but
+# the CVaR limit; the solution for a nearby limit is still a good start
+_WARM_STARTS = OrderedDict()
+_WARM_STARTS_LOCK = threading.Lock()
+WARM_START_ENTRIES = 256
+
+# Dirichlet candidates drawn per requested start; only the best are solved
+DIRICHLET_CANDIDATES = 64
+
+# Slack on the CVaR and budget constraints when judging a solver's result
+FEASIBILITY_TOL = 1e-6
+
+
+def _solve_slsqp(samples, x0, cvar_limit, cvar_alpha, bounds, scenario_weights=None,
+                 callback=None):
+    """
+    Maximize the sampled Sharpe ratio from x0 subject to the CVaR limit.
+
+    Module-level so that parallel.map_starts can run it in worker processes.
+    callback(weights) is called after every SLSQP iteration; raising from
+    it stops the solve.
+
+    Returns:
+        scipy OptimizeResult
+    """
     def negative_sharpe(weights):
         port_ret = portfolio_returns(weights, samples)
-        return -calculate_sharpe(port_ret)
+        return -calculate_sharpe(port_ret, scenario_weights=scenario_weights)
 
     def cvar_constraint(weights):
         port_ret = portfolio_returns(weights, samples)
-        cvar = calculate_cvar(port_ret, cvar_alpha)
+        cvar = calculate_cvar(port_ret, cvar_alpha, scenario_weights=scenario_weights)
         return cvar - cvar_limit  # Must be >= 0
 
     # Constraints: weights sum to 1, CVaR >= limit
@@ -127,28 +664,284 @@ def optimize_portfolio_continuous(assets, corr_matrix, n_samples=10000,
         {'type': 'ineq', 'fun': cvar_constraint}
     ]
 
-    # Bounds: each weight in [0, 1], or per-asset bounds if provided
-    bounds = asset_bounds if asset_bounds else [(0, 1) for _ in range(n_assets)]
-
-    # Initial guess: equal weight
-    x0 = np.ones(n_assets) / n_assets
-
-    result = minimize(
+    return minimize(
         negative_sharpe,
         x0,
         method='SLSQP',
         bounds=bounds,
         constraints=constraints,
+        callback=callback,
         options={'ftol': 1e-8}
     )
 
-    optimal_weights = result.x
-    port_ret = portfolio_returns(optimal_weights, samples)
+
+def _project_to_bounds(points, lo, hi, iterations=60):
+    """
+    Euclidean projection of each row onto {lo <= w <= hi, sum(w) = 1}.
+
+    The projection is clip(x - t, lo, hi) for the shift t that makes the
+    row sum to one; t is found by bisection, for all rows at once.
+    """
+    points = np.atleast_2d(points)
+    low = (points - hi).min(axis=1)
+    high = (points - lo).max(axis=1)
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        total = np.clip(points - mid[:, None], lo, hi).sum(axis=1)
+        low = np.where(total > 1, mid, low)
+        high = np.where(total > 1, high, mid)
+    return np.clip(points - ((low + high) / 2)[:, None], lo, hi)
+
+
+def _start_points(samples, n_starts, cvar_limit, cvar_alpha, bounds, previous, seed,
+                  coarse_points, scenario_weights=None):
+    """
+    Up to n_starts (source, x0) pairs for multi-start SLSQP.
+
+    In order: the previous solution for the same inputs, the best feasible
+    point of a coarse grid, equal weights, then Dirichlet samples projected
+    onto the bounds. Many more Dirichlet samples are drawn than needed and
+    evaluated in one batch; feasible ones are taken first, by Sharpe ratio.
+    """
+    n_assets = samples.shape[1]
+    lo = np.array([b[0] for b in bounds], dtype=float)
+    hi = np.array([b[1] for b in bounds], dtype=float)
+    equal = np.ones(n_assets) / n_assets
+    if n_starts == 1:
+        return [('equal', equal)]
+
+    starts = []
+    if previous is not None:
+        starts.append(('previous', previous))
+
+    asset_bounds = [tuple(b) for b in bounds]
+    total = _refinement_levels(n_assets, 20, asset_bounds, coarse_points)[0]
+    if 0 < count_weight_grid(n_assets, 1 / total, asset_bounds) <= coarse_points:
+        grid = weight_grid_array(n_assets, 1 / total, asset_bounds)
+        best = best_feasible_index(evaluate_portfolios(samples, grid, cvar_alpha,
+                                                       scenario_weights=scenario_weights),
+                                   cvar_limit)
+        if best is not None:
+            starts.append(('grid', grid[best]))
+
+    starts.append(('equal', equal))
+
+    n_random = n_starts - len(starts)
+    if n_random > 0:
+        rng = np.random.default_rng(seed)
+        candidates = _project_to_bounds(
+            rng.dirichlet(np.ones(n_assets), n_random * DIRICHLET_CANDIDATES), lo, hi)
+        metrics = evaluate_portfolios(samples, candidates, cvar_alpha,
+                                      scenario_weights=scenario_weights)
+        feasible = metrics['cvar'] >= cvar_limit
+        # Feasible by Sharpe ratio, then the rest by CVaR
+        order = np.lexsort((np.where(feasible, -metrics['sharpe'], -metrics['cvar']), ~feasible))
+        starts.extend(('dirichlet', candidates[i]) for i in order[:n_random])
+    return starts[:n_starts]
+
+
+def _start_summary(source, result, samples, cvar_limit, cvar_alpha, bounds, scenario_weights):
+    """Weights, risk and convergence statistics of one SLSQP start."""
+    weights = result.x
+    port_ret = portfolio_returns(weights, samples)
+    cvar = calculate_cvar(port_ret, cvar_alpha, scenario_weights=scenario_weights)
+    lo = np.array([b[0] for b in bounds], dtype=float)
+    hi = np.array([b[1] for b in bounds], dtype=float)
+    feasible = bool(cvar >= cvar_limit - FEASIBILITY_TOL
+                    and abs(np.sum(weights) - 1) <= FEASIBILITY_TOL
+                    and np.all(weights >= lo - FEASIBILITY_TOL)
+                    and np.all(weights <= hi + FEASIBILITY_TOL))
+    return {
+        'source': source,
+        'weights': weights,
+        'sharpe': calculate_sharpe(port_ret, scenario_weights=scenario_weights),
+        'cvar': cvar,
+        'feasible': feasible,
+        'success': bool(result.success),
+        'status': int(result.status),
+        'message': str(result.message),
+        'nit': int(result.get('nit', 0)),
+        'nfev': int(result.get('nfev', 0)),
+    }
+
+
+def _warm_start_key(assets, corr_matrix, n_samples, seed, bounds, cvar_alpha, sampler, tail_shift):
+    return scenario_key(assets, corr_matrix, n_samples, seed, sampler=sampler,
+                        tail_shift=tail_shift, cvar_alpha=float(cvar_alpha),
+                        bounds=tuple((float(b[0]), float(b[1])) for b in bounds))
+
+
+def clear_warm_starts():
+    """Forget all previous continuous solutions."""
+    with _WARM_STARTS_LOCK:
+        _WARM_STARTS.clear()
+
+
+def optimize_portfolio_continuous(assets, corr_matrix, n_samples=10000,
+                                  cvar_limit=-0.20, cvar_alpha=0.05,
+                                  asset_bounds=None, method='slsqp', seed=None, use_cache=True,
+                                  store=None, sampler='random', tail_shift=None, n_starts=1,
+                                  n_workers=1, coarse_points=2000, progress=None):
+    """
+    Find optimal portfolio via continuous optimization.
+
+    The Sharpe objective is not concave and the sampled CVaR constraint is
+    piecewise linear, so SLSQP can stop in a poor local optimum. With
+    n_starts > 1 it is run from several starts: the previous solution for
+    the same seeded inputs (any CVaR limit), the best feasible point of a
+    coarse grid, equal weights, and the most promising of a batch of
+    Dirichlet samples projected onto the bounds. The best feasible result
+    is returned, or the one closest to the CVaR limit if none is feasible.
+    The LP is convex, so method='lp' ignores n_starts.
+
+    Args:
+        assets: list of Asset objects, or an AssetUniverse
+        corr_matrix: correlation matrix (None with an AssetUniverse)
+        n_samples: number of scenarios to generate
+        cvar_limit: maximum allowed CVaR
+        cvar_alpha: CVaR confidence level
+        asset_bounds: list of (min, max) tuples for each asset's weight bounds
+        method: 'slsqp' maximizes Sharpe directly with a sampled CVaR
+            constraint; 'lp' solves the linear Rockafellar-Uryasev /
+            Charnes-Cooper program (mean / MAD objective) with HiGHS. The
+            LP needs a portfolio with a positive mean return; without one,
+            'lp' falls back to SLSQP (see _solve_cvar_lp)
+        seed: random seed for the scenarios; seeded scenarios are shared
+            through the process-wide scenario cache
+        use_cache: set to False to bypass the scenario cache
+        store: optional ScenarioStore, as in optimize_portfolio_grid
+        sampler: 'random' or 'sobol', as in optimize_portfolio_grid
+        tail_shift: importance-sample the lower tail, as in
+            optimize_portfolio_grid
+        n_starts: number of SLSQP starts; 1 starts from equal weights only
+        n_workers: number of processes running the starts, over scenarios
+            shared once (see parallel.map_starts)
+        coarse_points: largest coarse grid evaluated for the grid start
+        progress: optional callback progress(stage, fraction), called as
+            the 'sampling' stage advances, then with the 'evaluation' stage
+            after every SLSQP iteration of serial starts and as starts
+            complete. Raising from it aborts the solve.
+
+    Returns:
+        dict with the optimal weights, Sharpe ratio and CVaR, the scenarios,
+        the method that produced them and the chosen start's
+        optimization_result; SLSQP results also list
+        every start's source, weights, sharpe, cvar, feasible, and
+        convergence statistics (success, status, message, nit, nfev) under
+        'starts'
+    """
+    if method not in ('slsqp', 'lp'):
+        raise ValueError(f"Unknown method: {method}")
+
+    with timed('sampling'):
+        samples = get_scenarios(assets, corr_matrix, n_samples, seed=seed, use_cache=use_cache,
+                                store=store, sampler=sampler, tail_shift=tail_shift,
+                                progress=progress)
+    scenario_weights = None
+    if tail_shift is not None:
+        samples, scenario_weights = samples
+    n_assets = len(assets)
+
+    # Bounds: each weight in [0, 1], or per-asset bounds if provided
+    bounds = asset_bounds if asset_bounds else [(0, 1) for _ in range(n_assets)]
+
+    lp_fallback = False
+    if method == 'lp':
+        with timed('solve'):
+            optimal_weights, result = _solve_cvar_lp(samples, cvar_limit, cvar_alpha, bounds,
+                                                     scenario_weights=scenario_weights)
+        if optimal_weights is not None:
+            port_ret = portfolio_returns(optimal_weights, samples)
+            return {
+                'optimal_weights': optimal_weights,
+                'optimal_sharpe': calculate_sharpe(port_ret, scenario_weights=scenario_weights),
+                'optimal_cvar': calculate_cvar(port_ret, cvar_alpha,
+                                               scenario_weights=scenario_weights),
+                'scenarios': samples,
+                'scenario_weights': scenario_weights,
+                'method': 'lp',
+                'optimization_result': result
+            }
+        if result.status != 0 or result['positive_mean']:
+            return {
+                'optimal_weights': None,
+                'optimal_sharpe': -np.inf,
+                'optimal_cvar': None,
+                'scenarios': samples,
+                'scenario_weights': scenario_weights,
+                'method': 'lp',
+                'optimization_result': result
+            }
+        # Only non-positive means are possible: maximize Sharpe directly,
+        # and report infeasibility rather than the closest start
+        lp_fallback = True
+
+    # Warm starts only for seeded scenarios, which are the same next time
+    warm_key = None
+    previous = None
+    if seed is not None and use_cache:
+        warm_key = _warm_start_key(assets, corr_matrix, n_samples, seed, bounds, cvar_alpha,
+                                   sampler, tail_shift)
+        with _WARM_STARTS_LOCK:
+            previous = _WARM_STARTS.get(warm_key)
+
+    with timed('solve'):
+        starts = _start_points(samples, n_starts, cvar_limit, cvar_alpha, bounds, previous, seed,
+                               coarse_points, scenario_weights)
+        args = (cvar_limit, cvar_alpha, bounds, scenario_weights)
+        if n_workers == 1 or len(starts) == 1:
+            results = []
+            for _, x0 in starts:
+                callback = None
+                if progress is not None:
+                    fraction = len(results) / len(starts)
+                    callback = lambda weights: progress('evaluation', fraction)
+                results.append(_solve_slsqp(samples, x0, *args, callback=callback))
+                if progress is not None:
+                    progress('evaluation', len(results) / len(starts))
+        else:
+            results = map_starts(_solve_slsqp, samples, [x0 for _, x0 in starts], args,
+                                 n_workers, progress=progress)
+    summaries = [_start_summary(source, result, samples, cvar_limit, cvar_alpha, bounds,
+                                scenario_weights)
+                 for (source, _), result in zip(starts, results)]
+    count('objective_evaluations', sum(summary['nfev'] for summary in summaries))
+
+    # Highest Sharpe among feasible starts (ties to the earliest), otherwise
+    # the start closest to meeting the CVaR limit
+    feasible = [i for i, summary in enumerate(summaries) if summary['feasible']]
+    if feasible:
+        best = max(feasible, key=lambda i: (summaries[i]['sharpe'], -i))
+    else:
+        best = max(range(len(summaries)), key=lambda i: (summaries[i]['cvar'], -i))
+
+    if lp_fallback and not summaries[best]['feasible']:
+        return {
+            'optimal_weights': None,
+            'optimal_sharpe': -np.inf,
+            'optimal_cvar': None,
+            'scenarios': samples,
+            'scenario_weights': scenario_weights,
+            'method': 'slsqp',
+            'optimization_result': results[best],
+            'starts': summaries,
+        }
+
+    optimal_weights = summaries[best]['weights']
+    if warm_key is not None:
+        with _WARM_STARTS_LOCK:
+            _WARM_STARTS[warm_key] = optimal_weights.copy()
+            _WARM_STARTS.move_to_end(warm_key)
+            while len(_WARM_STARTS) > WARM_START_ENTRIES:
+                _WARM_STARTS.popitem(last=False)
 
     return {
         'optimal_weights': optimal_weights,
-        'optimal_sharpe': calculate_sharpe(port_ret),
-        'optimal_cvar': calculate_cvar(port_ret, cvar_alpha),
+        'optimal_sharpe': summaries[best]['sharpe'],
+        'optimal_cvar': summaries[best]['cvar'],
         'scenarios': samples,
-        'optimization_result': result
-    }
\ No newline at end of file
+        'scenario_weights': scenario_weights,
+        'method': 'slsqp',
+        'optimization_result': results[best],
+        'starts': summaries,
+    }
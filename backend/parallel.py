@@ -0,0 +1,339 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .evaluation import (
+    DEFAULT_MEMORY_BUDGET,
+    best_feasible_index,
+    evaluate_portfolios,
+    evaluation_block_size,
+)
+
+
+# Worker pools by size, started on first use and kept for later calls so
+# repeated requests don't pay for spawning and importing in fresh workers
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _get_pool(n_workers):
+    """Shared process pool with n_workers workers, created on first use."""
+    with _POOLS_LOCK:
+        pool = _POOLS.get(n_workers)
+        if pool is None:
+            # Spawned (not forked) workers, since the web server runs threads
+            pool = ProcessPoolExecutor(max_workers=n_workers,
+                                       mp_context=multiprocessing.get_context('spawn'))
+            _POOLS[n_workers] = pool
+        return pool
+
+
+def _discard_pool(n_workers, pool):
+    """Forget a pool whose workers died, so the next call starts a new one."""
+    with _POOLS_LOCK:
+        if _POOLS.get(n_workers) is pool:
+            del _POOLS[n_workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown_pools():
+    """Shut down every shared worker pool."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.shutdown(cancel_futures=True)
+
+
+def _settle(futures):
+    """
+    Cancel pending futures and wait for running ones, so no worker still
+    uses shared memory that is about to be unlinked.
+    """
+    for future in futures:
+        future.cancel()
+    wait(futures)
+
+
+def _share(array):
+    """
+    Copy an array into a new shared memory block.
+
+    Returns:
+        (SharedMemory, spec) where spec lets a worker attach to it
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, ('shm', shm.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+    """
+    Open an array described by a spec from _share, or a .npy memmap spec.
+
+    Returns:
+        (SharedMemory or None, array)
+    """
+    if spec[0] == 'memmap':
+        return None, np.load(spec[1], mmap_mode='r')
+    _, name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _run_range(fn, samples_spec, weights_spec, out_spec, start, stop, args):
+    """
+    Worker: apply fn to grid rows start:stop, writing into the shared output.
+
+    fn(samples, weights, *args) returns (columns, extra) where columns has
+    shape (n_outputs, stop - start).
+
+    Returns:
+        (start, extra)
+    """
+    handles = []
+    try:
+        shm, samples = _attach(samples_spec)
+        handles.append(shm)
+        shm, weights = _attach(weights_spec)
+        handles.append(shm)
+        shm, out = _attach(out_spec)
+        handles.append(shm)
+
+        columns, extra = fn(samples, weights[start:stop], *args)
+        out[:, start:stop] = columns
+        # Views into shared memory must be gone before it can be closed
+        del samples, weights, out
+        return start, extra
+    finally:
+        for shm in handles:
+            if shm is not None:
+                shm.close()
+
+
+def map_grid_chunks(fn, samples, weights_matrix, n_outputs, block, args=(), n_workers=None,
+                    progress=None, stage='evaluation'):
+    """
+    Run fn over consecutive chunks of a weight grid in a process pool.
+
+    The scenarios and weights are copied into shared memory once and the
+    workers write their columns straight into a shared output array, so
+    nothing large is pickled. Memory-mapped scenarios are not copied; every
+    worker opens the same file instead. The pool itself is kept between
+    calls (one per n_workers) and shut down at exit.
+
+    Chunks are whole multiples of block, so a fn that works in blocks of
+    that size from the start of its rows does exactly the same arithmetic
+    as one call over the whole grid, whatever the number of workers.
+
+    Args:
+        fn: importable function fn(samples, weights, *args) returning
+            (columns of shape (n_outputs, len(weights)), extra)
+        samples: 2D array of shape (n_samples, n_assets), or a .npy memmap
+        weights_matrix: 2D array of shape (n_portfolios, n_assets)
+        n_outputs: number of output rows per portfolio
+        block: chunk granularity in portfolios
+        args: extra picklable arguments for fn
+        n_workers: number of worker processes (default: os.cpu_count())
+        progress: optional callback progress(stage, fraction), called as
+            chunks complete. Raising from it cancels the remaining chunks.
+        stage: stage name reported to progress
+
+    Returns:
+        (outputs of shape (n_outputs, n_portfolios), [(start, extra), ...]
+        in chunk order)
+    """
+    weights_matrix = np.ascontiguousarray(weights_matrix, dtype=float)
+    n_portfolios = len(weights_matrix)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    # About four chunks per worker for load balancing
+    blocks_per_chunk = max(1, -(-n_portfolios // (4 * n_workers * block)))
+    chunk = blocks_per_chunk * block
+    ranges = [(start, min(start + chunk, n_portfolios)) for start in range(0, n_portfolios, chunk)]
+    if not ranges:
+        return np.empty((n_outputs, 0)), []
+
+    shms = []
+    pool = _get_pool(n_workers)
+    futures = {}
+    try:
+        if isinstance(samples, np.memmap):
+            samples_spec = ('memmap', samples.filename)
+        else:
+            shm, samples_spec = _share(np.ascontiguousarray(samples))
+            shms.append(shm)
+        shm, weights_spec = _share(weights_matrix)
+        shms.append(shm)
+        out_shm = shared_memory.SharedMemory(create=True, size=n_outputs * n_portfolios * 8)
+        shms.append(out_shm)
+        out_spec = ('shm', out_shm.name, (n_outputs, n_portfolios), '<f8')
+
+        futures = {
+            pool.submit(_run_range, fn, samples_spec, weights_spec, out_spec, start, stop,
+                        args): stop - start
+            for start, stop in ranges
+        }
+
+        done = 0
+        extras = []
+        for future in as_completed(futures):
+            extras.append(future.result())
+            done += futures[future]
+            if progress is not None:
+                progress(stage, done / n_portfolios)
+
+        out = np.ndarray((n_outputs, n_portfolios), dtype='<f8', buffer=out_shm.buf)
+        outputs = out.copy()
+        del out
+    except BrokenProcessPool:
+        _discard_pool(n_workers, pool)
+        raise
+    finally:
+        _settle(futures)
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    return outputs, sorted(extras, key=lambda item: item[0])
+
+
+def _evaluate_chunk(samples, weights, cvar_alpha, cvar_limit, memory_budget, chunk_rows,
+                    scenario_weights):
+    """Worker body of evaluate_portfolios_parallel."""
+    metrics = evaluate_portfolios(samples, weights, cvar_alpha, memory_budget, chunk_rows=chunk_rows,
+                                  scenario_weights=scenario_weights)
+    best = None if cvar_limit is None else best_feasible_index(metrics, cvar_limit)
+    columns = np.vstack([metrics['mean'], metrics['std'],
+                         metrics['var'].reshape(-1, len(weights)),
+                         metrics['cvar'].reshape(-1, len(weights))])
+    return columns, None if best is None else (best, metrics['sharpe'][best])
+
+
+def evaluate_portfolios_parallel(samples, weights_matrix, cvar_limit=None, cvar_alpha=0.05,
+                                 memory_budget=DEFAULT_MEMORY_BUDGET, n_workers=None,
+                                 progress=None, chunk_rows=65536, scenario_weights=None):
+    """
+    evaluate_portfolios spread over a process pool, plus the best feasible pick.
+
+    Each worker evaluates a chunk of the grid and returns its own best
+    feasible portfolio; those are then reduced to the overall best. Since
+    chunks follow evaluate_portfolios' block boundaries, the results do not
+    depend on the number of workers.
+
+    Args:
+        samples: 2D array of shape (n_samples, n_assets), or a .npy memmap
+        weights_matrix: 2D array of shape (n_portfolios, n_assets)
+        cvar_limit: minimum CVaR of a feasible portfolio, or None to skip
+            picking one (required with several alphas)
+        cvar_alpha: CVaR tail probability, or a sequence of them
+        memory_budget: approximate bytes of scratch space per block
+        n_workers: number of worker processes (default: os.cpu_count())
+        progress: optional callback progress(stage, fraction), called with
+            the 'evaluation' stage as chunks complete
+        chunk_rows: scenario rows per chunk for memory-mapped scenarios
+        scenario_weights: optional weight per scenario, as in
+            evaluate_portfolios (sent to every worker with the task)
+
+    Returns:
+        (metrics, best) with metrics as from evaluate_portfolios and best
+        the index chosen by best_feasible_index (None if cvar_limit is None)
+    """
+    alpha_shape = np.shape(cvar_alpha)
+    n_alphas = int(np.prod(alpha_shape))
+    block = evaluation_block_size(samples, cvar_alpha, memory_budget, chunk_rows,
+                                  scenario_weights is not None)
+    outputs, extras = map_grid_chunks(_evaluate_chunk, samples, weights_matrix, 2 + 2 * n_alphas,
+                                      block, (cvar_alpha, cvar_limit, memory_budget, chunk_rows,
+                                              scenario_weights),
+                                      n_workers, progress)
+    n_portfolios = outputs.shape[1]
+    metrics = {
+        'mean': outputs[0],
+        'std': outputs[1],
+        'var': outputs[2:2 + n_alphas].reshape(alpha_shape + (n_portfolios,)),
+        'cvar': outputs[2 + n_alphas:].reshape(alpha_shape + (n_portfolios,)),
+    }
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics['sharpe'] = metrics['mean'] / metrics['std']
+
+    # Highest Sharpe across chunks; ties go to the lowest index, as in
+    # best_feasible_index
+    candidates = [(start + best[0], best[1]) for start, best in extras if best is not None]
+    best = None
+    if candidates:
+        best = min(candidates, key=lambda c: (-c[1], c[0]))[0]
+    return metrics, best
+
+
+def _run_start(fn, samples_spec, x0, args):
+    """Worker: fn(samples, x0, *args) on the shared scenarios."""
+    shm, samples = _attach(samples_spec)
+    try:
+        result = fn(samples, x0, *args)
+        del samples
+        return result
+    finally:
+        if shm is not None:
+            shm.close()
+
+
+def map_starts(fn, samples, starts, args=(), n_workers=None, progress=None, stage='evaluation'):
+    """
+    Run fn from every start point in a process pool over shared scenarios.
+
+    As in map_grid_chunks, the scenarios are copied into shared memory once
+    (memory-mapped scenarios are opened by every worker instead), so only
+    the start points and args are pickled, and the pool is kept between
+    calls.
+
+    Args:
+        fn: importable function fn(samples, x0, *args) returning a picklable
+            result
+        samples: 2D array of shape (n_samples, n_assets), or a .npy memmap
+        starts: sequence of start points
+        args: extra picklable arguments for fn
+        n_workers: number of worker processes (default: os.cpu_count())
+        progress: optional callback progress(stage, fraction), called as
+            starts complete. Raising from it cancels the remaining starts.
+        stage: stage name reported to progress
+
+    Returns:
+        list of results in the order of starts
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    if not len(starts):
+        return []
+
+    shm = None
+    pool = _get_pool(n_workers)
+    futures = {}
+    try:
+        if isinstance(samples, np.memmap):
+            samples_spec = ('memmap', samples.filename)
+        else:
+            shm, samples_spec = _share(np.ascontiguousarray(samples))
+        futures = {pool.submit(_run_start, fn, samples_spec, x0, args): i
+                   for i, x0 in enumerate(starts)}
+
+        results = [None] * len(starts)
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(stage, done / len(starts))
+        return results
+    except BrokenProcessPool:
+        _discard_pool(n_workers, pool)
+        raise
+    finally:
+        _settle(futures)
+        if shm is not None:
+            shm.close()
+            shm.unlink()
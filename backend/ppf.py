@@ -0,0 +1,195 @@
+import warnings
+
+import numpy as np
+from scipy import special
+
+from .metrics import count
+
+
+# Quantiles are clipped to [Q_MIN, 1 - Q_MIN] before inversion
+Q_MIN = 1e-10
+Z_MAX = float(-special.ndtri(Q_MIN))
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+def _mix(values, weights):
+    """Sum of values weighted along the last axis (weights of shape (k,) or (..., k))."""
+    if np.ndim(weights) == 1:
+        return values @ weights
+    return np.einsum('...k,...k->...', values, weights)
+
+
+def mixture_cdf(x, weights, means, stds):
+    """
+    CDF of a mixture of normals, broadcast over any shape of x.
+
+    The parameters have shape (k,), or (..., k) for a different mixture at
+    every point of x.
+    """
+    z = (np.asarray(x, dtype=float)[..., None] - means) / stds
+    return _mix(special.ndtr(z), weights)
+
+
+def mixture_pdf(x, weights, means, stds):
+    """PDF of a mixture of normals, broadcast over any shape of x, as mixture_cdf."""
+    z = (np.asarray(x, dtype=float)[..., None] - means) / stds
+    return _mix(np.exp(-0.5 * z**2) / (stds * SQRT_2PI), weights)
+
+
+def mixture_ppf_vectorized(q_array, weights, means, stds, xtol=2e-12, rtol=4 * np.finfo(float).eps,
+                           maxiter=100, progress=None):
+    """
+    Exact inverse CDF for an array of quantiles.
+
+    Every quantile is solved at once with safeguarded Newton steps: the root
+    is kept bracketed between the smallest and largest component quantile,
+    and any Newton step that leaves the bracket is replaced by bisection.
+    Converged points are masked out so later passes only touch stragglers.
+
+    The mixture parameters have shape (k,), or broadcast against
+    q_array.shape + (k,) to solve for a different mixture at every point:
+    e.g. (n_assets, k) padded parameters for an (n_samples, n_assets)
+    array, solving all assets in one pass. Padded components need zero
+    weight (and a positive std).
+
+    Args:
+        q_array: array of probabilities (clipped to [Q_MIN, 1 - Q_MIN])
+        weights: mixture component weights
+        means: mixture component means
+        stds: mixture component standard deviations
+        xtol, rtol: absolute and relative tolerance on x, as in brentq
+        maxiter: maximum number of Newton/bisection passes
+        progress: optional callback progress(stage, fraction), called after
+            every pass with the fraction of converged points
+
+    Returns:
+        array of quantiles with the shape of q_array
+    """
+    weights = np.asarray(weights, dtype=float)
+    means = np.asarray(means, dtype=float)
+    stds = np.asarray(stds, dtype=float)
+    q = np.clip(np.asarray(q_array, dtype=float), Q_MIN, 1 - Q_MIN).ravel()
+    count('root_finds', q.size)
+
+    per_point = max(weights.ndim, means.ndim, stds.ndim) > 1
+    if per_point:
+        # One row of parameters per point, indexed along with the points
+        shape = np.shape(q_array) + (np.broadcast_shapes(weights.shape, means.shape,
+                                                          stds.shape)[-1],)
+        weights, means, stds = (np.broadcast_to(p, shape).reshape(-1, shape[-1])
+                                for p in (weights, means, stds))
+
+    # The mixture quantile lies between the component quantiles (of the
+    # components with any weight, so padding does not widen the bracket)
+    component_quantiles = means + stds * special.ndtri(q)[:, None]
+    present = weights > 0
+    low = np.where(present, component_quantiles, np.inf).min(axis=1)
+    high = np.where(present, component_quantiles, -np.inf).max(axis=1)
+    x = _mix(component_quantiles, weights)
+
+    active = np.arange(len(q))
+    for _ in range(maxiter):
+        if len(active) == 0:
+            break
+
+        xa, lo, hi, qa = x[active], low[active], high[active], q[active]
+        if per_point and len(active) < len(q):
+            params = weights[active], means[active], stds[active]
+        else:
+            params = weights, means, stds
+        f = mixture_cdf(xa, *params) - qa
+        lo = np.where(f < 0, xa, lo)
+        hi = np.where(f > 0, xa, hi)
+
+        with np.errstate(divide='ignore', over='ignore', invalid='ignore'):
+            x_new = xa - f / mixture_pdf(xa, *params)
+        # An exact root stays put even on the edge of its bracket
+        outside = ~((x_new > lo) & (x_new < hi)) & (f != 0)
+        x_new = np.where(outside, 0.5 * (lo + hi), x_new)
+
+        x[active], low[active], high[active] = x_new, lo, hi
+
+        tol = xtol + rtol * np.abs(x_new)
+        done = (f == 0) | (np.abs(x_new - xa) < tol) | (hi - lo < tol)
+        active = active[~done]
+        if progress is not None:
+            progress('sampling', 1 - len(active) / len(q))
+
+    return x.reshape(np.shape(q_array))
+
+
+class QuantileTable:
+    """
+    Interpolated inverse CDF of a mixture of normals.
+
+    Nodes are placed in standard-normal score z = Phi^-1(q) rather than in q,
+    so a uniform layout already packs them densely into both tails. Cells
+    whose midpoint error exceeds the tolerance are then split until the
+    whole table meets it. Lookups are a single vectorized linear
+    interpolation in z.
+    """
+
+    def __init__(self, weights, means, stds, tol=1e-6, n_nodes=257,
+                 max_nodes=65536, min_width=1e-6):
+        """
+        Args:
+            weights: mixture component weights (must sum to 1)
+            means: mixture component means
+            stds: mixture component standard deviations
+            tol: maximum allowed absolute interpolation error, checked
+                against the exact root-finder at the midpoint of every cell
+            n_nodes: number of uniformly spaced initial nodes
+            max_nodes: upper limit on the number of table nodes
+            min_width: cells narrower than this (in z) are never split.
+                Only gaps between well-separated modes, where the quantile
+                function is effectively discontinuous, end up this narrow.
+        """
+        self.weights = np.asarray(weights, dtype=float)
+        self.means = np.asarray(means, dtype=float)
+        self.stds = np.asarray(stds, dtype=float)
+        self.tol = tol
+
+        z_nodes = np.linspace(-Z_MAX, Z_MAX, n_nodes)
+        x_nodes = self.exact_from_normal(z_nodes)
+
+        while True:
+            # Linear interpolation error is largest between nodes
+            z_mid = 0.5 * (z_nodes[1:] + z_nodes[:-1])
+            x_mid = self.exact_from_normal(z_mid)
+            errors = np.abs(0.5 * (x_nodes[1:] + x_nodes[:-1]) - x_mid)
+
+            split = (errors > tol) & (np.diff(z_nodes) > min_width)
+            n_split = np.count_nonzero(split)
+            if n_split == 0:
+                break
+            if len(z_nodes) + n_split > max_nodes:
+                warnings.warn(
+                    f"Quantile table error {errors.max():.2e} exceeds tolerance "
+                    f"{tol:.2e} at the {max_nodes} node limit"
+                )
+                break
+
+            insert_at = np.flatnonzero(split) + 1
+            z_nodes = np.insert(z_nodes, insert_at, z_mid[split])
+            x_nodes = np.insert(x_nodes, insert_at, x_mid[split])
+
+        self.z_nodes = z_nodes
+        self.x_nodes = x_nodes
+        self.max_error = float(errors.max())
+
+    def __len__(self):
+        return len(self.z_nodes)
+
+    def exact_from_normal(self, z):
+        """Reference quantiles at standard-normal scores z, by root-finding."""
+        return mixture_ppf_vectorized(special.ndtr(z), self.weights, self.means, self.stds)
+
+    def ppf_from_normal(self, z):
+        """Quantiles at standard-normal scores z (clipped to the table range)."""
+        z = np.clip(z, -Z_MAX, Z_MAX)
+        return np.interp(z, self.z_nodes, self.x_nodes)
+
+    def ppf(self, q):
+        """Quantiles at probabilities q."""
+        q = np.clip(q, Q_MIN, 1 - Q_MIN)
+        return self.ppf_from_normal(special.ndtri(q))
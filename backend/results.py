@@ -0,0 +1,86 @@
+from collections.abc import Sequence
+
+import numpy as np
+
+
+class GridResults(Sequence):
+    """
+    Columnar grid-search results: a weights matrix plus one array per metric.
+
+    Integer indexing and iteration give a dict per point, like the list of
+    dicts grid search used to return, built only when asked for. Slices
+    give GridResults views sharing the same arrays; boolean masks and
+    index arrays give copies.
+    """
+
+    COLUMNS = ('sharpe', 'cvar', 'var', 'mean', 'std', 'feasible')
+
+    def __init__(self, weights, sharpe, cvar, var, mean, std, feasible):
+        """
+        Args:
+            weights: 2D array of shape (n_points, n_assets)
+            sharpe, cvar, var, mean, std: float arrays of length n_points
+            feasible: bool array of length n_points
+        """
+        self.weights = weights
+        self.sharpe = sharpe
+        self.cvar = cvar
+        self.var = var
+        self.mean = mean
+        self.std = std
+        self.feasible = feasible
+
+    @classmethod
+    def from_metrics(cls, weights, metrics, cvar_limit):
+        """Results for weights evaluated by evaluate_portfolios."""
+        return cls(weights, metrics['sharpe'], metrics['cvar'], metrics['var'], metrics['mean'],
+                   metrics['std'], metrics['cvar'] >= cvar_limit)
+
+    def __len__(self):
+        return len(self.weights)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            row = {'weights': self.weights[key]}
+            row.update((name, getattr(self, name)[key]) for name in self.COLUMNS)
+            return row
+        return GridResults(self.weights[key], *(getattr(self, name)[key] for name in self.COLUMNS))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return f"GridResults({len(self)} points, {int(np.count_nonzero(self.feasible))} feasible)"
+
+    def filter(self, mask):
+        """Points where mask is true, e.g. results.filter(results.cvar > -0.1)."""
+        return self[np.asarray(mask, dtype=bool)]
+
+    def top_k(self, k, by='sharpe', feasible_only=True):
+        """
+        The k points with the highest value of a column, best first.
+
+        Ties go to the earlier point; NaN values are never selected.
+        """
+        values = np.asarray(getattr(self, by), dtype=float)
+        valid = ~np.isnan(values)
+        if feasible_only:
+            valid &= self.feasible
+        candidates = np.flatnonzero(valid)
+        if k < len(candidates):
+            # Partition first so only the top k are sorted
+            kth = np.partition(-values[candidates], k - 1)[k - 1]
+            candidates = candidates[-values[candidates] <= kth]
+        order = np.lexsort((candidates, -values[candidates]))[:k]
+        return self[candidates[order]]
+
+    def to_records(self):
+        """NumPy structured array with a weights sub-array field."""
+        dtype = [('weights', float, (self.weights.shape[1],))]
+        dtype += [(name, bool if name == 'feasible' else float) for name in self.COLUMNS]
+        records = np.empty(len(self), dtype=dtype)
+        records['weights'] = self.weights
+        for name in self.COLUMNS:
+            records[name] = getattr(self, name)
+        return records
@@ -5,6 +5,9 @@ def portfolio_returns(weights, asset_returns):
     """
     Calculate portfolio returns for each scenario.
 
+    Computed in the precision of asset_returns, so float32 scenarios give
+    float32 returns without a float64 copy of the scenarios.
+
     Args:
         weights: array of portfolio weights (must sum to 1)
         asset_returns: 2D array of shape (n_samples, n_assets)
@@ -12,11 +15,299 @@ def portfolio_returns(weights, asset_returns):
     Returns:
         1D array of portfolio returns (n_samples,)
     """
-    weights = np.array(weights)
+    single = np.asarray(asset_returns).dtype == np.float32
+    weights = np.asarray(weights, dtype=np.float32 if single else float)
     return asset_returns @ weights
 
 
-def calculate_cvar(returns, alpha=0.05):
+def _tail_positions(n, alphas):
+    """Order-statistic indices behind VaR and CVaR for n scenarios."""
+    positions = alphas * (n - 1)
+    lower = np.floor(positions).astype(int)
+    upper = np.minimum(lower + 1, n - 1)
+    fraction = positions - lower
+    cutoffs = (n * alphas).astype(int)
+    kth = np.unique(np.concatenate([lower, upper, cutoffs[cutoffs > 0] - 1]))
+    return lower, upper, fraction, cutoffs, kth
+
+
+def _tail_metrics(part, lower, upper, fraction, cutoffs):
+    """VaR and CVaR from returns partitioned (along axis 0) at every needed index."""
+    batch_shape = part.shape[1:]
+    frac = fraction.reshape((-1,) + (1,) * len(batch_shape))
+    var = part[lower] + frac * (part[upper] - part[lower])
+
+    cvar = np.full((len(cutoffs),) + batch_shape, np.nan)
+    for i, k in enumerate(cutoffs):
+        if k > 0:
+            # Everything before pivot k - 1 is among the k smallest
+            cvar[i] = part[:k].mean(axis=0, dtype=np.float64)
+    return var, cvar
+
+
+def _normalized(scenario_weights):
+    scenario_weights = np.asarray(scenario_weights, dtype=float)
+    return scenario_weights / scenario_weights.sum()
+
+
+def _weighted_tail_metrics(returns, probabilities, alphas):
+    """
+    VaR and CVaR of weighted scenarios (along axis 0) from one sort.
+
+    VaR is the alpha-quantile of the weighted distribution (no
+    interpolation); CVaR is the probability-weighted mean of the lowest
+    returns holding exactly alpha of the mass, the boundary scenario
+    counted fractionally.
+    """
+    order = np.argsort(returns, axis=0)
+    ordered = np.take_along_axis(returns, order, axis=0)
+    mass = probabilities[order]
+    cum_mass = np.cumsum(mass, axis=0)
+    cum_value = np.cumsum(mass * ordered, axis=0)
+
+    batch_shape = returns.shape[1:]
+    var = np.empty((len(alphas),) + batch_shape)
+    cvar = np.empty((len(alphas),) + batch_shape)
+    for i, alpha in enumerate(alphas):
+        # First scenario at which the cumulative mass reaches alpha
+        boundary = np.minimum((cum_mass < alpha - 1e-12).sum(axis=0), len(returns) - 1)
+        boundary = np.expand_dims(boundary, 0)
+        below = boundary - 1
+        mass_below = np.where(below >= 0, np.take_along_axis(cum_mass, np.maximum(below, 0), 0), 0.0)
+        value_below = np.where(below >= 0, np.take_along_axis(cum_value, np.maximum(below, 0), 0), 0.0)
+        var[i] = np.take_along_axis(ordered, boundary, axis=0)[0]
+        cvar[i] = (value_below[0] + (alpha - mass_below[0]) * var[i]) / alpha
+    return var, cvar
+
+
+def tail_risk(returns, alphas, axis=0, scenario_weights=None):
+    """
+    VaR and CVaR at several tail probabilities from a single partition.
+
+    All order statistics needed by every alpha are selected with one
+    np.partition call instead of a full sort per metric. VaR interpolates
+    linearly between order statistics exactly like np.percentile; CVaR is
+    the mean of the worst int(n * alpha) scenarios, as in calculate_cvar.
+
+    With scenario_weights (e.g. importance-sampling likelihood ratios), the
+    scenarios are weighted by them instead and sorted once; see
+    _weighted_tail_metrics.
+
+    Args:
+        returns: 1D array of return scenarios, or a 2D batch of portfolios
+            with scenarios along `axis` (default: one portfolio per column)
+        alphas: tail probability or sequence of tail probabilities
+        axis: scenario axis of a 2D batch
+        scenario_weights: optional non-negative weight per scenario
+
+    Returns:
+        (var, cvar) with shape (n_alphas,) + batch shape, or just the batch
+        shape when alphas is a scalar
+    """
+    returns = np.moveaxis(np.asarray(returns), axis, 0)
+    scalar = np.ndim(alphas) == 0
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=float))
+
+    if scenario_weights is not None:
+        var, cvar = _weighted_tail_metrics(returns, _normalized(scenario_weights), alphas)
+    else:
+        lower, upper, fraction, cutoffs, kth = _tail_positions(returns.shape[0], alphas)
+        part = np.partition(returns, kth, axis=0)
+        var, cvar = _tail_metrics(part, lower, upper, fraction, cutoffs)
+
+    if scalar:
+        return var[0], cvar[0]
+    return var, cvar
+
+
+def tail_weights(returns, alpha=0.05, scenario_weights=None):
+    """
+    Weight of every scenario in the CVaR of returns, so that CVaR = q @ returns.
+
+    Unweighted, q is 1 / k on the worst k = int(n * alpha) scenarios; with
+    scenario_weights, it is the tail's share of the normalized weights
+    divided by alpha, as in tail_risk.
+    """
+    n = len(returns)
+    q = np.zeros(n)
+    if scenario_weights is None:
+        k = int(n * alpha)
+        if k > 0:
+            q[np.argpartition(returns, k - 1)[:k]] = 1.0 / k
+        return q
+
+    probabilities = _normalized(scenario_weights)
+    order = np.argsort(returns)
+    cum_mass = np.cumsum(probabilities[order])
+    boundary = min(int((cum_mass < alpha - 1e-12).sum()), n - 1)
+    q[order[:boundary]] = probabilities[order[:boundary]]
+    q[order[boundary]] = alpha - (cum_mass[boundary - 1] if boundary > 0 else 0.0)
+    return q / alpha
+
+
+def portfolio_moments(returns, axis=0, scenario_weights=None):
+    """
+    Mean and (population) standard deviation of returns along axis.
+
+    With scenario_weights, both are weighted by the normalized weights.
+    Both are accumulated in float64 whatever the precision of returns.
+    """
+    returns = np.asarray(returns)
+    if scenario_weights is None:
+        return returns.mean(axis=axis, dtype=np.float64), returns.std(axis=axis, dtype=np.float64)
+    probabilities = _normalized(scenario_weights)
+    returns = np.moveaxis(returns, axis, -1)
+    mean = returns @ probabilities
+    deviation = returns - mean[..., None]
+    return mean, np.sqrt((deviation * deviation) @ probabilities)
+
+
+def iter_row_chunks(scenarios, chunk_rows=65536):
+    """Yield consecutive row blocks of a (possibly memory-mapped) scenario matrix."""
+    for start in range(0, len(scenarios), chunk_rows):
+        yield np.asarray(scenarios[start:start + chunk_rows])
+
+
+def chunked_portfolio_stats(weights_matrix, scenarios, alphas=0.05, chunk_rows=65536,
+                            block_size=None):
+    """
+    Mean, std, VaR and CVaR of many portfolios in one pass over scenario rows.
+
+    Only one block of rows is in memory at a time, so scenarios can be a
+    memory-mapped matrix far larger than RAM. Moments are accumulated as
+    shifted sums; for the tail, the smallest returns seen so far are kept
+    per portfolio, just enough of them to cover every alpha. Each block of
+    rows is read once and evaluated against all the portfolios, block_size
+    portfolios at a time, so the scratch space stays bounded however many
+    portfolios share the pass.
+
+    Args:
+        weights_matrix: 2D array of shape (n_portfolios, n_assets)
+        scenarios: 2D array of shape (n_samples, n_assets)
+        alphas: tail probability or sequence of tail probabilities
+        chunk_rows: scenario rows per block
+        block_size: portfolios per matrix product (default: all of them)
+
+    Returns:
+        dict with mean and std of shape (n_portfolios,), and var and cvar
+        of shape (n_alphas, n_portfolios), or (n_portfolios,) for a scalar
+        alpha
+    """
+    weights_matrix = np.atleast_2d(np.asarray(weights_matrix, dtype=float))
+    scalar = np.ndim(alphas) == 0
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=float))
+    n_samples = len(scenarios)
+    n_portfolios = len(weights_matrix)
+    block_size = block_size or n_portfolios
+
+    lower, upper, fraction, cutoffs, kth = _tail_positions(n_samples, alphas)
+    n_keep = int(kth.max()) + 1
+
+    shift = np.empty(n_portfolios)
+    total = np.zeros(n_portfolios)
+    total_sq = np.zeros(n_portfolios)
+    smallest = np.empty((n_portfolios, n_keep))
+    kept = 0
+    for chunk in iter_row_chunks(scenarios, chunk_rows):
+        merged_width = min(n_keep, kept + len(chunk))
+        for start in range(0, n_portfolios, block_size):
+            rows = slice(start, start + block_size)
+            port_ret = weights_matrix[rows] @ chunk.T
+            if kept == 0:
+                shift[rows] = port_ret.mean(axis=1)
+            deviation = port_ret - shift[rows, None]
+            total[rows] += deviation.sum(axis=1)
+            total_sq[rows] += np.einsum('ij,ij->i', deviation, deviation)
+
+            merged = np.concatenate([smallest[rows, :kept], port_ret], axis=1)
+            if merged.shape[1] > n_keep:
+                merged = np.partition(merged, n_keep - 1, axis=1)[:, :n_keep]
+            smallest[rows, :merged_width] = merged
+        kept = merged_width
+
+    mean_shift = total / n_samples
+    std = np.sqrt(np.maximum(total_sq / n_samples - mean_shift**2, 0.0))
+
+    part = np.partition(smallest[:, :kept], kth, axis=1).T
+    var, cvar = _tail_metrics(part, lower, upper, fraction, cutoffs)
+    if scalar:
+        var, cvar = var[0], cvar[0]
+
+    return {
+        'mean': shift + mean_shift,
+        'std': std,
+        'var': var,
+        'cvar': cvar,
+    }
+
+
+def scenario_moments(scenarios, chunk_rows=65536, scenario_weights=None):
+    """
+    Mean vector and (population) covariance matrix of the asset returns.
+
+    Accumulated as shifted sums over row chunks, so memory-mapped scenarios
+    are never loaded whole. With scenario_weights, scenarios are weighted
+    by the normalized weights.
+
+    Returns:
+        (mean of shape (n_assets,), covariance of shape (n_assets, n_assets))
+    """
+    n_samples = len(scenarios)
+    if scenario_weights is None:
+        probabilities = np.full(n_samples, 1.0 / n_samples)
+    else:
+        probabilities = _normalized(scenario_weights)
+    shift = None
+    start = 0
+    for chunk in iter_row_chunks(scenarios, chunk_rows):
+        p = probabilities[start:start + len(chunk)]
+        start += len(chunk)
+        if shift is None:
+            shift = chunk.mean(axis=0, dtype=np.float64)
+            total = np.zeros_like(shift)
+            total_outer = np.zeros((len(shift), len(shift)))
+        deviation = chunk - shift
+        total += p @ deviation
+        total_outer += deviation.T @ (deviation * p[:, None])
+
+    return shift + total, total_outer - np.outer(total, total)
+
+
+def replicate_estimates(weights, replicates, alpha=0.05):
+    """
+    Portfolio statistics averaged over scenario replicates, with standard errors.
+
+    Args:
+        weights: array of portfolio weights
+        replicates: array of shape (n_replicates, n_samples, n_assets), e.g.
+            from scenarios.sample_replicates
+        alpha: CVaR tail probability
+
+    Returns:
+        dict with 'mean', 'std', 'sharpe' and 'cvar' (averages over the
+        replicates) and the matching '<name>_stderr' standard errors
+    """
+    returns = np.asarray(replicates) @ np.asarray(weights, dtype=float)
+    mean = returns.mean(axis=1)
+    std = returns.std(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_replicate = {
+            'mean': mean,
+            'std': std,
+            'sharpe': mean / std,
+            'cvar': tail_risk(returns, alpha, axis=1)[1],
+        }
+
+    n_replicates = len(returns)
+    estimates = {}
+    for name, values in per_replicate.items():
+        estimates[name] = values.mean()
+        estimates[f'{name}_stderr'] = (values.std(ddof=1) / np.sqrt(n_replicates) if n_replicates > 1
+                                       else np.nan)
+    return estimates
+
+
+def calculate_cvar(returns, alpha=0.05, scenario_weights=None):
     """
     Calculate CVaR (Conditional Value at Risk) at level alpha.
 
@@ -25,34 +316,35 @@ def calculate_cvar(returns, alpha=0.05):
     Args:
         returns: array of return scenarios
         alpha: tail probability (default 0.05 = worst 5%)
+        scenario_weights: optional weight per scenario, e.g. likelihood
+            ratios of importance-sampled scenarios
 
     Returns:
         CVaR value (will be negative for losses)
     """
-    cutoff_index = int(len(returns) * alpha)
-    sorted_returns = np.sort(returns)
-    tail_returns = sorted_returns[:cutoff_index]
-    return tail_returns.mean()
+    return tail_risk(returns, alpha, scenario_weights=scenario_weights)[1]
 
 
-def calculate_var(returns, alpha=0.05):
+def calculate_var(returns, alpha=0.05, scenario_weights=None):
     """
     Calculate VaR (Value at Risk) at level alpha.
     VaR is the return at the alpha percentile.
     """
-    return np.percentile(returns, alpha * 100)
+    return tail_risk(returns, alpha, scenario_weights=scenario_weights)[0]
 
 
-def calculate_sharpe(returns, risk_free_rate=0.0):
+def calculate_sharpe(returns, risk_free_rate=0.0, scenario_weights=None):
     """
     Calculate Sharpe ratio.
 
     Args:
         returns: array of return scenarios
         risk_free_rate: risk-free rate (default 0)
+        scenario_weights: optional weight per scenario
 
     Returns:
         Sharpe ratio
     """
-    excess_returns = returns - risk_free_rate
-    return excess_returns.mean() / excess_returns.std()
\ No newline at end of file
+    mean, std = portfolio_moments(np.asarray(returns) - risk_free_rate,
+                                  scenario_weights=scenario_weights)
+    return mean / std
\ No newline at end of file
@@ -0,0 +1,394 @@
+import contextvars
+import hashlib
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .correlation import (
+    AssetUniverse,
+    FactorCorrelation,
+    as_universe,
+    sample_correlated_assets,
+    scenario_dtype,
+    sample_tail_weighted,
+)
+from .metrics import count
+
+
+def scenario_key(assets, corr_matrix, n_samples, seed, **options):
+    """
+    Canonical hash of everything that determines a scenario matrix.
+
+    Asset names are left out since they do not affect the samples; all
+    numeric inputs are hashed as float64 bytes so that e.g. lists and arrays
+    with equal values give the same key.
+    """
+    if isinstance(assets, AssetUniverse):
+        corr_matrix = assets.corr_matrix
+    h = hashlib.sha256()
+    for asset in assets:
+        for values in (asset.weights, asset.means, asset.stds):
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            h.update(repr(values.shape).encode())
+            h.update(values.tobytes())
+    if isinstance(corr_matrix, FactorCorrelation):
+        # Factor models sample differently from the equivalent dense matrix
+        h.update(b'factor')
+        arrays = (corr_matrix.loadings, corr_matrix.idiosyncratic)
+    else:
+        arrays = (corr_matrix,)
+    for values in arrays:
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        h.update(repr(values.shape).encode())
+        h.update(values.tobytes())
+    h.update(repr((int(n_samples), seed, sorted(options.items()))).encode())
+    return h.hexdigest()
+
+
+class ScenarioCache:
+    """Thread-safe LRU cache of scenario matrices, bounded by total bytes."""
+
+    def __init__(self, max_bytes=512 * 2**20):
+        """
+        Args:
+            max_bytes: total size of cached arrays before the least recently
+                used entries are evicted
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Cached array for key (marked most recently used), or None."""
+        with self._lock:
+            samples = self._entries.get(key)
+            if samples is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return samples
+
+    def put(self, key, samples):
+        """
+        Cache samples under key, evicting least recently used entries.
+
+        Cached arrays are made read-only since every hit shares them. Arrays
+        larger than max_bytes are not cached at all.
+        """
+        if samples.nbytes > self.max_bytes:
+            return
+        samples.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key).nbytes
+            self._entries[key] = samples
+            self.nbytes += samples.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Counters for monitoring."""
+        return {
+            'entries': len(self._entries),
+            'nbytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class ScenarioStore:
+    """
+    Scenario matrices saved as .npy files and opened memory-mapped.
+
+    Files are named by scenario_key, so any process pointed at the same
+    directory reuses them, including after restarts.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, f"{key}.npy")
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def load(self, key):
+        """Read-only memory map of the stored matrix."""
+        return np.load(self.path(key), mmap_mode='r')
+
+    def create(self, key, shape, fill_chunks, dtype=np.float64):
+        """
+        Write a matrix row block by row block without holding it in memory.
+
+        Args:
+            key: scenario key
+            shape: (n_samples, n_assets)
+            fill_chunks: iterable of consecutive row blocks covering shape
+            dtype: element type of the stored matrix
+
+        Returns:
+            read-only memory map of the new file
+        """
+        # Write under a temporary name so readers never see a partial file
+        tmp_path = f"{self.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+        start = 0
+        for chunk in fill_chunks:
+            out[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        out.flush()
+        del out
+        os.replace(tmp_path, self.path(key))
+        return self.load(key)
+
+
+# Process-wide cache shared by the optimizers and API requests
+SCENARIO_CACHE = ScenarioCache()
+
+# Rows drawn from each random stream of seeded scenarios
+SCENARIO_BLOCK_ROWS = 65536
+
+
+def _sample_block(assets, corr_matrix, n_rows, seed_seq, sampling_options):
+    rng = np.random.default_rng(seed_seq)
+    if 'tail_shift' in sampling_options:
+        # Likelihood-ratio weights travel as an extra last column
+        return np.column_stack(sample_tail_weighted(assets, corr_matrix, n_rows, rng=rng,
+                                                    **sampling_options))
+    return sample_correlated_assets(assets, corr_matrix, n_rows, rng=rng, **sampling_options)
+
+
+def iter_scenario_blocks(assets, corr_matrix, n_samples, seed, block_rows=SCENARIO_BLOCK_ROWS,
+                         n_workers=1, progress=None, **sampling_options):
+    """
+    Seeded scenarios as consecutive row blocks, each from its own stream.
+
+    Block i holds rows i * block_rows onwards and is drawn from the i-th
+    child of np.random.SeedSequence(seed), so its values depend only on the
+    seed, block_rows and the inputs, not on how many blocks are computed at
+    once. With n_workers > 1, blocks are sampled in a thread pool (NumPy
+    releases the GIL for most of the work), at most 2 * n_workers ahead of
+    the consumer.
+
+    Args:
+        assets: list of Asset objects, or an AssetUniverse
+        corr_matrix: correlation matrix (None with an AssetUniverse)
+        n_samples: number of scenarios
+        seed: random seed, or a np.random.SeedSequence
+        block_rows: rows per block and random stream
+        n_workers: number of threads sampling blocks; None uses every core
+        progress: optional callback progress(stage, fraction) reporting the
+            'sampling' stage as blocks complete
+        **sampling_options: passed on to sample_correlated_assets, or to
+            sample_tail_weighted when they include tail_shift
+
+    Yields:
+        arrays of shape (rows, n_assets), in order; with tail_shift, each
+        row ends with its likelihood-ratio weight
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    # Validate and factorize once for all blocks
+    universe = as_universe(assets, corr_matrix)
+    seed_seq = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    starts = range(0, n_samples, block_rows)
+    jobs = [(min(block_rows, n_samples - start), child)
+            for start, child in zip(starts, seed_seq.spawn(len(starts)))]
+
+    if n_workers == 1 or len(jobs) == 1:
+        for i, (n_rows, child) in enumerate(jobs):
+            yield _sample_block(universe, None, n_rows, child, sampling_options)
+            if progress is not None:
+                progress('sampling', (i + 1) / len(jobs))
+        return
+
+    # Build the factor and quantile tables once, before threads race to build them
+    universe.factor
+    if sampling_options.get('ppf_method', 'table') == 'table':
+        universe.quantile_tables(sampling_options.get('ppf_tol', 1e-6))
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = deque()
+        next_job = 0
+        for i in range(len(jobs)):
+            while next_job < len(jobs) and len(pending) < 2 * n_workers:
+                n_rows, child = jobs[next_job]
+                # In a copy of the caller's context, so metrics reach its collectors
+                pending.append(executor.submit(contextvars.copy_context().run, _sample_block,
+                                               universe, None, n_rows, child, sampling_options))
+                next_job += 1
+            yield pending.popleft().result()
+            if progress is not None:
+                progress('sampling', (i + 1) / len(jobs))
+
+
+def generate_scenarios(assets, corr_matrix, n_samples, seed, block_rows=SCENARIO_BLOCK_ROWS,
+                       n_workers=1, progress=None, **sampling_options):
+    """
+    Seeded scenarios drawn block by block; see iter_scenario_blocks.
+
+    The result is bit-identical for any n_workers.
+
+    Returns:
+        array of shape (n_samples, n_assets), plus a trailing weight column
+        with tail_shift, of the sampling dtype
+    """
+    samples = np.empty((n_samples, len(assets) + ('tail_shift' in sampling_options)),
+                       dtype=sampling_options.get('dtype', 'float64'))
+    start = 0
+    for block in iter_scenario_blocks(assets, corr_matrix, n_samples, seed, block_rows, n_workers,
+                                      progress, **sampling_options):
+        samples[start:start + len(block)] = block
+        start += len(block)
+    return samples
+
+
+def sample_replicates(assets, corr_matrix, n_samples, n_replicates, seed=None, sampler='sobol',
+                      **sampling_options):
+    """
+    Independently randomized scenario sets, for error estimates.
+
+    Each replicate is drawn from its own child of np.random.SeedSequence(seed);
+    with sampler='sobol' that means an independent scrambling of the same
+    Sobol sequence, so the spread of an estimate across replicates measures
+    its quasi-Monte Carlo error (see risk.replicate_estimates).
+
+    Args:
+        assets: list of Asset objects, or an AssetUniverse
+        corr_matrix: correlation matrix (None with an AssetUniverse)
+        n_samples: scenarios per replicate
+        n_replicates: number of replicates
+        seed: random seed (None for fresh entropy)
+        sampler: 'sobol' or 'random', as in sample_correlated_assets
+        **sampling_options: passed on to sample_correlated_assets
+
+    Returns:
+        array of shape (n_replicates, n_samples, n_assets)
+    """
+    children = np.random.SeedSequence(seed).spawn(n_replicates)
+    universe = as_universe(assets, corr_matrix)
+    return np.stack([
+        sample_correlated_assets(universe, None, n_samples, rng=np.random.default_rng(child),
+                                 sampler=sampler, **sampling_options)
+        for child in children
+    ])
+
+
+def _seeded_scenarios(assets, corr_matrix, n_samples, seed, use_cache, cache, store, block_rows,
+                      n_workers, progress, sampling_options):
+    """get_scenarios for a seed: look up, or generate and keep, the keyed matrix."""
+    key = scenario_key(assets, corr_matrix, n_samples, seed, block_rows=block_rows,
+                       **sampling_options)
+    if store is not None:
+        if use_cache and key in store:
+            count('scenario_cache_hits')
+            return store.load(key)
+        count('scenario_cache_misses')
+        blocks = iter_scenario_blocks(assets, corr_matrix, n_samples, seed, block_rows, n_workers,
+                                      progress, **sampling_options)
+        return store.create(key, (n_samples, len(assets)), blocks,
+                            sampling_options.get('dtype', 'float64'))
+
+    cache = SCENARIO_CACHE if cache is None else cache
+    if use_cache:
+        samples = cache.get(key)
+        if samples is not None:
+            count('scenario_cache_hits')
+            if progress is not None:
+                progress('sampling', 1.0)
+            return samples
+        count('scenario_cache_misses')
+
+    samples = generate_scenarios(assets, corr_matrix, n_samples, seed, block_rows, n_workers,
+                                 progress, **sampling_options)
+    if use_cache:
+        cache.put(key, samples)
+    return samples
+
+
+def get_scenarios(assets, corr_matrix, n_samples, seed=None, use_cache=True, cache=None,
+                  store=None, block_rows=SCENARIO_BLOCK_ROWS, n_workers=1, progress=None,
+                  tail_shift=None, **sampling_options):
+    """
+    Correlated scenarios for the given inputs, reused across calls.
+
+    Seeded scenarios come from generate_scenarios, which uses its own random
+    streams rather than the global random state, and are cached; with
+    seed=None the scenarios are drawn from the global random state, so there
+    is nothing to key on. With a ScenarioStore, seeded scenarios are written
+    straight to disk block by block and returned memory-mapped instead of
+    being held in the in-memory cache.
+
+    Args:
+        assets: list of Asset objects, or an AssetUniverse
+        corr_matrix: correlation matrix (None with an AssetUniverse)
+        n_samples: number of scenarios
+        seed: random seed
+        use_cache: set to False to always resample instead of reusing cached
+            or stored scenarios
+        cache: ScenarioCache to use (default: the process-wide SCENARIO_CACHE)
+        store: optional ScenarioStore for on-disk, memory-mapped scenarios
+        block_rows: rows per random stream of seeded scenarios; part of the
+            cache key, since it determines the values
+        n_workers: number of threads sampling seeded scenarios (does not
+            change the result)
+        progress: optional callback progress(stage, fraction) reporting the
+            'sampling' stage
+        tail_shift: if given, importance-sample the lower tail with this
+            shift (see sample_tail_weighted) and also return the
+            likelihood-ratio weights. Not supported with a store.
+        **sampling_options: passed on to sample_correlated_assets or
+            sample_tail_weighted; dtype='float32' gives single-precision
+            scenarios (cached and stored at half the size, and seeded
+            weights rounded to single precision too)
+
+    Returns:
+        array of shape (n_samples, n_assets), read-only when cached; with
+        tail_shift, (samples, scenario weights)
+    """
+    # One cache key per precision however it is spelled, with the float64
+    # default left out as before
+    dtype = scenario_dtype(sampling_options.pop('dtype', 'float64'))
+    if dtype != 'float64':
+        sampling_options['dtype'] = dtype
+    if seed is None:
+        if tail_shift is not None:
+            return sample_tail_weighted(assets, corr_matrix, n_samples, tail_shift,
+                                        progress=progress, **sampling_options)
+        return sample_correlated_assets(assets, corr_matrix, n_samples, progress=progress,
+                                        **sampling_options)
+
+    if tail_shift is not None:
+        if store is not None:
+            raise ValueError("Importance-sampled scenarios cannot be stored memory-mapped")
+        # Cached with the weights as a trailing column
+        stacked = _seeded_scenarios(assets, corr_matrix, n_samples, seed, use_cache, cache, None,
+                                    block_rows, n_workers, progress,
+                                    dict(sampling_options, tail_shift=tail_shift))
+        return stacked[:, :-1], stacked[:, -1]
+    return _seeded_scenarios(assets, corr_matrix, n_samples, seed, use_cache, cache, store,
+                             block_rows, n_workers, progress, sampling_options)
@@ -0,0 +1,167 @@
+"""
+Runtime benchmarks of the optimizer stages.
+
+Times PPF sampling, grid enumeration, grid evaluation and the continuous
+solve over a matrix of asset counts, grid steps and sample counts, writes
+the timings as JSON together with the cost model fitted to them, and can
+compare a run against an earlier one:
+
+    python benchmarks/run_benchmarks.py --output benchmarks/results.json
+    python benchmarks/run_benchmarks.py --quick --baseline benchmarks/results.json
+
+The fitted coefficients can be used by the app through the COST_MODEL
+config setting (a path to the results file).
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import Asset, SCENARIO_CACHE, optimize_portfolio_continuous, sample_correlated_assets  # noqa: E402
+from backend.costmodel import CostModel  # noqa: E402
+from backend.evaluation import evaluate_portfolios  # noqa: E402
+from backend.optimisation import count_weight_grid, weight_grid_array  # noqa: E402
+
+
+def make_problem(n_assets):
+    """Fresh assets (no cached quantile tables) and an equicorrelated matrix."""
+    assets = [
+        Asset(f"Asset{i}", [0.8, 0.2], [0.06 + 0.02 * i, -0.15], [0.10 + 0.01 * i, 0.25])
+        for i in range(n_assets)
+    ]
+    corr = np.full((n_assets, n_assets), 0.2)
+    np.fill_diagonal(corr, 1.0)
+    return assets, corr
+
+
+def best_time(fn, repeat):
+    """Fastest of repeat runs of fn(), in seconds, and the last result."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(assets_list, steps, sample_counts, repeat=3, max_points=2_000_000, max_work=2e9):
+    """
+    Benchmark records, one per stage and configuration.
+
+    Grids with more than max_points points are not enumerated, and grid
+    evaluations of more than max_work portfolio-scenario pairs are skipped.
+    """
+    records = []
+
+    def record(stage, n_assets, n_samples, seconds, step=None, n_points=0):
+        records.append({'stage': stage, 'n_assets': n_assets, 'n_samples': n_samples,
+                        'step': step, 'n_points': n_points, 'seconds': seconds})
+        label = f"step={step}" if step is not None else ''
+        print(f"{stage:12s} assets={n_assets:<3d} samples={n_samples:<7d} {label:11s} "
+              f"{seconds * 1000:10.1f} ms")
+
+    for n_assets in assets_list:
+        for n_samples in sample_counts:
+            rng = np.random.default_rng(0)
+
+            def sample():
+                assets, corr = make_problem(n_assets)
+                return sample_correlated_assets(assets, corr, n_samples, rng=rng)
+
+            seconds, samples = best_time(sample, repeat)
+            record('sampling', n_assets, n_samples, seconds)
+
+            assets, corr = make_problem(n_assets)
+            kwargs = dict(n_samples=n_samples, cvar_limit=-0.15, seed=0)
+            optimize_portfolio_continuous(assets, corr, **kwargs)  # Cache the scenarios
+            seconds, _ = best_time(lambda: optimize_portfolio_continuous(assets, corr, **kwargs),
+                                   repeat)
+            record('continuous', n_assets, n_samples, seconds)
+            SCENARIO_CACHE.clear()
+
+            for step in steps:
+                n_points = count_weight_grid(n_assets, step)
+                if n_points > max_points:
+                    continue
+                seconds, grid = best_time(lambda: weight_grid_array(n_assets, step), repeat)
+                if n_samples == sample_counts[0]:
+                    record('enumeration', n_assets, n_samples, seconds, step, n_points)
+                if n_points * n_samples > max_work:
+                    continue
+                seconds, _ = best_time(lambda: evaluate_portfolios(samples, grid), repeat)
+                record('evaluation', n_assets, n_samples, seconds, step, n_points)
+
+    return records
+
+
+def compare(records, baseline, tolerance):
+    """Print timings slower than the baseline by more than tolerance; return how many."""
+    def key(r):
+        return r['stage'], r['n_assets'], r['n_samples'], r.get('step')
+
+    previous = {key(r): r['seconds'] for r in baseline['records']}
+    regressions = 0
+    for r in records:
+        before = previous.get(key(r))
+        if before is None or before < 1e-4:
+            continue
+        ratio = r['seconds'] / before
+        if ratio > 1 + tolerance:
+            regressions += 1
+            print(f"REGRESSION {key(r)}: {before * 1000:.1f} ms -> {r['seconds'] * 1000:.1f} ms "
+                  f"({ratio:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--assets', type=int, nargs='+', default=[2, 3, 4, 5, 6])
+    parser.add_argument('--steps', type=float, nargs='+', default=[0.1, 0.05, 0.02])
+    parser.add_argument('--samples', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true',
+                        help='small matrix for a fast regression check')
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown relative to the baseline reported as a regression')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.assets, args.steps, args.samples, args.repeat = [2, 4], [0.1, 0.05], [1000, 5000], 2
+
+    records = run(args.assets, args.steps, args.samples, args.repeat)
+    model = CostModel.fit(records)
+    results = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'records': records,
+        'cost_model': model.coefficients,
+    }
+    print(json.dumps({'cost_model': model.coefficients}, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(records, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,55 @@
+import base64
+import os
+import time
+import uuid
+
 import numpy as np
-from flask import Blueprint, render_template, jsonify, request
+from flask import Blueprint, Response, current_app, render_template, jsonify, request
 
 from backend import (
     Asset,
+    AssetUniverse,
+    FactorCorrelation,
+    SCENARIO_CACHE,
+    ScenarioStore,
+    cross_validate,
     validate_correlation_matrix,
+    optimize_frontier_grid,
+    optimize_portfolio_continuous,
     optimize_portfolio_grid,
     portfolio_returns,
-    calculate_cvar,
-    calculate_sharpe,
+    tail_risk,
 )
+from backend.correlation import SCENARIO_DTYPES
+from backend.costmodel import CostModel
+from backend.jobs import JobCancelled, JobManager
+from backend.metrics import METRICS, collect, peak_rss_bytes, profiled, prometheus_text, timed
+from backend.optimisation import count_weight_grid
 
 bp = Blueprint('main', __name__)
 
+# Stages reported by the grid optimizers and cross_validate, in order
+OPTIMIZE_STAGES = ['sampling', 'evaluation']
+
+# Grids larger than this are searched coarse-to-fine by default
+ADAPTIVE_SEARCH_POINTS = 1_000_000
+
+# How /api/optimize returns the optimal portfolio's simulated returns:
+# 'list' as a JSON list, 'base64' as base64 little-endian float32, or
+# 'summary' with only the histogram (always included)
+RETURNS_FORMATS = ('list', 'base64', 'summary')
+
+# Histogram bins of the return distribution
+HISTOGRAM_BINS = 50
+
+# 'grid' and 'continuous' pick the optimizer; 'auto' lets the cost model
+# choose one that fits in time_budget seconds
+STRATEGIES = ('grid', 'continuous', 'auto')
+DEFAULT_TIME_BUDGET = 10.0
+
+# Cap on n_starts of the continuous optimizer
+MAX_STARTS = 32
+
 
 @bp.route('/')
 def index():
@@ -37,58 +75,233 @@ def validate_correlation():
     })
 
 
-@bp.route('/api/optimize', methods=['POST'])
-def optimize():
-    """Run portfolio optimization."""
-    data = request.get_json()
+@bp.route('/api/scenario-cache')
+def scenario_cache():
+    """Scenario cache size and hit/miss counters."""
+    return jsonify(SCENARIO_CACHE.stats())
 
-    try:
-        # Parse assets
-        assets_data = data.get('assets', [])
-        assets = []
-        for a in assets_data:
-            asset = Asset(
-                name=a['name'],
-                weights=a['weights'],
-                means=a['means'],
-                stds=a['stds']
-            )
-            assets.append(asset)
 
-        correlation_matrix = data.get('correlation_matrix')
-        cvar_limit = data.get('cvar_limit', -0.15)
-        n_samples = min(data.get('n_samples', 5000), 20000)  # Cap at 20k
-
-        # Parse asset bounds (list of [min, max] pairs)
-        asset_bounds_raw = data.get('asset_bounds')
-        asset_bounds = None
-        if asset_bounds_raw:
-            asset_bounds = [tuple(b) for b in asset_bounds_raw]
-
-        # Parse step/granularity (default 0.05 = 5%)
-        step = data.get('step', 0.05)
-        step = max(0.005, min(0.2, step))  # Clamp to reasonable range
-
-        # Validate correlation matrix
-        is_valid, msg = validate_correlation_matrix(correlation_matrix)
-        if not is_valid:
-            return jsonify({'error': f'Invalid correlation matrix: {msg}'})
-
-        # Run optimization
-        np.random.seed(42)  # For reproducibility
-        result = optimize_portfolio_grid(
-            assets,
-            correlation_matrix,
-            n_samples=n_samples,
-            cvar_limit=cvar_limit,
-            step=step,
-            asset_bounds=asset_bounds
+@bp.route('/metrics')
+def metrics():
+    """
+    Stage timings, counters and memory gauges in the Prometheus text format.
+
+    Covers the requests served by this process; /api/jobs runs in worker
+    processes, whose results carry a timings block instead.
+    """
+    cache = SCENARIO_CACHE.stats()
+    gauges = {
+        'scenario_cache_entries': cache['entries'],
+        'scenario_cache_bytes': cache['nbytes'],
+    }
+    return Response(prometheus_text(METRICS, gauges), mimetype='text/plain; version=0.0.4')
+
+
+def parse_problem(data, store=None):
+    """
+    Assets (as an AssetUniverse) and search settings from an /api/optimize
+    style payload.
+
+    Args:
+        data: request JSON
+        store: optional ScenarioStore for the seeded scenarios (see
+            get_scenario_store)
+
+    Raises:
+        ValueError: if the correlation matrix or factor model is invalid
+    """
+    # Parse assets
+    assets_data = data.get('assets', [])
+    assets = []
+    for a in assets_data:
+        asset = Asset(
+            name=a['name'],
+            weights=a['weights'],
+            means=a['means'],
+            stds=a['stds']
         )
+        assets.append(asset)
+
+    # Either a dense correlation_matrix or, for large universes, a factor
+    # model: factor_loadings (assets x factors) and optional idiosyncratic
+    # variances
+    if data.get('factor_loadings') is not None:
+        correlation_matrix = FactorCorrelation(data['factor_loadings'], data.get('idiosyncratic'))
+    else:
+        correlation_matrix = data.get('correlation_matrix')
+
+    # Parse asset bounds (list of [min, max] pairs)
+    asset_bounds_raw = data.get('asset_bounds')
+    asset_bounds = None
+    if asset_bounds_raw:
+        asset_bounds = [tuple(b) for b in asset_bounds_raw]
+
+    # Parse step/granularity (default 0.05 = 5%)
+    step = data.get('step', 0.05)
+    step = max(0.005, min(0.2, step))  # Clamp to reasonable range
+
+    sampler = data.get('sampler', 'random')
+    if sampler not in ('random', 'sobol'):
+        raise ValueError(f'Unknown sampler: {sampler}')
+
+    precision = data.get('precision', 'float64')
+    if precision not in SCENARIO_DTYPES:
+        raise ValueError(f'precision must be one of {", ".join(SCENARIO_DTYPES)}')
+
+    # Convert and validate once; the optimizers reuse the universe's
+    # factorization and quantile tables
+    universe = AssetUniverse(assets, correlation_matrix)
+    if not universe.is_valid:
+        raise ValueError(f'Invalid correlation matrix: {universe.validation_message}')
+
+    # Fixed seed for reproducibility, which also lets repeated requests for
+    # the same inputs reuse their scenarios: from the in-memory cache of the
+    # same process, or from the store across processes (the web process
+    # and the job workers, so /api/cross-validate and /api/frontier after
+    # an /api/jobs optimization only share its scenarios with a store)
+    return {
+        'assets': universe,
+        'corr_matrix': None,
+        'cvar_limit': data.get('cvar_limit', -0.15),
+        'n_samples': min(data.get('n_samples', 5000), 20000),  # Cap at 20k
+        'step': step,
+        'asset_bounds': asset_bounds,
+        'seed': 42,
+        'use_cache': data.get('use_cache', True),
+        'store': store,
+        # Processes evaluating the grid (default 1, at most one per core)
+        'n_workers': max(1, min(int(data.get('n_workers', 1)), os.cpu_count() or 1)),
+        # 'random' or 'sobol' (quasi-Monte Carlo) scenarios
+        'sampler': sampler,
+        # Scenario precision of the grid search; the continuous optimizer
+        # always works in float64
+        'dtype': precision,
+    }
+
+
+def returns_histogram(returns, bins=HISTOGRAM_BINS):
+    """Histogram of returns as {'edges': bins + 1 values, 'counts': bins values}."""
+    counts, edges = np.histogram(returns, bins=bins)
+    return {'edges': edges.tolist(), 'counts': counts.tolist()}
+
+
+def encode_returns(returns, returns_format):
+    """
+    Response fields for a portfolio's simulated returns.
+
+    The histogram is enough to draw the distribution chart; the returns
+    themselves are only sent when asked for, as base64 float32 (a quarter
+    of the size of the JSON text, and decoded straight into a
+    Float32Array) or as a plain list.
+    """
+    fields = {'histogram': returns_histogram(returns)}
+    if returns_format == 'list':
+        fields['portfolio_returns'] = returns.tolist()
+    elif returns_format == 'base64':
+        fields['portfolio_returns'] = base64.b64encode(returns.astype('<f4').tobytes()).decode('ascii')
+        fields['returns_dtype'] = 'float32'
+    return fields
+
+
+def start_statistics(starts):
+    """JSON-safe summary of the continuous optimizer's starts."""
+    def finite(value):
+        return float(value) if np.isfinite(value) else None
+
+    return [{
+        'source': start['source'],
+        'weights': start['weights'].tolist(),
+        'sharpe': finite(start['sharpe']),
+        'cvar': finite(start['cvar']),
+        'feasible': start['feasible'],
+        'success': start['success'],
+        'message': start['message'],
+        'iterations': start['nit'],
+        'evaluations': start['nfev'],
+    } for start in starts]
+
+
+def request_timings(request_metrics, seconds):
+    """The timings block of a response: stages and counters of one request."""
+    return {
+        'total_seconds': seconds,
+        **request_metrics.snapshot(),
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def run_optimization(data, progress=None, cost_model=None, store=None):
+    """
+    Run a portfolio optimization for an /api/optimize payload.
+
+    Runs inside the request for /api/optimize and in a worker process for
+    /api/jobs, so it returns a plain dict: either the response body or
+    {'error': message}.
+
+    The optimizer is chosen by strategy (one of STRATEGIES, default
+    'grid'). The optimal portfolio's returns are encoded as set by
+    returns_format (one of RETURNS_FORMATS, default 'list'); see
+    encode_returns. With timings set, the response also has a timings
+    block of this request's stage seconds and counters (see
+    request_timings); response serialization happens after it is built,
+    so it is only in /metrics.
+
+    Args:
+        data: request JSON
+        progress: optional callback progress(stage, fraction)
+        cost_model: CostModel for strategy='auto' (default: the built-in
+            coefficients)
+        store: optional ScenarioStore, as in parse_problem
+    """
+    start = time.perf_counter()
+    with collect() as request_metrics, timed('request'):
+        response = _optimize(data, progress, cost_model, store)
+    if 'error' not in response and data.get('timings'):
+        response['timings'] = request_timings(request_metrics, time.perf_counter() - start)
+    return response
+
+
+def _optimize(data, progress, cost_model, store):
+    try:
+        returns_format = data.get('returns_format', 'list')
+        if returns_format not in RETURNS_FORMATS:
+            raise ValueError(f'returns_format must be one of {", ".join(RETURNS_FORMATS)}')
+        strategy = data.get('strategy', 'grid')
+        if strategy not in STRATEGIES:
+            raise ValueError(f'strategy must be one of {", ".join(STRATEGIES)}')
+        problem = parse_problem(data, store)
+        n_starts = max(1, min(int(data.get('n_starts', 1)), MAX_STARTS))
+
+        # Moment-based search finds the same portfolio as the exhaustive
+        # one while usually evaluating only a handful of grid points, but
+        # it still ranks the whole grid; beyond that, refine coarse-to-fine
+        search = data.get('search')
+        if search is None:
+            n_points = count_weight_grid(len(problem['assets']), problem['step'],
+                                         problem['asset_bounds'])
+            search = 'moments' if n_points <= ADAPTIVE_SEARCH_POINTS else 'adaptive'
+
+        if strategy == 'auto':
+            strategy = (cost_model or CostModel()).choose_strategy(
+                len(problem['assets']), problem['step'], problem['n_samples'],
+                problem['asset_bounds'],
+                time_budget=float(data.get('time_budget', DEFAULT_TIME_BUDGET)),
+                search=search, n_starts=n_starts)
+
+        if strategy == 'continuous':
+            result = optimize_portfolio_continuous(
+                problem['assets'], problem['corr_matrix'], n_samples=problem['n_samples'],
+                cvar_limit=problem['cvar_limit'], asset_bounds=problem['asset_bounds'],
+                seed=problem['seed'], use_cache=problem['use_cache'], sampler=problem['sampler'],
+                n_starts=n_starts, n_workers=problem['n_workers'], store=problem['store'],
+                progress=progress)
+        else:
+            result = optimize_portfolio_grid(**problem, search=search, progress=progress)
 
         if result['optimal_weights'] is None:
-            return jsonify({
+            return {
                 'error': 'No feasible portfolio found. Try relaxing the CVaR limit.'
-            })
+            }
 
         # Calculate portfolio returns for the optimal weights
         weights = np.array(result['optimal_weights'])
@@ -99,26 +312,251 @@ def optimize():
         optimal_sharpe = result['optimal_sharpe']
         optimal_cvar = result['optimal_cvar']
 
-        # Calculate percentiles (5th through 95th in steps of 5)
-        percentile_levels = list(range(5, 100, 5))  # 5, 10, 15, ..., 95
-        percentiles = {p: float(np.percentile(port_returns, p)) for p in percentile_levels}
-
-        # Calculate CVaR at multiple levels (5% through 50% in steps of 5)
-        cvar_levels = list(range(5, 55, 5))  # 5, 10, 15, ..., 50
-        cvars = {}
-        for level in cvar_levels:
-            cvars[level] = float(calculate_cvar(port_returns, alpha=level/100))
+        with timed('summary'):
+            # Percentiles (5th through 95th in steps of 5) and CVaR at 5% through
+            # 50% all come from one partition of the returns
+            levels = list(range(5, 100, 5))  # 5, 10, 15, ..., 95
+            var_values, cvar_values = tail_risk(port_returns, [level / 100 for level in levels])
+            percentiles = {p: float(v) for p, v in zip(levels, var_values)}
+            cvars = {level: float(c) for level, c in zip(levels, cvar_values) if level <= 50}
+            returns_fields = encode_returns(port_returns, returns_format)
 
-        return jsonify({
+        return {
             'optimal_weights': optimal_weights.tolist() if optimal_weights is not None else None,
             'sharpe': float(optimal_sharpe) if optimal_sharpe is not None and np.isfinite(optimal_sharpe) else None,
             'cvar': float(optimal_cvar) if optimal_cvar is not None and np.isfinite(optimal_cvar) else None,
             'mean': float(port_returns.mean()),
             'std': float(port_returns.std()),
-            'portfolio_returns': port_returns.tolist(),
+            **returns_fields,
             'percentiles': percentiles,
-            'cvars': cvars
-        })
+            'cvars': cvars,
+            'strategy': strategy,
+            # Grid points evaluated, of the whole grid (grid search only)
+            'n_evaluated': result.get('n_evaluated'),
+            'n_exhaustive': result.get('n_exhaustive'),
+            # Convergence of each SLSQP start (continuous optimizer only)
+            'starts': start_statistics(result['starts']) if 'starts' in result else None
+        }
 
+    except JobCancelled:
+        raise
     except Exception as e:
-        return jsonify({'error': str(e)})
\ No newline at end of file
+        return {'error': str(e)}
+
+
+@bp.route('/api/optimize', methods=['POST'])
+def optimize():
+    """
+    Run portfolio optimization.
+
+    When the PROFILE_DIR config setting is set, a request with profile set
+    is run under cProfile and its stats are written there (pstats format);
+    the response's profile field names the file.
+    """
+    data = request.get_json()
+    profile_dir = current_app.config.get('PROFILE_DIR')
+    if profile_dir and data.get('profile'):
+        os.makedirs(profile_dir, exist_ok=True)
+        filename = f'optimize-{uuid.uuid4().hex}.prof'
+        with profiled(os.path.join(profile_dir, filename)):
+            result = run_optimization(data, cost_model=get_cost_model(),
+                                      store=get_scenario_store())
+        result['profile'] = filename
+    else:
+        result = run_optimization(data, cost_model=get_cost_model(), store=get_scenario_store())
+    with timed('serialization'):
+        return jsonify(result)
+
+
+def _finite_or_none(value):
+    return float(value) if np.isfinite(value) else None
+
+
+def run_cross_validation(data, progress=None, store=None):
+    """
+    Cross-validate an optimization for an /api/cross-validate payload.
+
+    Like run_optimization, it runs inside the request or in a worker
+    process (for /api/jobs with kind 'cross-validate'), so it returns a
+    plain dict: either the response body or {'error': message}.
+    """
+    try:
+        problem = parse_problem(data, store)
+        n_folds = max(2, min(int(data.get('n_folds', 5)), 10))
+        result = cross_validate(n_folds=n_folds, progress=progress, **problem)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        return {'error': str(e)}
+
+    return {
+        'folds': [
+            {
+                'fold': r['fold'],
+                'weights': r['weights'].tolist(),
+                'train_sharpe': _finite_or_none(r['train_sharpe']),
+                'test_sharpe': _finite_or_none(r['test_sharpe']),
+                'train_cvar': _finite_or_none(r['train_cvar']),
+                'test_cvar': _finite_or_none(r['test_cvar']),
+            }
+            for r in result['fold_results']
+        ],
+        'mean_train_sharpe': _finite_or_none(result['mean_train_sharpe']),
+        'mean_test_sharpe': _finite_or_none(result['mean_test_sharpe']),
+        'sharpe_degradation': _finite_or_none(result['sharpe_degradation']),
+        'weight_stability': [_finite_or_none(v) for v in result['weight_stability']],
+    }
+
+
+@bp.route('/api/cross-validate', methods=['POST'])
+def cross_validate_optimization():
+    """
+    Out-of-sample check of an optimization (same payload as /api/optimize).
+
+    Each fold's best grid portfolio is picked on the other folds' scenarios
+    and scored on its own; n_folds (default 5) sets the number of folds.
+    This evaluates the whole grid in the request; the frontend runs it as
+    a job instead (kind 'cross-validate').
+    """
+    return jsonify(run_cross_validation(request.get_json(), store=get_scenario_store()))
+
+
+def _nan_to_none(values):
+    """Array as nested lists, with NaN as null."""
+    values = np.asarray(values, dtype=float)
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+def run_frontier(data, progress=None, store=None):
+    """
+    Efficient frontier for an /api/frontier payload.
+
+    Like run_optimization, it runs inside the request or in a worker
+    process (for /api/jobs with kind 'frontier'), so it returns a plain
+    dict: either the response body or {'error': message}.
+    """
+    try:
+        problem = parse_problem(data, store)
+        problem.pop('cvar_limit')
+        result = optimize_frontier_grid(
+            cvar_limits=data.get('cvar_limits'),
+            cvar_alphas=data.get('cvar_alphas', [0.05]),
+            n_points=max(2, min(int(data.get('n_points', 25)), 200)),
+            objective=data.get('objective', 'sharpe'),
+            progress=progress,
+            **problem
+        )
+    except JobCancelled:
+        raise
+    except Exception as e:
+        return {'error': str(e)}
+
+    return {
+        'cvar_alphas': result['cvar_alphas'].tolist(),
+        'cvar_limits': _nan_to_none(result['cvar_limits']),
+        'weights': _nan_to_none(result['weights']),
+        'sharpe': _nan_to_none(result['sharpe']),
+        'mean': _nan_to_none(result['mean']),
+        'std': _nan_to_none(result['std']),
+        'cvar': _nan_to_none(result['cvar']),
+    }
+
+
+@bp.route('/api/frontier', methods=['POST'])
+def frontier():
+    """
+    Efficient frontier (same payload as /api/optimize).
+
+    Optional cvar_limits (list; default n_points limits spanning the grid),
+    cvar_alphas (list, default [0.05]) and objective ('sharpe' or 'mean').
+    Arrays are indexed [alpha][limit], with null where no portfolio meets
+    the limit. This evaluates the whole grid in the request; the frontend
+    runs it as a job instead (kind 'frontier').
+    """
+    return jsonify(run_frontier(request.get_json(), store=get_scenario_store()))
+
+
+def get_cost_model():
+    """
+    The app's CostModel for strategy='auto', created on first use.
+
+    COST_MODEL may name a benchmark results or coefficients JSON file (see
+    benchmarks/run_benchmarks.py); otherwise the built-in coefficients are
+    used.
+    """
+    model = current_app.extensions.get('cost_model')
+    if model is None:
+        path = current_app.config.get('COST_MODEL')
+        model = CostModel.load(path) if path else CostModel()
+        current_app.extensions['cost_model'] = model
+    return model
+
+
+def get_scenario_store():
+    """
+    The app's ScenarioStore, or None to keep scenarios in memory only.
+
+    Set the SCENARIO_DIR config setting to share seeded scenarios between
+    the web process and the job workers (and across restarts) as
+    memory-mapped files named by scenario_key.
+    """
+    root = current_app.config.get('SCENARIO_DIR')
+    if not root:
+        return None
+    store = current_app.extensions.get('scenario_store')
+    if store is None:
+        store = ScenarioStore(root)
+        current_app.extensions['scenario_store'] = store
+    return store
+
+
+def get_job_manager():
+    """The app's JobManager, created on first use (JOB_WORKERS sets the pool size)."""
+    manager = current_app.extensions.get('job_manager')
+    if manager is None:
+        manager = JobManager(max_workers=current_app.config.get('JOB_WORKERS', 2))
+        current_app.extensions['job_manager'] = manager
+    return manager
+
+
+# What /api/jobs can run, by the payload's kind
+JOB_KINDS = {
+    'optimize': run_optimization,
+    'cross-validate': run_cross_validation,
+    'frontier': run_frontier,
+}
+
+
+@bp.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue a computation in the worker pool.
+
+    kind (one of JOB_KINDS, default 'optimize') picks what runs; the rest
+    of the payload is that endpoint's, e.g. /api/optimize's.
+    """
+    data = request.get_json()
+    kind = data.get('kind', 'optimize')
+    if kind not in JOB_KINDS:
+        return jsonify({'error': f'kind must be one of {", ".join(JOB_KINDS)}'}), 400
+    kwargs = {'cost_model': get_cost_model()} if kind == 'optimize' else {}
+    job_id = get_job_manager().submit(JOB_KINDS[kind], data, stages=OPTIMIZE_STAGES,
+                                      store=get_scenario_store(), **kwargs)
+    return jsonify(get_job_manager().status(job_id)), 202
+
+
+@bp.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """State, progress fraction, stage timings and, once done, the result."""
+    status = get_job_manager().status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status)
+
+
+@bp.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running job."""
+    if not get_job_manager().cancel(job_id):
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(get_job_manager().status(job_id, include_result=False))
@@ -4,8 +4,16 @@
 let assets = [];
 let assetCharts = {};
 let currentAbortController = null;
+let currentJobId = null;
 let optimizationStartTime = null;
 
+// How often to poll a running optimization job (ms)
+const JOB_POLL_INTERVAL = 500;
+
+// Jobs that follow a grid search (cross-validation, frontier), cancelled
+// when another optimization starts
+const followUpJobIds = new Set();
+
 // Fun sci-fi asset names from classic authors
 const sciFiAssetNames = [
     // Hitchhiker's Guide to the Galaxy (Douglas Adams)
@@ -387,6 +395,22 @@ function createHistogram(samples, bins) {
     return { labels, counts };
 }
 
+// Histogram from the server ({edges, counts}) in createHistogram's format
+function serverHistogram(histogram) {
+    const labels = histogram.edges.slice(0, -1).map(edge => (edge * 100).toFixed(0) + '%');
+    return { labels, counts: histogram.counts };
+}
+
+// Portfolio returns sent with returns_format 'base64' as a Float32Array
+function decodeReturns(encoded) {
+    const binary = atob(encoded);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return new Float32Array(bytes.buffer);
+}
+
 function updateSections() {
     // Show correlation section if we have at least 2 assets
     if (assets.length >= 2) {
@@ -515,6 +539,12 @@ function cancelOptimization() {
         currentAbortController.abort();
         currentAbortController = null;
 
+        // Stop the server-side job too, not just our polling
+        if (currentJobId) {
+            cancelJob(currentJobId);
+            currentJobId = null;
+        }
+
         document.getElementById('loading').style.display = 'none';
         document.getElementById('cancel-btn').style.display = 'none';
         document.getElementById('optimize-btn').disabled = false;
@@ -649,29 +679,36 @@ async function runOptimization() {
     const cvarLimit = parseFloat(document.getElementById('cvar-limit').value);
     const nSamples = parseInt(document.getElementById('n-samples').value);
     const step = parseFloat(document.getElementById('grid-step').value);
+    const payload = {
+        assets: assetsData,
+        correlation_matrix: correlationMatrix,
+        asset_bounds: assetBounds,
+        cvar_limit: cvarLimit,
+        n_samples: nSamples,
+        step: step
+    };
+    // The chart only needs the server's histogram, not every return. The
+    // server falls back to continuous optimization when the grid would not
+    // finish within the time budget.
+    const jobPayload = { ...payload, returns_format: 'summary', strategy: 'auto' };
 
-    try {
-        const response = await fetch('/api/optimize', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                assets: assetsData,
-                correlation_matrix: correlationMatrix,
-                asset_bounds: assetBounds,
-                cvar_limit: cvarLimit,
-                n_samples: nSamples,
-                step: step
-            }),
-            signal: currentAbortController.signal
-        });
+    // Results from the previous run are about to be replaced
+    cancelFollowUpJobs();
 
-        const result = await response.json();
+    try {
+        // Queue the optimization as a background job and poll its progress
+        const job = await runJob(jobPayload, status => {
+            currentJobId = status.id;
+            showJobProgress(status);
+        }, currentAbortController.signal);
 
         document.getElementById('loading').style.display = 'none';
         document.getElementById('cancel-btn').style.display = 'none';
         document.getElementById('optimize-btn').disabled = false;
         currentAbortController = null;
+        currentJobId = null;
 
+        const result = job.state === 'done' ? job.result : { error: job.error || `Job ${job.state}` };
         if (result.error) {
             document.getElementById('results-content').innerHTML = `
                 <div class="error-message visible">${result.error}</div>
@@ -679,12 +716,18 @@ async function runOptimization() {
         } else {
             const elapsed = ((Date.now() - optimizationStartTime) / 1000).toFixed(1);
             displayResults(result, elapsed);
+            // Both evaluate the whole grid, so only follow a grid search
+            if (result.strategy === 'grid') {
+                runCrossValidation(payload);
+                runFrontier(payload);
+            }
         }
     } catch (error) {
         document.getElementById('loading').style.display = 'none';
         document.getElementById('cancel-btn').style.display = 'none';
         document.getElementById('optimize-btn').disabled = false;
         currentAbortController = null;
+        currentJobId = null;
 
         if (error.name === 'AbortError') {
             // Already handled by cancelOptimization
@@ -697,6 +740,171 @@ async function runOptimization() {
     }
 }
 
+// Submit a job to /api/jobs and poll it until it finishes. onStatus gets
+// every status while it is queued or running; returns the final status.
+async function runJob(payload, onStatus, signal) {
+    const response = await fetch('/api/jobs', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload),
+        signal
+    });
+    let job = await response.json();
+    if (!response.ok) {
+        return { state: 'failed', error: job.error };
+    }
+
+    while (job.state === 'queued' || job.state === 'running') {
+        onStatus(job);
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+        const poll = await fetch(`/api/jobs/${job.id}`, { signal });
+        job = await poll.json();
+    }
+    return job;
+}
+
+// Run a follow-up job, showing its progress (with a cancel button) in
+// container until it finishes. Returns the job's result, or null if it
+// was cancelled.
+async function runFollowUpJob(payload, container, label) {
+    let jobId = null;
+    let job;
+    try {
+        job = await runJob(payload, status => {
+            if (jobId === null) {
+                jobId = status.id;
+                followUpJobIds.add(jobId);
+                container.innerHTML = `
+                    <span class="follow-up-status"></span>
+                    <button type="button" class="btn btn-danger" onclick="cancelJob('${jobId}')">Cancel</button>
+                `;
+            }
+            container.querySelector('.follow-up-status').textContent = status.state === 'queued'
+                ? `${label}: waiting for a free worker...`
+                : `${label}: ${Math.round(status.progress * 100)}%`;
+        });
+    } catch (error) {
+        job = { state: 'failed', error: error.message };
+    } finally {
+        followUpJobIds.delete(jobId);
+    }
+
+    if (job.state === 'cancelled') {
+        return null;
+    }
+    return job.state === 'done' ? job.result : { error: job.error || `Job ${job.state}` };
+}
+
+function cancelJob(jobId) {
+    fetch(`/api/jobs/${jobId}/cancel`, { method: 'POST' });
+}
+
+function cancelFollowUpJobs() {
+    for (const jobId of followUpJobIds) {
+        cancelJob(jobId);
+    }
+    followUpJobIds.clear();
+}
+
+async function runCrossValidation(payload) {
+    const content = document.getElementById('cross-validation-content');
+    // Evaluates the whole grid once per fold, so it runs as a job
+    const result = await runFollowUpJob({ ...payload, kind: 'cross-validate' }, content,
+                                        'Cross-validation');
+    if (result === null) {
+        content.textContent = 'Cross-validation cancelled.';
+        return;
+    }
+
+    if (result.error) {
+        content.innerHTML = `<div class="error-message visible">${result.error}</div>`;
+        return;
+    }
+    if (result.folds.length === 0) {
+        content.textContent = 'No fold had a feasible portfolio.';
+        return;
+    }
+
+    const pct = v => v === null ? '-' : `${(v * 100).toFixed(2)}%`;
+    const num = v => v === null ? '-' : v.toFixed(3);
+    let html = '<table class="stats-table"><thead><tr><th>Fold</th><th>Train Sharpe</th>' +
+        '<th>Test Sharpe</th><th>Train CVaR</th><th>Test CVaR</th></tr></thead><tbody>';
+    for (const fold of result.folds) {
+        html += `<tr><td>${fold.fold + 1}</td><td>${num(fold.train_sharpe)}</td>` +
+            `<td>${num(fold.test_sharpe)}</td><td class="negative">${pct(fold.train_cvar)}</td>` +
+            `<td class="negative">${pct(fold.test_cvar)}</td></tr>`;
+    }
+    html += '</tbody></table>';
+
+    const degradation = result.sharpe_degradation;
+    const warning = degradation !== null && degradation > 0.1
+        ? '<div class="error-message visible">Significant overfitting: consider more scenarios or a coarser grid.</div>'
+        : '';
+    content.innerHTML = `
+        <div class="metric">
+            <span class="metric-label">Sharpe degradation (train - test)</span>
+            <span class="metric-value">${num(degradation)}</span>
+        </div>
+        ${html}
+        ${warning}
+    `;
+}
+
+async function runFrontier(payload) {
+    const status = document.getElementById('frontier-status');
+    // Evaluates the whole grid at every limit, so it runs as a job
+    const frontierPayload = { ...payload, kind: 'frontier', objective: 'mean', n_points: 30 };
+    const result = await runFollowUpJob(frontierPayload, status, 'Frontier');
+    if (result === null) {
+        status.textContent = 'Frontier cancelled.';
+        return;
+    }
+    status.textContent = '';
+    if (result.error) {
+        console.error('Frontier error:', result.error);
+        return;
+    }
+
+    // One alpha: plot realized CVaR against expected return of each point
+    const points = [];
+    for (let i = 0; i < result.cvar[0].length; i++) {
+        if (result.cvar[0][i] !== null) {
+            points.push({ x: result.cvar[0][i] * 100, y: result.mean[0][i] * 100 });
+        }
+    }
+
+    new Chart(document.getElementById('frontier-chart'), {
+        type: 'scatter',
+        data: {
+            datasets: [{
+                data: points,
+                showLine: true,
+                backgroundColor: 'rgba(52, 152, 219, 0.6)',
+                borderColor: 'rgba(52, 152, 219, 1)'
+            }]
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: { legend: { display: false } },
+            scales: {
+                x: { title: { display: true, text: 'CVaR 5% (%)' } },
+                y: { title: { display: true, text: 'Expected Return (%)' } }
+            }
+        }
+    });
+}
+
+function showJobProgress(job) {
+    const status = document.getElementById('loading-status');
+    if (job.state === 'queued') {
+        status.textContent = 'Waiting for a free worker...';
+    } else {
+        const stage = job.stage ? job.stage.charAt(0).toUpperCase() + job.stage.slice(1) : 'Starting';
+        status.textContent = `${stage}: ${Math.round(job.progress * 100)}% overall`;
+    }
+}
+
 function displayResults(result, elapsedSeconds) {
     const content = document.getElementById('results-content');
 
@@ -744,6 +952,30 @@ function displayResults(result, elapsedSeconds) {
 
     const timeInfo = elapsedSeconds ? `<span class="elapsed-time">Completed in ${elapsedSeconds}s</span>` : '';
 
+    const gridSearch = result.strategy === 'grid';
+    const methodHtml = gridSearch ? `
+                <div class="metric">
+                    <span class="metric-label">Grid Points Evaluated</span>
+                    <span class="metric-value">${result.n_evaluated.toLocaleString()} of ${result.n_exhaustive.toLocaleString()}</span>
+                </div>` : `
+                <div class="metric">
+                    <span class="metric-label">Method</span>
+                    <span class="metric-value">Continuous (grid too large)</span>
+                </div>`;
+    const gridCardsHtml = gridSearch ? `
+        <div class="result-card stats-card" style="margin-top: 20px;">
+            <h3>Out-of-Sample Check</h3>
+            <p class="stats-description">Best portfolio picked on 4/5 of the scenarios, scored on the held-out 1/5</p>
+            <div id="cross-validation-content">Running cross-validation...</div>
+        </div>
+
+        <div class="result-card" style="margin-top: 20px;">
+            <h3>Efficient Frontier</h3>
+            <p class="stats-description">Highest expected return for each CVaR limit (5%)</p>
+            <div id="frontier-status"></div>
+            <canvas id="frontier-chart"></canvas>
+        </div>` : '';
+
     content.innerHTML = `
         <div class="results-grid">
             <div class="result-card">
@@ -769,6 +1001,7 @@ function displayResults(result, elapsedSeconds) {
                     <span class="metric-label">Volatility</span>
                     <span class="metric-value">${(result.std * 100).toFixed(2)}%</span>
                 </div>
+                ${methodHtml}
             </div>
         </div>
 
@@ -784,6 +1017,8 @@ function displayResults(result, elapsedSeconds) {
             ${cvarsHtml}
         </div>
 
+        ${gridCardsHtml}
+
         <div class="result-card" style="margin-top: 20px;">
             <h3>Portfolio Return Distribution</h3>
             <canvas id="return-distribution-chart"></canvas>
@@ -791,7 +1026,15 @@ function displayResults(result, elapsedSeconds) {
     `;
 
     // Draw return distribution chart
-    const histogram = createHistogram(result.portfolio_returns, 50);
+    let histogram;
+    if (result.histogram) {
+        histogram = serverHistogram(result.histogram);
+    } else {
+        const returns = typeof result.portfolio_returns === 'string'
+            ? decodeReturns(result.portfolio_returns)
+            : result.portfolio_returns;
+        histogram = createHistogram(returns, 50);
+    }
 
     new Chart(document.getElementById('return-distribution-chart'), {
         type: 'bar',
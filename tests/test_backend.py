@@ -1,18 +1,66 @@
+import base64
+import queue
+import threading
+import time
+
 import numpy as np
 import pytest
+from scipy import stats
 
 
 from backend import (
     Asset,
+    AssetUniverse,
+    QuantileTable,
+    FactorCorrelation,
     validate_correlation_matrix,
     sample_mixture_of_normals,
     sample_correlated_assets,
+    sample_tail_weighted,
     portfolio_returns,
+    portfolio_moments,
     calculate_cvar,
     calculate_var,
     calculate_sharpe,
+    tail_risk,
+    replicate_estimates,
     optimize_portfolio_grid,
+    optimize_frontier_grid,
+    optimize_portfolio_continuous,
+    cross_validate,
+    cross_validate_grid,
+    ScenarioCache,
+    ScenarioStore,
+    GridResults,
+    generate_scenarios,
+    get_scenarios,
+    sample_replicates,
+)
+from backend.evaluation import (
+    best_feasible_index,
+    evaluate_portfolios,
+    frontier_indices,
+    lazy_best_feasible,
 )
+import backend.risk as risk_module
+from backend.risk import chunked_portfolio_stats
+from backend.optimisation import (
+    _project_to_bounds,
+    _solve_cvar_lp,
+    _refinement_levels,
+    clear_warm_starts,
+    count_weight_grid,
+    generate_weight_grid,
+    iter_weight_grid_chunks,
+    weight_grid_array,
+)
+from backend.ppf import mixture_cdf, mixture_ppf_vectorized
+from backend.costmodel import CostModel, DEFAULT_COEFFICIENTS
+from backend.jobs import JobCancelled, JobManager, _ProgressReporter
+from backend import parallel as parallel_module
+from backend.metrics import METRICS, Metrics, collect, profiled, prometheus_text, timed
+from frontend import create_app
+from frontend.routes import HISTOGRAM_BINS, run_optimization
 
 
 class TestValidation:
@@ -33,6 +81,34 @@ class TestValidation:
         assert is_valid is False
 
 
+class TestFactorCorrelation:
+    def test_validation(self):
+        model = FactorCorrelation([[0.6, 0.3], [0.5, -0.4], [0.0, 0.9]])
+        assert model.validate()[0] is True
+        assert validate_correlation_matrix(model.to_dense())[0] is True
+        assert np.allclose(np.diag(model.to_dense()), 1.0)
+
+        is_valid, msg = validate_correlation_matrix(FactorCorrelation([[0.8, 0.7], [0.1, 0.2]]))
+        assert is_valid is False
+        assert "asset 0" in msg
+        assert validate_correlation_matrix(FactorCorrelation([[0.5], [0.5]], [0.5, 0.5]))[0] is False
+
+    def test_sampling_matches_dense_correlation(self):
+        rng = np.random.default_rng(0)
+        loadings = rng.uniform(-0.5, 0.5, size=(20, 3))
+        model = FactorCorrelation(loadings)
+        assets = [Asset(f"A{i}", [1.0], [0.0], [1.0]) for i in range(20)]
+
+        samples = sample_correlated_assets(assets, model, 50000, rng=np.random.default_rng(1))
+        assert samples.shape == (50000, 20)
+        assert np.allclose(np.corrcoef(samples.T), model.to_dense(), atol=0.03)
+
+        tail_samples, weights = sample_tail_weighted(assets, model, 50000,
+                                                     rng=np.random.default_rng(2))
+        assert tail_samples.shape == (50000, 20)
+        assert abs(weights.mean() - 1) < 0.02
+
+
 class TestAsset:
     def test_create_asset(self):
         asset = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
@@ -65,6 +141,256 @@ class TestSampling:
         samples = sample_correlated_assets([stock, bond], corr, 100)
         assert samples.shape == (100, 2)
 
+    def test_table_sampling_matches_exact(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+        np.random.seed(42)
+        table = sample_correlated_assets([stock, bond], corr, 200, ppf_method='table')
+        np.random.seed(42)
+        exact = sample_correlated_assets([stock, bond], corr, 200, ppf_method='exact')
+        assert np.allclose(table, exact, atol=1e-5)
+
+    def test_universe_matches_asset_list(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+        universe = AssetUniverse([stock, bond], corr)
+
+        assert universe.weights.shape == (2, 2)
+        assert universe.weights[1, 1] == 0
+        assert np.allclose(universe.expected_returns, [stock.expected_return(), bond.expected_return()])
+        assert np.allclose(universe.volatilities, [stock.volatility(), bond.volatility()])
+
+        direct = sample_correlated_assets([stock, bond], corr, 500, rng=np.random.default_rng(4))
+        assert np.array_equal(universe.sample(500, np.random.default_rng(4)), direct)
+        assert np.array_equal(sample_correlated_assets(universe, None, 500,
+                                                       rng=np.random.default_rng(4)), direct)
+
+        by_list = optimize_portfolio_grid([stock, bond], corr, n_samples=500, step=0.1,
+                                          cvar_limit=-0.30, seed=6, use_cache=False)
+        by_universe = optimize_portfolio_grid(universe, None, n_samples=500, step=0.1,
+                                              cvar_limit=-0.30, seed=6, use_cache=False)
+        assert np.array_equal(by_list['scenarios'], by_universe['scenarios'])
+        assert np.array_equal(by_list['optimal_weights'], by_universe['optimal_weights'])
+
+    def test_generator_streams(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+        first = sample_correlated_assets([stock, bond], corr, 100, rng=np.random.default_rng(5))
+        second = sample_correlated_assets([stock, bond], corr, 100, rng=np.random.default_rng(5))
+        assert np.array_equal(first, second)
+        assert np.array_equal(stock.sample(50, rng=np.random.default_rng(1)),
+                              stock.sample(50, rng=np.random.default_rng(1)))
+
+    def test_sobol_replicates(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+        first = sample_correlated_assets([stock, bond], corr, 256, rng=np.random.default_rng(2),
+                                         sampler='sobol')
+        second = sample_correlated_assets([stock, bond], corr, 256, rng=np.random.default_rng(2),
+                                          sampler='sobol')
+        assert np.array_equal(first, second)
+        with pytest.raises(ValueError):
+            sample_correlated_assets([stock, bond], corr, 256, sampler='halton')
+
+        sobol = sample_replicates([stock, bond], corr, 1024, 8, seed=3)
+        assert sobol.shape == (8, 1024, 2)
+        assert not np.array_equal(sobol[0], sobol[1])
+        sobol_estimates = replicate_estimates([0.6, 0.4], sobol)
+        random_estimates = replicate_estimates(
+            [0.6, 0.4], sample_replicates([stock, bond], corr, 1024, 8, seed=3, sampler='random'))
+        # Exact mean 0.6 * 0.08 + 0.4 * 0.04
+        assert np.isclose(sobol_estimates['mean'], 0.064, atol=1e-4)
+        assert sobol_estimates['cvar_stderr'] < random_estimates['cvar_stderr'] / 4
+        assert sobol_estimates['sharpe_stderr'] < random_estimates['sharpe_stderr'] / 4
+
+    def test_tail_weighted_sampling(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+        weights = np.array([0.6, 0.4])
+
+        samples, ratios = sample_tail_weighted([stock, bond], corr, 200_000, tail_shift=1.5,
+                                               rng=np.random.default_rng(0))
+        assert ratios.max() <= 2.0 and np.isclose(ratios.mean(), 1.0, atol=0.01)
+        # The shifted half of the scenarios puts far more than 5% in the tail
+        reference = sample_correlated_assets([stock, bond], corr, 200_000, rng=np.random.default_rng(1))
+        threshold = calculate_var(reference @ weights, 0.05)
+        assert np.mean(samples @ weights <= threshold) > 0.15
+        assert np.isclose(calculate_cvar(samples @ weights, 0.05, scenario_weights=ratios),
+                          calculate_cvar(reference @ weights, 0.05), atol=2e-3)
+        assert np.isclose(portfolio_moments(samples @ weights, scenario_weights=ratios)[0], 0.064,
+                          atol=1e-3)
+
+        def cvar_spread(tail_shift):
+            estimates = []
+            for seed in range(40):
+                rng = np.random.default_rng(seed)
+                if tail_shift is None:
+                    returns, ratios = sample_correlated_assets([stock, bond], corr, 2000, rng=rng), None
+                else:
+                    returns, ratios = sample_tail_weighted([stock, bond], corr, 2000, tail_shift, rng=rng)
+                estimates.append(calculate_cvar(returns @ weights, 0.05, scenario_weights=ratios))
+            return np.std(estimates)
+
+        assert cvar_spread(1.5) < 0.8 * cvar_spread(None)
+
+    def test_block_streams_independent_of_workers(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+        np.random.seed(0)
+        state = np.random.get_state()[1].copy()
+
+        serial = generate_scenarios([stock, bond], corr, 2500, seed=9, block_rows=300)
+        threaded = generate_scenarios([stock, bond], corr, 2500, seed=9, block_rows=300, n_workers=3)
+        assert np.array_equal(serial, threaded)
+        # Each block is its own stream, so a block can be drawn on its own
+        fourth = sample_correlated_assets([stock, bond], corr, 300,
+                                          rng=np.random.default_rng(np.random.SeedSequence(9).spawn(9)[3]))
+        assert np.array_equal(serial[900:1200], fourth)
+        # The global random state is left alone
+        assert np.array_equal(np.random.get_state()[1], state)
+
+
+class TestExactPPF:
+    def test_matches_brentq(self):
+        from scipy.optimize import brentq
+        weights, means, stds = np.array([0.8, 0.2]), np.array([0.15, -0.20]), np.array([0.12, 0.25])
+        q = np.array([1e-10, 0.001, 0.05, 0.3, 0.5, 0.9, 0.999, 1 - 1e-10])
+        expected = [brentq(lambda x: mixture_cdf(x, weights, means, stds) - qi, -5, 5) for qi in q]
+        assert np.allclose(mixture_ppf_vectorized(q, weights, means, stds), expected, atol=1e-9)
+
+    def test_inverts_cdf_for_bimodal_mixture(self):
+        weights, means, stds = np.array([0.5, 0.5]), np.array([-0.1, 0.2]), np.array([0.01, 0.01])
+        q = np.random.default_rng(0).random(5000)
+        x = mixture_ppf_vectorized(q, weights, means, stds)
+        assert x.shape == q.shape
+        assert np.allclose(mixture_cdf(x, weights, means, stds), q, atol=1e-9)
+
+    def test_padded_parameters_solve_every_column_at_once(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        gold = Asset("Gold", [0.5, 0.3, 0.2], [0.05, 0.2, -0.3], [0.1, 0.05, 0.2])
+        universe = AssetUniverse([stock, bond, gold], np.eye(3))
+        q = np.random.default_rng(1).random((1000, 3))
+
+        batched = mixture_ppf_vectorized(q, universe.weights, universe.means, universe.stds)
+        for i, asset in enumerate(universe):
+            column = mixture_ppf_vectorized(q[:, i], asset.weights, asset.means, asset.stds)
+            assert np.allclose(batched[:, i], column, rtol=0, atol=1e-10)
+            assert np.allclose(mixture_cdf(batched[:, i], asset.weights, asset.means, asset.stds),
+                               q[:, i], atol=1e-9)
+
+
+class TestQuantileTable:
+    def test_error_bound_in_tails(self):
+        table = QuantileTable([0.8, 0.2], [0.15, -0.20], [0.12, 0.25], tol=1e-6)
+        assert table.max_error <= 1e-6
+        z = np.linspace(-6.3, 6.3, 2001)
+        assert np.max(np.abs(table.ppf_from_normal(z) - table.exact_from_normal(z))) <= 1e-6
+
+    def test_single_component_is_exact(self):
+        table = QuantileTable([1.0], [0.04], [0.03])
+        q = np.array([0.001, 0.05, 0.5, 0.95, 0.999])
+        assert np.allclose(table.ppf(q), 0.04 + 0.03 * stats.norm.ppf(q))
+
+    def test_asset_caches_table(self):
+        asset = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        assert asset.quantile_table() is asset.quantile_table()
+
+
+class TestScenarioCache:
+    def test_lru_eviction_by_bytes(self):
+        cache = ScenarioCache(max_bytes=2 * 800)
+        for key in 'abc':
+            cache.put(key, np.zeros(100))
+        assert 'a' not in cache and len(cache) == 2
+        cache.get('b')
+        cache.put('d', np.zeros(100))
+        assert 'b' in cache and 'c' not in cache
+        assert cache.nbytes == 1600
+
+    def test_seeded_scenarios_are_reused(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        cache = ScenarioCache()
+
+        first = get_scenarios([stock, bond], [[1.0, -0.3], [-0.3, 1.0]], 200, seed=7, cache=cache)
+        # Equal inputs in a different container type hit the same entry
+        same = get_scenarios([Asset("S", (0.8, 0.2), (0.15, -0.2), (0.12, 0.25)), bond],
+                             np.array([[1.0, -0.3], [-0.3, 1.0]]), 200, seed=7, cache=cache)
+        assert same is first
+        assert cache.hits == 1 and cache.misses == 1
+        assert not first.flags.writeable
+
+        fresh = get_scenarios([stock, bond], [[1.0, -0.3], [-0.3, 1.0]], 200, seed=7, cache=cache,
+                              use_cache=False)
+        assert fresh is not first and np.array_equal(fresh, first)
+
+
+class TestScenarioStore:
+    def test_store_roundtrip_and_grid_search(self, tmp_path):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+        store = ScenarioStore(str(tmp_path))
+
+        stored = get_scenarios([stock, bond], corr, 3000, seed=11, store=store, block_rows=700)
+        in_memory = get_scenarios([stock, bond], corr, 3000, seed=11, use_cache=False,
+                                  block_rows=700)
+        assert isinstance(stored, np.memmap)
+        assert np.array_equal(stored, in_memory)
+        assert len(list(tmp_path.iterdir())) == 1
+
+        on_disk = optimize_portfolio_grid([stock, bond], corr, n_samples=3000, step=0.1,
+                                          cvar_limit=-0.30, seed=11, store=store)
+        in_ram = optimize_portfolio_grid([stock, bond], corr, n_samples=3000, step=0.1,
+                                         cvar_limit=-0.30, seed=11, use_cache=False)
+        assert np.allclose(on_disk['optimal_weights'], in_ram['optimal_weights'])
+        assert np.isclose(on_disk['optimal_cvar'], in_ram['optimal_cvar'])
+
+    def test_chunked_stats_match_in_memory(self):
+        np.random.seed(42)
+        samples = np.random.normal(0.05, 0.15, (5001, 3))
+        weights = np.random.dirichlet(np.ones(3), size=4)
+        stats = chunked_portfolio_stats(weights, samples, [0.05, 0.25], chunk_rows=333)
+        port_ret = samples @ weights.T
+        var, cvar = tail_risk(port_ret, [0.05, 0.25])
+        assert np.allclose(stats['var'], var)
+        assert np.allclose(stats['cvar'], cvar)
+        assert np.allclose(stats['std'], port_ret.std(axis=0))
+
+        # Products split into sub-blocks of portfolios give the same statistics
+        blocked = chunked_portfolio_stats(weights, samples, [0.05, 0.25], chunk_rows=333,
+                                          block_size=3)
+        for key in ('mean', 'std', 'var', 'cvar'):
+            assert np.allclose(blocked[key], stats[key], rtol=0, atol=1e-14)
+
+    def test_memory_mapped_evaluation_passes_scale_with_tails(self, tmp_path, monkeypatch):
+        np.random.seed(42)
+        path = tmp_path / 'scenarios.npy'
+        np.save(path, np.random.normal(0.05, 0.15, (20000, 3)))
+        samples = np.load(path, mmap_mode='r')
+        weights = np.random.dirichlet(np.ones(3), size=200)
+
+        chunks = []
+        original = risk_module.iter_row_chunks
+        monkeypatch.setattr(risk_module, 'iter_row_chunks',
+                            lambda *args: chunks.append(1) or original(*args))
+        streamed = evaluate_portfolios(samples, weights, 0.05, memory_budget=2**20,
+                                       chunk_rows=4000)
+        in_memory = evaluate_portfolios(np.asarray(samples), weights, 0.05)
+
+        # The 1002 retained returns per portfolio fit 130 portfolios in 1 MB:
+        # two passes over the file rather than one per 13 portfolios
+        assert len(chunks) == 2
+        for key in ('mean', 'std', 'cvar', 'sharpe'):
+            assert np.allclose(streamed[key], in_memory[key])
+
 
 class TestRisk:
     def test_cvar_worse_than_var(self):
@@ -74,11 +400,74 @@ class TestRisk:
         var = calculate_var(returns, 0.05)
         assert cvar < var  # CVaR is always worse (more negative)
 
+    def test_tail_risk_matches_single_level_metrics(self):
+        np.random.seed(42)
+        returns = np.random.normal(0.05, 0.15, 1001)
+        alphas = [0.01, 0.05, 0.25, 0.5]
+        var, cvar = tail_risk(returns, alphas)
+        assert np.allclose(var, np.percentile(returns, np.array(alphas) * 100))
+        assert np.allclose(cvar, [np.sort(returns)[:int(1001 * a)].mean() for a in alphas])
+
+    def test_tail_risk_column_batch(self):
+        np.random.seed(42)
+        batch = np.random.normal(0.05, 0.15, (500, 4))
+        var, cvar = tail_risk(batch, [0.05, 0.1])
+        assert var.shape == cvar.shape == (2, 4)
+        for j in range(4):
+            assert np.isclose(cvar[1, j], calculate_cvar(batch[:, j], 0.1))
+            assert np.isclose(var[0, j], calculate_var(batch[:, j], 0.05))
+
     def test_sharpe_positive_for_positive_returns(self):
         returns = np.array([0.05, 0.10, 0.15, 0.08, 0.12])
         sharpe = calculate_sharpe(returns)
         assert sharpe > 0
 
+    def test_weighted_metrics_match_repeated_scenarios(self):
+        rng = np.random.default_rng(4)
+        returns = rng.normal(0.05, 0.15, (400, 3))
+        counts = rng.integers(1, 4, 400)
+        repeated = np.repeat(returns, counts, axis=0)
+
+        # Integer weights act like repeated scenarios
+        mean, std = portfolio_moments(returns, scenario_weights=counts)
+        assert np.allclose(mean, repeated.mean(axis=0)) and np.allclose(std, repeated.std(axis=0))
+        assert np.isclose(calculate_sharpe(returns[:, 0], scenario_weights=counts),
+                          calculate_sharpe(repeated[:, 0]))
+        _, cvar = tail_risk(returns, [0.05, 0.2], scenario_weights=counts)
+        assert np.allclose(cvar, tail_risk(repeated, [0.05, 0.2])[1], atol=2e-3)
+
+        # Uniform weights reproduce the unweighted worst-k average
+        uniform = np.ones(400)
+        assert np.isclose(calculate_cvar(returns[:, 1], 0.05, scenario_weights=uniform),
+                          calculate_cvar(returns[:, 1], 0.05))
+        assert calculate_var(returns[:, 1], 0.05, scenario_weights=uniform) == np.sort(returns[:, 1])[19]
+
+
+class TestWeightGrid:
+    def test_count_matches_stars_and_bars(self):
+        from math import comb
+        assert count_weight_grid(5, 0.01) == comb(104, 4)
+        assert len(list(generate_weight_grid(4, 0.05))) == comb(23, 3)
+
+    def test_bounded_grid(self):
+        bounds = [(0.1, 0.5), (0.0, 1.0), (0.2, 0.3), (0.0, 0.6)]
+        grid = weight_grid_array(4, 0.1, bounds)
+        assert len(grid) == count_weight_grid(4, 0.1, bounds)
+        assert np.allclose(grid.sum(axis=1), 1.0)
+        for i, (lo, hi) in enumerate(bounds):
+            assert np.all(grid[:, i] >= lo - 1e-9) and np.all(grid[:, i] <= hi + 1e-9)
+        assert len(np.unique(grid, axis=0)) == len(grid)
+
+    def test_chunks_concatenate_to_full_grid(self):
+        chunks = list(iter_weight_grid_chunks(4, 0.05, chunk_size=500))
+        assert all(len(c) <= 500 for c in chunks)
+        assert np.array_equal(np.concatenate(chunks), weight_grid_array(4, 0.05))
+
+    def test_infeasible_bounds_give_empty_grid(self):
+        bounds = [(0.6, 1.0), (0.6, 1.0)]
+        assert count_weight_grid(2, 0.1, bounds) == 0
+        assert weight_grid_array(2, 0.1, bounds).shape == (0, 2)
+
 
 class TestOptimization:
     def test_grid_search_finds_solution(self):
@@ -137,6 +526,657 @@ class TestOptimization:
         weights = result['optimal_weights']
         assert weights[1] >= 0.3 - 1e-9, f"Bond weight {weights[1]} should be >= 0.3"
 
+    def test_lp_matches_slsqp_when_unconstrained(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+
+        np.random.seed(42)
+        slsqp = optimize_portfolio_continuous([stock, bond], corr, n_samples=2000, cvar_limit=-0.30)
+        np.random.seed(42)
+        lp = optimize_portfolio_continuous([stock, bond], corr, n_samples=2000, cvar_limit=-0.30,
+                                           method='lp')
+
+        assert np.isclose(sum(lp['optimal_weights']), 1.0)
+        assert lp['optimal_sharpe'] == pytest.approx(slsqp['optimal_sharpe'], abs=0.01)
+
+    def test_lp_enforces_cvar_limit(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, 0.2], [0.2, 1.0]]
+        bounds = [(0.2, 1.0), (0.0, 1.0)]
+
+        np.random.seed(42)
+        result = optimize_portfolio_continuous([stock, bond], corr, n_samples=2000, cvar_limit=-0.10,
+                                               asset_bounds=bounds, method='lp')
+        assert result['optimal_cvar'] >= -0.10 - 1e-9
+        assert result['optimal_weights'][0] >= 0.2 - 1e-9
+
+        # At least 20% stocks can never keep CVaR above -2%
+        np.random.seed(42)
+        result = optimize_portfolio_continuous([stock, bond], corr, n_samples=2000, cvar_limit=-0.02,
+                                               asset_bounds=bounds, method='lp')
+        assert result['optimal_weights'] is None
+
+    def test_lp_falls_back_without_positive_means(self):
+        # Bear market: no portfolio has a positive mean, which the LP cannot express
+        stock = Asset("Stock", [0.8, 0.2], [-0.02, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [-0.01], [0.03])
+        corr = [[1.0, 0.2], [0.2, 1.0]]
+
+        result = optimize_portfolio_continuous([stock, bond], corr, n_samples=2000, cvar_limit=-0.30,
+                                               seed=6, method='lp')
+        assert result['method'] == 'slsqp'
+        assert result['optimal_weights'] is not None
+        assert result['optimal_cvar'] >= -0.30 - 1e-6
+        slsqp = optimize_portfolio_continuous([stock, bond], corr, n_samples=2000, cvar_limit=-0.30,
+                                              seed=6)
+        assert result['optimal_sharpe'] == pytest.approx(slsqp['optimal_sharpe'])
+
+        # Still infeasible when even the fallback cannot meet the limit
+        result = optimize_portfolio_continuous([stock, bond], corr, n_samples=2000, cvar_limit=-0.01,
+                                               seed=6, method='lp')
+        assert result['optimal_weights'] is None
+
+    def test_lp_reports_unconverged_cuts(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        samples = sample_correlated_assets([stock, bond], [[1.0, 0.2], [0.2, 1.0]], 2000,
+                                           rng=np.random.default_rng(0))
+        bounds = [(0, 1), (0, 1)]
+
+        with pytest.warns(RuntimeWarning, match='CVaR LP cuts'):
+            weights, result = _solve_cvar_lp(samples, -0.10, 0.05, bounds, max_iter=1)
+        assert weights is not None and not result['converged']
+
+        weights, result = _solve_cvar_lp(samples, -0.10, 0.05, bounds)
+        assert result['converged'] and result['positive_mean']
+
+    def test_importance_sampled_optimizers(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        gold = Asset("Gold", [1.0], [0.05], [0.15])
+        corr = [[1.0, -0.3, 0.1], [-0.3, 1.0, 0.0], [0.1, 0.0, 1.0]]
+        kwargs = dict(n_samples=2000, step=0.05, cvar_limit=-0.08, seed=4, tail_shift=1.5)
+
+        exhaustive = optimize_portfolio_grid([stock, bond, gold], corr, **kwargs)
+        moments = optimize_portfolio_grid([stock, bond, gold], corr, search='moments', **kwargs)
+        ratios = exhaustive['scenario_weights']
+        assert ratios.shape == (2000,)
+        assert np.array_equal(exhaustive['optimal_weights'], moments['optimal_weights'])
+        assert exhaustive['optimal_cvar'] >= -0.08
+        port_ret = exhaustive['scenarios'] @ exhaustive['optimal_weights']
+        assert exhaustive['optimal_cvar'] == pytest.approx(
+            calculate_cvar(port_ret, 0.05, scenario_weights=ratios))
+
+        for method in ('slsqp', 'lp'):
+            result = optimize_portfolio_continuous([stock, bond, gold], corr, n_samples=2000,
+                                                   cvar_limit=-0.08, seed=4, tail_shift=1.5,
+                                                   method=method)
+            assert np.array_equal(result['scenario_weights'], ratios)
+            assert result['optimal_cvar'] >= -0.08 - 1e-6
+            assert result['optimal_sharpe'] >= exhaustive['optimal_sharpe'] - 0.02
+
+    def test_parallel_grid_matches_single_process(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        gold = Asset("Gold", [1.0], [0.05], [0.15])
+        corr = [[1.0, -0.3, 0.1], [-0.3, 1.0, 0.0], [0.1, 0.0, 1.0]]
+
+        # A small memory budget splits the grid into many chunks
+        kwargs = dict(n_samples=1000, step=0.05, cvar_limit=-0.10, seed=7, memory_budget=50_000)
+        serial = optimize_portfolio_grid([stock, bond, gold], corr, **kwargs)
+        parallel = optimize_portfolio_grid([stock, bond, gold], corr, n_workers=2, **kwargs)
+
+        assert np.array_equal(serial['optimal_weights'], parallel['optimal_weights'])
+        assert serial['optimal_sharpe'] == parallel['optimal_sharpe']
+        for a, b in zip(serial['all_results'], parallel['all_results']):
+            assert (a['sharpe'], a['cvar'], a['feasible']) == (b['sharpe'], b['cvar'], b['feasible'])
+
+        # Later calls reuse the same warm workers
+        pool = parallel_module._POOLS[2]
+        again = optimize_portfolio_grid([stock, bond, gold], corr, n_workers=2, **kwargs)
+        assert parallel_module._POOLS[2] is pool
+        assert again['optimal_sharpe'] == parallel['optimal_sharpe']
+
+    def test_multi_start_continuous(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        gold = Asset("Gold", [1.0], [0.05], [0.15])
+        corr = [[1.0, -0.3, 0.1], [-0.3, 1.0, 0.0], [0.1, 0.0, 1.0]]
+        kwargs = dict(n_samples=2000, cvar_limit=-0.08, seed=11)
+
+        clear_warm_starts()
+        single = optimize_portfolio_continuous([stock, bond, gold], corr, **kwargs)
+        assert [s['source'] for s in single['starts']] == ['equal']
+
+        clear_warm_starts()
+        serial = optimize_portfolio_continuous([stock, bond, gold], corr, n_starts=4, **kwargs)
+        assert [s['source'] for s in serial['starts']] == ['grid', 'equal', 'dirichlet', 'dirichlet']
+        assert serial['optimal_cvar'] >= -0.08 - 1e-6
+        assert serial['optimal_sharpe'] >= single['optimal_sharpe'] - 1e-9
+        assert serial['optimal_sharpe'] == max(s['sharpe'] for s in serial['starts'] if s['feasible'])
+        assert all(s['nfev'] > 0 for s in serial['starts'])
+
+        clear_warm_starts()
+        events = []
+        parallel = optimize_portfolio_continuous([stock, bond, gold], corr, n_starts=4,
+                                                 n_workers=2, progress=lambda *e: events.append(e),
+                                                 **kwargs)
+        assert np.array_equal(serial['optimal_weights'], parallel['optimal_weights'])
+        assert [e for e in events if e[0] == 'evaluation'] == [('evaluation', done / 4)
+                                                               for done in range(1, 5)]
+
+        # The next solve for the same inputs, at any CVaR limit, starts from it
+        again = optimize_portfolio_continuous([stock, bond, gold], corr, n_starts=4,
+                                              **dict(kwargs, cvar_limit=-0.09))
+        assert again['starts'][0]['source'] == 'previous'
+        assert again['optimal_sharpe'] >= serial['optimal_sharpe'] - 1e-9
+
+    def test_multi_start_progress_cancels(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+
+        def cancel(stage, fraction):
+            if stage == 'evaluation':
+                raise JobCancelled('job')
+
+        for n_workers in (1, 2):
+            with pytest.raises(JobCancelled):
+                optimize_portfolio_continuous([stock, bond], corr, n_samples=1000, cvar_limit=-0.10,
+                                              n_starts=3, n_workers=n_workers, progress=cancel)
+
+    def test_continuous_job_reports_sampling_and_iterations(self):
+        data = {'assets': [{'name': 'Stock', 'weights': [0.8, 0.2], 'means': [0.15, -0.20],
+                            'stds': [0.12, 0.25]},
+                           {'name': 'Bond', 'weights': [1.0], 'means': [0.04], 'stds': [0.03]}],
+                'correlation_matrix': [[1.0, -0.3], [-0.3, 1.0]], 'n_samples': 1000,
+                'cvar_limit': -0.30, 'strategy': 'continuous', 'returns_format': 'summary'}
+
+        events = []
+        assert 'sharpe' in run_optimization(data, progress=lambda *e: events.append(e))
+        stages = [stage for stage, _ in events]
+        assert stages[0] == 'sampling' and stages[-1] == 'evaluation'
+        # SLSQP iterations report before the single start completes
+        assert events.count(('evaluation', 0.0)) > 0 and events[-1] == ('evaluation', 1.0)
+
+        # So a cancel lands inside the solve, not only between starts
+        def cancel(stage, fraction):
+            if stage == 'evaluation':
+                raise JobCancelled('job')
+
+        with pytest.raises(JobCancelled):
+            run_optimization(data, progress=cancel)
+
+    def test_project_to_bounds(self):
+        rng = np.random.default_rng(1)
+        lo, hi = np.array([0.1, 0.0, 0.2]), np.array([0.5, 0.3, 1.0])
+        projected = _project_to_bounds(rng.normal(size=(50, 3)), lo, hi)
+        np.testing.assert_allclose(projected.sum(axis=1), 1.0, atol=1e-12)
+        assert np.all(projected >= lo) and np.all(projected <= hi)
+
+    def test_frontier_indices_match_best_feasible(self):
+        rng = np.random.default_rng(0)
+        metrics = {'sharpe': np.round(rng.normal(size=200), 1), 'cvar': np.round(rng.normal(size=200), 1)}
+        metrics['sharpe'][::17] = np.nan
+        limits = np.append(rng.normal(size=20), [-np.inf, np.inf])
+
+        indices = frontier_indices(metrics, limits)
+        for limit, index in zip(limits, indices):
+            best = best_feasible_index(metrics, limit)
+            assert index == (-1 if best is None else best)
+
+    def test_frontier_matches_grid_search_per_limit(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        gold = Asset("Gold", [1.0], [0.05], [0.15])
+        corr = [[1.0, -0.3, 0.1], [-0.3, 1.0, 0.0], [0.1, 0.0, 1.0]]
+        limits = [-0.30, -0.10, -0.03, 0.5]
+
+        frontier = optimize_frontier_grid([stock, bond, gold], corr, cvar_limits=limits,
+                                          cvar_alphas=[0.05, 0.10], n_samples=1000, step=0.1, seed=3)
+        assert frontier['weights'].shape == (2, 4, 3)
+
+        for i, alpha in enumerate([0.05, 0.10]):
+            for j, limit in enumerate(limits):
+                result = optimize_portfolio_grid([stock, bond, gold], corr, n_samples=1000, step=0.1,
+                                                 seed=3, cvar_limit=limit, cvar_alpha=alpha)
+                if result['optimal_weights'] is None:
+                    assert frontier['index'][i, j] == -1
+                    assert np.all(np.isnan(frontier['weights'][i, j]))
+                else:
+                    assert np.array_equal(frontier['weights'][i, j], result['optimal_weights'])
+                    assert frontier['sharpe'][i, j] == result['optimal_sharpe']
+                    assert frontier['cvar'][i, j] == result['optimal_cvar']
+
+    def test_moment_search_matches_exhaustive(self):
+        rng = np.random.default_rng(1)
+        # The highest-Sharpe asset has a crash tail, so tight limits push
+        # the answer far down the Sharpe ranking
+        crash = rng.random(4000) < 0.05
+        samples = np.column_stack([
+            np.where(crash, rng.normal(-0.4, 0.1, 4000), rng.normal(0.12, 0.05, 4000)),
+            rng.normal(0.03, 0.05, 4000),
+            rng.normal(0.06, 0.12, 4000),
+            rng.normal(0.05, 0.08, 4000),
+        ])
+        grid = weight_grid_array(4, 0.05)
+        metrics = evaluate_portfolios(samples, grid)
+
+        for limit in np.append(np.quantile(metrics['cvar'], [0.01, 0.5, 0.95, 0.999]), 1.0):
+            best, evaluated, lazy_metrics = lazy_best_feasible(samples, grid, limit)
+            assert best == best_feasible_index(metrics, limit)
+            assert np.array_equal(lazy_metrics['cvar'], metrics['cvar'][evaluated])
+        # An infeasible limit ends up evaluating everything once
+        assert np.array_equal(np.sort(evaluated), np.arange(len(grid)))
+
+    def test_grid_search_moment_mode(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+
+        kwargs = dict(n_samples=2000, step=0.05, cvar_limit=-0.05, seed=11)
+        exhaustive = optimize_portfolio_grid([stock, bond], corr, **kwargs)
+        lazy = optimize_portfolio_grid([stock, bond], corr, search='moments', **kwargs)
+
+        assert np.array_equal(lazy['optimal_weights'], exhaustive['optimal_weights'])
+        assert lazy['optimal_cvar'] == exhaustive['optimal_cvar']
+        assert lazy['n_evaluated'] <= exhaustive['n_evaluated'] == 21
+
+    def test_adaptive_grid_search(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        gold = Asset("Gold", [1.0], [0.05], [0.15])
+        corr = [[1.0, -0.3, 0.1], [-0.3, 1.0, 0.0], [0.1, 0.0, 1.0]]
+
+        # A small coarse grid forces several refinement levels: 10, 20, 40 units
+        assert _refinement_levels(3, 40, coarse_points=100) == [10, 20, 40]
+        for cvar_limit in (-0.30, -0.05):
+            result = optimize_portfolio_grid([stock, bond, gold], corr, n_samples=2000, step=0.025,
+                                             cvar_limit=cvar_limit, seed=2, search='adaptive',
+                                             coarse_points=100, verify=True)
+            assert result['verification']['matches']
+            assert result['n_exhaustive'] == count_weight_grid(3, 0.025) == 861
+            assert result['n_evaluated'] < result['n_exhaustive']
+            assert result['optimal_cvar'] >= cvar_limit
+
+    def test_adaptive_grid_search_with_narrow_bounds(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        gold = Asset("Gold", [1.0], [0.05], [0.15])
+        corr = [[1.0, -0.3, 0.1], [-0.3, 1.0, 0.0], [0.1, 0.0, 1.0]]
+
+        # Coarse grids with no point inside narrow bounds are never searched
+        for low, high in ((0.41, 0.43), (0.13, 0.17), (0.33, 0.35)):
+            bounds = [(low, high), (0, 1), (0, 1)]
+            for coarse_points in (5, 20):
+                levels = _refinement_levels(3, 100, bounds, coarse_points)
+                assert count_weight_grid(3, 1 / levels[0], bounds) > 0
+                kwargs = dict(n_samples=2000, step=0.01, cvar_limit=-0.30, seed=2,
+                              asset_bounds=bounds)
+                exhaustive = optimize_portfolio_grid([stock, bond, gold], corr, **kwargs)
+                adaptive = optimize_portfolio_grid([stock, bond, gold], corr, search='adaptive',
+                                                   coarse_points=coarse_points, **kwargs)
+                assert exhaustive['optimal_weights'] is not None
+                assert adaptive['optimal_weights'] is not None
+                assert adaptive['optimal_sharpe'] == pytest.approx(exhaustive['optimal_sharpe'],
+                                                                   abs=1e-3)
+
+    def test_batched_evaluation_matches_per_portfolio(self):
+        np.random.seed(42)
+        samples = np.random.normal(0.05, 0.15, (1000, 3))
+        weights = np.random.dirichlet(np.ones(3), size=50)
+
+        # A tiny budget forces many blocks
+        metrics = evaluate_portfolios(samples, weights, 0.05, memory_budget=50_000)
+
+        for i, w in enumerate(weights):
+            port_ret = portfolio_returns(w, samples)
+            assert np.isclose(metrics['cvar'][i], calculate_cvar(port_ret, 0.05))
+            assert np.isclose(metrics['sharpe'][i], calculate_sharpe(port_ret))
+            assert np.isclose(metrics['std'][i], port_ret.std())
+
+    def test_float32_scenarios_match_float64(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        gold = Asset("Gold", [0.9, 0.1], [0.05, -0.10], [0.15, 0.30])
+        corr = [[1.0, -0.3, 0.1], [-0.3, 1.0, 0.0], [0.1, 0.0, 1.0]]
+        options = dict(n_samples=4000, step=0.05, cvar_limit=-0.10, seed=8, use_cache=False)
+
+        double = optimize_portfolio_grid([stock, bond, gold], corr, **options)
+        single = optimize_portfolio_grid([stock, bond, gold], corr, dtype='float32', **options)
+        assert single['scenarios'].dtype == np.float32
+        assert np.array_equal(single['scenarios'], double['scenarios'].astype(np.float32))
+        assert np.array_equal(single['optimal_weights'], double['optimal_weights'])
+
+        # Error bounds of evaluate_portfolios, with R = max |return|
+        bound = 4 * 2.0**-24 * np.abs(double['scenarios']).max()
+        for name in ('mean', 'cvar'):
+            assert np.allclose(getattr(single['all_results'], name),
+                               getattr(double['all_results'], name), rtol=0, atol=bound)
+        assert np.allclose(single['all_results'].std, double['all_results'].std,
+                           rtol=0, atol=2 * bound)
+        assert abs(single['optimal_sharpe'] - double['optimal_sharpe']) < 1e-5
+
+        moments = optimize_portfolio_grid([stock, bond, gold], corr, dtype='float32',
+                                          search='moments', **options)
+        assert np.array_equal(moments['optimal_weights'], single['optimal_weights'])
+
+
+class TestGridResults:
+    def make_results(self):
+        weights = weight_grid_array(3, 0.25)
+        sharpe = np.array([0.5, 1.2, np.nan, 0.9, 1.2, 0.1, 0.7, 1.5, 0.3, 0.8, 1.1, 0.2, 0.6, 1.0, 0.4])
+        cvar = -np.linspace(0.01, 0.29, len(weights))
+        return GridResults(weights, sharpe, cvar, cvar / 2, sharpe / 10, np.full(len(weights), 0.1),
+                           cvar >= -0.2)
+
+    def test_row_view_matches_columns(self):
+        results = self.make_results()
+        row = results[3]
+        assert set(row) == {'weights', 'sharpe', 'cvar', 'var', 'mean', 'std', 'feasible'}
+        assert np.array_equal(row['weights'], results.weights[3])
+        assert row['sharpe'] == results.sharpe[3]
+        assert [r['cvar'] for r in results] == list(results.cvar)
+
+    def test_slicing_is_zero_copy(self):
+        results = self.make_results()
+        window = results[2:6]
+        assert len(window) == 4
+        assert np.shares_memory(window.sharpe, results.sharpe)
+        assert np.shares_memory(window.weights, results.weights)
+
+    def test_filter_and_top_k(self):
+        results = self.make_results()
+        assert len(results.filter(results.feasible)) == np.count_nonzero(results.cvar >= -0.2)
+
+        # Feasible points only by default; ties go to the earlier point
+        top = results.top_k(3)
+        assert list(top.sharpe) == [1.5, 1.2, 1.2]
+        assert np.array_equal(top.weights, results.weights[[7, 1, 4]])
+        assert list(results.top_k(2, by='cvar', feasible_only=False).cvar) == list(results.cvar[:2])
+        assert len(results.top_k(100)) == np.count_nonzero(results.feasible & ~np.isnan(results.sharpe))
+
+    def test_records(self):
+        records = self.make_results().to_records()
+        assert records.shape == (15,)
+        assert records['weights'].shape == (15, 3)
+        assert records['feasible'].dtype == bool
+
+
+class TestCostModel:
+    def test_fit_recovers_coefficients(self):
+        truth = CostModel({'sampling': [1e-3, 2e-8], 'enumeration': [5e-9],
+                           'evaluation': [1e-9, 3e-9], 'continuous': [4e-8]})
+        records = []
+        for n_assets in (2, 4, 6):
+            for n_samples in (1000, 20000):
+                for stage, n_points in (('sampling', 0), ('continuous', 0),
+                                        ('enumeration', 5000 * n_assets),
+                                        ('evaluation', 3000 * n_assets ** 2)):
+                    records.append({'stage': stage, 'n_assets': n_assets, 'n_samples': n_samples,
+                                    'n_points': n_points,
+                                    'seconds': truth.predict(stage, n_assets, n_samples, n_points)})
+        fitted = CostModel.fit(records)
+        for stage, values in truth.coefficients.items():
+            assert np.allclose(fitted.coefficients[stage], values, rtol=1e-6)
+
+        # Stages without records keep the defaults
+        partial = CostModel.fit([r for r in records if r['stage'] == 'sampling'])
+        assert partial.coefficients['evaluation'] == DEFAULT_COEFFICIENTS['evaluation']
+
+    def test_strategy_follows_grid_size_and_budget(self, tmp_path):
+        model = CostModel()
+        assert model.choose_strategy(3, 0.05, 5000) == 'grid'
+        assert model.choose_strategy(12, 0.01, 20000, time_budget=10) == 'continuous'
+        assert model.choose_strategy(12, 0.01, 20000, time_budget=1e12) == 'grid'
+        assert model.predict_grid(4, 0.02, 5000) > model.predict_grid(4, 0.05, 5000)
+
+        # Exhaustively this grid takes about a minute, but the moments
+        # search the route runs settles in well under a second
+        assert model.choose_strategy(4, 0.01, 20000) == 'continuous'
+        assert model.choose_strategy(4, 0.01, 20000, search='moments') == 'grid'
+        assert model.predict_grid(4, 0.01, 20000, search='moments') < 1
+        assert model.predict_grid(4, 0.01, 20000, search='adaptive') < model.predict_grid(
+            4, 0.01, 20000)
+        assert model.predict_continuous(4, 20000, n_starts=8) > 8 * model.predict(
+            'continuous', 4, 20000)
+
+        model.save(tmp_path / 'model.json')
+        assert CostModel.load(tmp_path / 'model.json').coefficients == model.coefficients
+
+    def test_auto_strategy_prices_the_search_it_runs(self):
+        assets = [{'name': name, 'weights': [1.0], 'means': [mean], 'stds': [std]}
+                  for name, mean, std in (('A', 0.08, 0.15), ('B', 0.04, 0.03),
+                                          ('C', 0.05, 0.15), ('D', 0.06, 0.10))]
+        data = {'assets': assets, 'correlation_matrix': np.eye(4).tolist(), 'step': 0.01,
+                'n_samples': 20000, 'cvar_limit': -0.30, 'strategy': 'auto',
+                'returns_format': 'summary'}
+        response = run_optimization(data)
+        assert response['strategy'] == 'grid'
+        assert response['n_evaluated'] < response['n_exhaustive'] == count_weight_grid(4, 0.01)
+
+
+class TestCrossValidation:
+    def test_folds_match_direct_evaluation(self):
+        rng = np.random.default_rng(3)
+        samples = rng.normal([0.06, 0.03, 0.08], [0.15, 0.04, 0.25], size=(1003, 3))
+        grid = weight_grid_array(3, 0.1)
+
+        result = cross_validate_grid(samples, grid, n_folds=5, cvar_limit=-0.15)
+
+        fold_size = len(samples) // 5
+        assert len(result['fold_results']) == 5
+        for fold in result['fold_results']:
+            test = np.zeros(len(samples), dtype=bool)
+            test[fold['fold'] * fold_size:(fold['fold'] + 1) * fold_size] = True
+
+            # Best feasible grid point on the training scenarios, the slow way
+            train_metrics = [(calculate_sharpe(portfolio_returns(w, samples[~test])),
+                              calculate_cvar(portfolio_returns(w, samples[~test]))) for w in grid]
+            best = max((sharpe, -i) for i, (sharpe, cvar) in enumerate(train_metrics)
+                       if cvar >= -0.15)
+            assert np.array_equal(fold['weights'], grid[-best[1]])
+
+            test_ret = portfolio_returns(fold['weights'], samples[test])
+            assert np.isclose(fold['train_sharpe'], best[0])
+            assert np.isclose(fold['test_sharpe'], calculate_sharpe(test_ret))
+            assert np.isclose(fold['test_cvar'], calculate_cvar(test_ret))
+
+    def test_parallel_matches_single_process(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+
+        serial = cross_validate([stock, bond], corr, n_samples=2000, cvar_limit=-0.15, step=0.05,
+                                seed=5, memory_budget=100_000)
+        parallel = cross_validate([stock, bond], corr, n_samples=2000, cvar_limit=-0.15, step=0.05,
+                                  seed=5, memory_budget=100_000, n_workers=2)
+        assert serial['mean_test_sharpe'] == parallel['mean_test_sharpe']
+        assert np.array_equal(serial['weight_stability'], parallel['weight_stability'])
+
+
+class TestJobs:
+    def test_progress_reporter_throttles_and_cancels(self):
+        events, cancel = queue.Queue(), threading.Event()
+        progress = _ProgressReporter('job', events, cancel)
+
+        for i in range(1001):
+            progress('evaluation', i / 1000)
+        assert 100 <= events.qsize() <= 102
+
+        cancel.set()
+        with pytest.raises(JobCancelled):
+            progress('evaluation', 1.0)
+
+    def test_job_runs_to_completion(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+
+        manager = JobManager(max_workers=1)
+        try:
+            job_id = manager.submit(optimize_portfolio_grid, [stock, bond], corr,
+                                    n_samples=500, step=0.1, cvar_limit=-0.30, seed=1,
+                                    stages=['sampling', 'evaluation'])
+            deadline = time.time() + 60
+            while manager.status(job_id)['state'] in ('queued', 'running') and time.time() < deadline:
+                time.sleep(0.05)
+            status = manager.status(job_id)
+        finally:
+            manager.shutdown()
+
+        assert status['state'] == 'done'
+        assert status['progress'] == 1.0
+        assert np.isclose(sum(status['result']['optimal_weights']), 1.0)
+        assert manager.status('unknown') is None
+
+    def test_follow_up_requests_share_job_scenarios_through_the_store(self, tmp_path):
+        app = create_app()
+        app.config.update(SCENARIO_DIR=str(tmp_path), JOB_WORKERS=1)
+        client = app.test_client()
+        data = {'assets': [{'name': 'Stock', 'weights': [0.8, 0.2], 'means': [0.15, -0.20],
+                            'stds': [0.12, 0.25]},
+                           {'name': 'Bond', 'weights': [1.0], 'means': [0.04], 'stds': [0.03]}],
+                'correlation_matrix': [[1.0, -0.3], [-0.3, 1.0]], 'n_samples': 1000,
+                'step': 0.1, 'cvar_limit': -0.30, 'returns_format': 'summary'}
+
+        try:
+            job_id = client.post('/api/jobs', json=data).get_json()['id']
+            deadline = time.time() + 60
+            while time.time() < deadline:
+                status = client.get(f'/api/jobs/{job_id}').get_json()
+                if status['state'] not in ('queued', 'running'):
+                    break
+                time.sleep(0.05)
+        finally:
+            app.extensions['job_manager'].shutdown()
+        assert status['state'] == 'done'
+        assert len(list(tmp_path.glob('*.npy'))) == 1
+
+        # The web process opens the file the worker wrote instead of resampling
+        before = METRICS.snapshot()['counters']
+        assert 'folds' in client.post('/api/cross-validate', json=data).get_json()
+        assert 'sharpe' in client.post('/api/frontier', json=data).get_json()
+        after = METRICS.snapshot()['counters']
+        assert after.get('scenario_cache_hits', 0) - before.get('scenario_cache_hits', 0) == 2
+        assert after.get('scenario_cache_misses', 0) == before.get('scenario_cache_misses', 0)
+        assert len(list(tmp_path.glob('*.npy'))) == 1
+
+    def test_follow_ups_run_as_jobs(self):
+        app = create_app()
+        app.config.update(JOB_WORKERS=1)
+        client = app.test_client()
+        data = {'assets': [{'name': 'Stock', 'weights': [0.8, 0.2], 'means': [0.15, -0.20],
+                            'stds': [0.12, 0.25]},
+                           {'name': 'Bond', 'weights': [1.0], 'means': [0.04], 'stds': [0.03]}],
+                'correlation_matrix': [[1.0, -0.3], [-0.3, 1.0]], 'n_samples': 1000,
+                'step': 0.1, 'cvar_limit': -0.30, 'seed': 3}
+
+        response = client.post('/api/jobs', json=dict(data, kind='backtest'))
+        assert response.status_code == 400
+        assert 'kind' in response.get_json()['error']
+
+        results = {}
+        try:
+            for kind in ('cross-validate', 'frontier'):
+                job_id = client.post('/api/jobs', json=dict(data, kind=kind)).get_json()['id']
+                deadline = time.time() + 60
+                while time.time() < deadline:
+                    status = client.get(f'/api/jobs/{job_id}').get_json()
+                    if status['state'] not in ('queued', 'running'):
+                        break
+                    time.sleep(0.05)
+                assert status['state'] == 'done'
+                results[kind] = status['result']
+        finally:
+            app.extensions['job_manager'].shutdown()
+        assert results['cross-validate'] == client.post('/api/cross-validate', json=data).get_json()
+        assert results['frontier'] == client.post('/api/frontier', json=data).get_json()
+
+
+class TestMetrics:
+    def test_collect_gathers_stages_and_counters(self):
+        stock = Asset("Stock", [0.8, 0.2], [0.15, -0.20], [0.12, 0.25])
+        bond = Asset("Bond", [1.0], [0.04], [0.03])
+        corr = [[1.0, -0.3], [-0.3, 1.0]]
+
+        with collect() as metrics:
+            optimize_portfolio_grid([stock, bond], corr, n_samples=1000, step=0.1,
+                                    cvar_limit=-0.30, seed=3, use_cache=False)
+        snapshot = metrics.snapshot()
+        assert {'sampling', 'cholesky', 'ppf', 'enumeration', 'evaluation'} <= set(snapshot['stages'])
+        assert snapshot['counters']['scenarios'] == 1000
+        assert snapshot['counters']['root_finds'] > 0  # building the quantile tables
+        assert snapshot['counters']['grid_points'] == 11
+
+        # Collectors only see their own block
+        with collect() as outer:
+            with timed('outer'):
+                pass
+        assert 'outer' not in metrics.snapshot()['stages']
+        assert outer.snapshot()['stages']['outer']['calls'] == 1
+
+    def test_prometheus_text_and_profile(self, tmp_path):
+        metrics = Metrics()
+        metrics.observe('evaluation', 0.5)
+        metrics.inc('grid_points', 11)
+        text = prometheus_text(metrics, gauges={'scenario_cache_bytes': 80})
+        assert 'optimizer_stage_seconds_total{stage="evaluation"} 0.5' in text
+        assert 'optimizer_stage_calls_total{stage="evaluation"} 1' in text
+        assert 'optimizer_grid_points_total 11' in text
+        assert 'optimizer_scenario_cache_bytes 80' in text
+
+        path = tmp_path / 'request.prof'
+        with profiled(str(path)):
+            sum(range(1000))
+        assert path.stat().st_size > 0
+
+
+class TestRoutes:
+    PAYLOAD = {
+        'assets': [{'name': 'Stock', 'weights': [0.8, 0.2], 'means': [0.15, -0.20],
+                    'stds': [0.12, 0.25]},
+                   {'name': 'Bond', 'weights': [1.0], 'means': [0.04], 'stds': [0.03]}],
+        'correlation_matrix': [[1.0, -0.3], [-0.3, 1.0]],
+        'n_samples': 2000,
+        'step': 0.1,
+        'cvar_limit': -0.30,
+    }
+
+    def optimize(self, **options):
+        client = create_app().test_client()
+        return client.post('/api/optimize', json=dict(self.PAYLOAD, **options)).get_json()
+
+    def test_returns_formats_agree(self):
+        listed = self.optimize(returns_format='list')
+        encoded = self.optimize(returns_format='base64')
+        summary = self.optimize(returns_format='summary')
+
+        returns = np.array(listed['portfolio_returns'])
+        assert len(returns) == 2000
+        assert encoded['returns_dtype'] == 'float32'
+        decoded = np.frombuffer(base64.b64decode(encoded['portfolio_returns']), dtype='<f4')
+        assert np.array_equal(decoded, returns.astype(np.float32))
+
+        assert 'portfolio_returns' not in summary
+        assert summary['optimal_weights'] == listed['optimal_weights']
+        for response in (listed, encoded, summary):
+            assert response['histogram'] == listed['histogram']
+
+        # Every return falls in one of the bins spanning their range
+        histogram = listed['histogram']
+        assert len(histogram['edges']) == HISTOGRAM_BINS + 1
+        assert len(histogram['counts']) == HISTOGRAM_BINS
+        assert sum(histogram['counts']) == len(returns)
+        assert histogram['edges'][0] == returns.min() and histogram['edges'][-1] == returns.max()
+        assert histogram['counts'] == np.histogram(returns, bins=HISTOGRAM_BINS)[0].tolist()
+
+    def test_rejects_unknown_returns_format(self):
+        response = self.optimize(returns_format='csv')
+        assert response == {'error': 'returns_format must be one of list, base64, summary'}
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file